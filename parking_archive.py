@@ -0,0 +1,579 @@
+import argparse
+import bisect
+import gzip
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from parking_history import HISTORY_SORT_KEYS, HistoryQueries, HistoryStats, MemoryHistory
+from parking_jobs import BackgroundJob
+from parking_records import VEHICLE_TYPE_LIST, VehicleType, day_end, day_of, day_start
+from parking_storage import write_atomic
+
+ARCHIVE_DIR = "parking_archive"
+MANIFEST_NAME = "manifest.json"
+# Names the archive writes: month partitions and plate summaries under a
+# generation number, and their temp files. Nothing else in the directory is
+# ever removed.
+ARCHIVE_FILE = re.compile(r"(?:\d{4}-\d{2}|plates)\.\d+\.json\.gz(?:\.tmp)?|manifest\.json\.tmp")
+# Decoded partitions (months) kept in memory for paging and filtered counts
+ARCHIVE_CACHED_PARTITIONS = 12
+ARCHIVE_COMPRESS_LEVEL = 6
+# How often a long-running process moves newly expired sessions
+ARCHIVE_INTERVAL = 3600
+DAY = 86400
+TYPE_CODES = {vtype.value: code for code, vtype in enumerate(VEHICLE_TYPE_LIST)}
+
+# Merge order for sorts other than exit time, ties in exit order
+SORT_VALUES = {
+    "entry": lambda record: (record.entry_ts, record.exit_ts),
+    "vehicle": lambda record: (record.vehicle, record.exit_ts),
+    "type": lambda record: (record.type.value, record.exit_ts),
+    "owner": lambda record: (record.owner, record.exit_ts),
+    "duration": lambda record: (record.duration, record.exit_ts),
+    "fee": lambda record: (record.fee, record.exit_ts),
+}
+
+
+def month_of(day):
+    return day[:7]
+
+
+def retention_cutoff(days, now=None):
+    # Start of the oldest day kept hot: sessions that ended before it are
+    # archived
+    now = int(time.time()) if now is None else now
+    return day_start(day_of(now - days * DAY))
+
+
+def read_partition(path):
+    # A partition is one gzip'd JSON object of session columns, which
+    # decodes far faster than a record per line
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        columns = json.load(f)
+    columns["type"] = [TYPE_CODES[name] for name in columns["type"]]
+    return MemoryHistory.from_columns(columns)
+
+
+def partition_text(history):
+    columns = history.columns()
+    return json.dumps({
+        "vehicle": columns["vehicle"],
+        "owner": columns["owner"],
+        "type": [VEHICLE_TYPE_LIST[code].value for code in columns["type"]],
+        "entry_ts": columns["entry_ts"].tolist(),
+        "exit_ts": columns["exit_ts"].tolist(),
+        "duration": columns["duration"].tolist(),
+        "fee": columns["fee"].tolist()
+    }, separators=(",", ":"))
+
+
+def write_gzip(path, lines):
+    # Same crash guarantees as write_atomic, for a compressed file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=ARCHIVE_COMPRESS_LEVEL, mtime=0) as f:
+            for line in lines:
+                f.write(line.encode("utf-8") + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+
+
+def partition_meta(history, file):
+    # What the manifest keeps per partition, enough to answer unfiltered
+    # counts and the dashboard aggregates without opening the file
+    stats = history.stats
+    exit_ts = history.exit_ts
+    return {
+        "file": file,
+        "count": len(history),
+        "first_ts": exit_ts[0],
+        "last_ts": exit_ts[-1],
+        "duration": stats.duration,
+        "days": {day: [stats.sessions_by_day[day], revenue] for day, revenue in stats.revenue_by_day.items()},
+        "types": {vtype.value: count for vtype, count in stats.type_counts.items()}
+    }
+
+
+class ArchivePartition:
+    # One month of archived sessions, read on demand. Counts without a plate
+    # or type filter come straight from the manifest.
+    def __init__(self, archive, month, meta):
+        self.archive = archive
+        self.month = month
+        self.meta = meta
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def history(self, cache=True):
+        return self.archive.load(self.meta["file"], cache)
+
+    def count(self, plate=None, vtype=None, start_day=None, end_day=None):
+        if not plate:
+            if not vtype:
+                return sum(sessions for day, (sessions, _) in self.meta["days"].items()
+                           if (not start_day or day >= start_day) and (not end_day or day <= end_day))
+            if not start_day and not end_day:
+                return self.meta["types"].get(str(vtype), 0)
+        return self.history().count(plate=plate, vtype=vtype, start_day=start_day, end_day=end_day)
+
+    def page(self, offset, limit, sort="exit", descending=True, **filters):
+        return self.history().page(offset, limit, sort, descending, **filters)
+
+    def columns(self, start_day=None, end_day=None):
+        return self.history(cache=False).columns(start_day, end_day)
+
+
+class HistoryArchive:
+    # Closed sessions moved out of the hot history, one gzip'd JSON object
+    # of session columns per month of exit time. manifest.json is the commit point: it
+    # lists the live partition files with their per-day and per-type
+    # totals, the archive cutoff (every session that ended before it is
+    # here) and a plate summary file used to prune partitions for plate
+    # queries. Files are written under a new generation number and only
+    # become part of the archive when the manifest naming them is written,
+    # so a crash leaves either the old archive or the new one.
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.cutoff = 0
+        self.generation = 0
+        self.partitions = {}
+        self.plates_file = None
+        self.superseded = []
+        self._plates = None
+        self._plate_list = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, MANIFEST_NAME))
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            self.cutoff = manifest["cutoff"]
+            self.generation = manifest["generation"]
+            self.partitions = manifest["partitions"]
+            self.plates_file = manifest["plates_file"]
+        # Files of uncommitted or superseded generations
+        live = {meta["file"] for meta in self.partitions.values()} | {self.plates_file}
+        for name in self._own_files():
+            if name not in live:
+                os.remove(self._path(name))
+        return self
+
+    def _own_files(self):
+        return [name for name in os.listdir(self.directory)
+                if ARCHIVE_FILE.fullmatch(name) and os.path.isfile(self._path(name))]
+
+    def __len__(self):
+        return sum(meta["count"] for meta in self.partitions.values())
+
+    def stats(self):
+        stats = HistoryStats()
+        day_rows = []
+        type_counts = {}
+        duration = 0.0
+        for meta in self.partitions.values():
+            duration += meta["duration"]
+            day_rows += [(day, sessions, revenue) for day, (sessions, revenue) in meta["days"].items()]
+            for vtype, count in meta["types"].items():
+                type_counts[vtype] = type_counts.get(vtype, 0) + count
+        stats.load_totals(duration, day_rows, [(VehicleType(vtype), count) for vtype, count in type_counts.items()])
+        return stats
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self, file, cache=True):
+        with self._lock:
+            history = self._cache.get(file)
+            if history is not None:
+                self._cache.move_to_end(file)
+                return history
+        history = read_partition(self._path(file))
+        if cache:
+            with self._lock:
+                self._cache[file] = history
+                while len(self._cache) > ARCHIVE_CACHED_PARTITIONS:
+                    self._cache.popitem(last=False)
+        return history
+
+    def plates(self):
+        # plate -> [sessions, first exit, last exit] over the whole archive
+        with self._lock:
+            if self._plates is None:
+                plates = {}
+                if self.plates_file:
+                    with gzip.open(self._path(self.plates_file), "rt", encoding="utf-8") as f:
+                        plates = json.load(f)
+                self._plates = plates
+                self._plate_list = sorted(plates)
+            return self._plates
+
+    def plate_span(self, plate, exact=False):
+        # (first, last) exit time over the archived plates equal to or
+        # starting with `plate`, or None if there are none
+        plates = self.plates()
+        if exact:
+            entry = plates.get(plate)
+            return (entry[1], entry[2]) if entry else None
+        names = self._plate_list
+        first = last = None
+        for index in range(bisect.bisect_left(names, plate), len(names)):
+            name = names[index]
+            if not name.startswith(plate):
+                break
+            _, seen_first, seen_last = plates[name]
+            first = seen_first if first is None else min(first, seen_first)
+            last = seen_last if last is None else max(last, seen_last)
+        return None if first is None else (first, last)
+
+    def select(self, start_day=None, end_day=None, plate=None, exact=False):
+        # Partitions that can hold matching sessions, oldest first; the rest
+        # are pruned using the manifest and the plate summary alone
+        if not self.partitions:
+            return []
+        lo, hi = None, None
+        if plate:
+            span = self.plate_span(plate, exact)
+            if span is None:
+                return []
+            lo, hi = span
+        selected = []
+        for month in sorted(self.partitions):
+            if start_day and month < month_of(start_day) or end_day and month > month_of(end_day):
+                continue
+            meta = self.partitions[month]
+            if lo is not None and (meta["last_ts"] < lo or meta["first_ts"] > hi):
+                continue
+            selected.append(ArchivePartition(self, month, meta))
+        return selected
+
+    def write(self, columns):
+        # Write the partitions and plate summary that archiving `columns`
+        # (a MemoryHistory.columns() layout, in exit order) produces, under
+        # the next generation. Nothing is live until commit().
+        generation = self.generation + 1
+        vehicles, exits = columns["vehicle"], columns["exit_ts"]
+        # Rows come in exit order, so each month is one run of them
+        months = []
+        start = end = 0
+        for index in range(len(exits)):
+            ts = exits[index]
+            if not start <= ts < end:
+                day = day_of(ts)
+                start, end = day_start(day), day_end(day)
+                if not months or months[-1][0] != month_of(day):
+                    months.append((month_of(day), index))
+        bounds = [(month, lo, hi) for (month, lo), (_, hi) in zip(months, months[1:] + [(None, len(exits))])]
+
+        partitions = {}
+        written = []
+        plates = dict(self.plates())
+        try:
+            for month, lo, hi in bounds:
+                old = self.partitions.get(month)
+                history = read_partition(self._path(old["file"])) if old is not None else MemoryHistory()
+                history.extend_columns({name: column[lo:hi] for name, column in columns.items()})
+                for index in range(lo, hi):
+                    plate, ts = vehicles[index], exits[index]
+                    entry = plates.get(plate)
+                    if entry is None:
+                        plates[plate] = [1, ts, ts]
+                    else:
+                        plates[plate] = [entry[0] + 1, min(entry[1], ts), max(entry[2], ts)]
+                file = f"{month}.{generation}.json.gz"
+                write_gzip(self._path(file), [partition_text(history)])
+                written.append(file)
+                partitions[month] = partition_meta(history, file)
+            plates_file = f"plates.{generation}.json.gz"
+            write_gzip(self._path(plates_file), [json.dumps(plates, separators=(",", ":"))])
+            written.append(plates_file)
+        except BaseException:
+            self.discard({"files": written})
+            raise
+        return {"generation": generation, "partitions": partitions, "plates_file": plates_file,
+                "plates": plates, "files": written}
+
+    def discard(self, pending):
+        for file in pending["files"]:
+            try:
+                os.remove(self._path(file))
+            except FileNotFoundError:
+                pass
+
+    def commit(self, pending, cutoff):
+        # Make a write() live. Files it replaces are removed one commit
+        # later, so readers still paging through them are not cut off.
+        partitions = dict(self.partitions)
+        superseded = [self.plates_file] if self.plates_file else []
+        for month, meta in pending["partitions"].items():
+            if month in partitions:
+                superseded.append(partitions[month]["file"])
+            partitions[month] = meta
+        manifest = {"cutoff": max(cutoff, self.cutoff), "generation": pending["generation"],
+                    "partitions": partitions, "plates_file": pending["plates_file"]}
+        write_atomic(self.manifest_path, json.dumps(manifest, separators=(",", ":")))
+        for file in self.superseded:
+            try:
+                os.remove(self._path(file))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.cutoff = manifest["cutoff"]
+            self.generation = manifest["generation"]
+            self.partitions = partitions
+            self.plates_file = manifest["plates_file"]
+            self.superseded = superseded
+            self._plates = pending["plates"]
+            self._plate_list = sorted(self._plates)
+
+    def clear(self):
+        # The manifest goes first, so a crash part way leaves no archive
+        # rather than one naming missing files
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        for name in self._own_files():
+            os.remove(self._path(name))
+        with self._lock:
+            self.cutoff = 0
+            self.generation = 0
+            self.partitions = {}
+            self.plates_file = None
+            self.superseded = []
+            self._plates = None
+            self._plate_list = None
+            self._cache.clear()
+
+    def attach(self, engine):
+        # Serve the engine's history through this archive. Hot sessions the
+        # archive already holds (a crash between the manifest and the hot
+        # store being trimmed) are dropped here; the storage backend sheds
+        # its copy the next time it prunes or rewrites.
+        hot = engine.history
+        if self.cutoff:
+            hot.drop_before(self.cutoff)
+        engine.history = TieredHistory(hot, self)
+        return engine.history
+
+
+class TieredHistory(HistoryQueries):
+    # The hot history (in memory or SQLite) in front of the archive, with
+    # the same query methods as either. Aggregates cover both tiers and are
+    # kept in memory. Row queries go to the hot tier plus the archive
+    # partitions whose dates, and for plate filters whose plates, can match.
+    # Sorting by anything but exit time merges sorted pages from every
+    # selected partition, so it reads each of them.
+    def __init__(self, hot, archive, stats=None):
+        self.hot = hot
+        self.archive = archive
+        if stats is None:
+            stats = archive.stats()
+            stats.merge(hot.stats)
+        self.stats = stats
+
+    def __len__(self):
+        return self.stats.count
+
+    def __iter__(self):
+        for partition in self.archive.select():
+            yield from partition.history(cache=False)
+        yield from self.hot
+
+    def open_reader(self):
+        if not hasattr(self.hot, "open_reader"):
+            return self
+        reader = self.hot.open_reader()
+        return self if reader is self.hot else TieredHistory(reader, self.archive, self.stats)
+
+    def close(self):
+        self.hot.close()
+
+    def append(self, record):
+        self.hot.append(record)
+        self.stats.add(record)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def prepend(self, older):
+        # Older hot sessions streamed in after startup; any the archive
+        # already holds are left out
+        if self.archive.cutoff:
+            older.drop_before(self.archive.cutoff)
+        self.hot.prepend(older)
+        self.stats.merge(older.stats)
+
+    def clear(self):
+        self.hot.clear()
+        self.archive.clear()
+        self.stats.clear()
+
+    def retire(self, cutoff):
+        # Drop the hot sessions that ended before `cutoff` once the archive
+        # holds them; the aggregates already count them
+        return self.hot.drop_before(cutoff)
+
+    def _sources(self, plate=None, vtype=None, start_day=None, end_day=None):
+        return self.archive.select(start_day, end_day, plate) + [self.hot]
+
+    def recent(self, limit):
+        records = self.hot.recent(limit)
+        for partition in reversed(self.archive.select()):
+            if len(records) >= limit:
+                break
+            records += partition.history().recent(limit - len(records))
+        return records
+
+    def find_by_plate(self, vehicle_num):
+        records = []
+        for partition in self.archive.select(plate=vehicle_num, exact=True):
+            records += partition.history().find_by_plate(vehicle_num)
+        return records + self.hot.find_by_plate(vehicle_num)
+
+    def cursor(self):
+        return self.hot.cursor()
+
+    def plate_counts(self, after=None, upto=None):
+        # Cursors are positions in the hot tier; everything archived comes
+        # before the first of them
+        if after is not None:
+            return self.hot.plate_counts(after, upto)
+        counts = {plate: (sessions, last) for plate, (sessions, _, last) in self.archive.plates().items()}
+        for plate, sessions, last in self.hot.plate_counts(upto=upto):
+            if plate in counts:
+                sessions += counts[plate][0]
+            counts[plate] = (sessions, last)
+        return [(plate, sessions, last) for plate, (sessions, last) in counts.items()]
+
+    def columns(self, start_day=None, end_day=None):
+        parts = [partition.columns(start_day, end_day) for partition in self.archive.select(start_day, end_day)]
+        hot = self.hot.columns(start_day, end_day)
+        if not parts:
+            return hot
+        columns = {name: column[:] for name, column in parts[0].items()}
+        for part in parts[1:] + [hot]:
+            for name, column in part.items():
+                columns[name] += column
+        return columns
+
+    def count(self, **filters):
+        return sum(source.count(**filters) for source in self._sources(**filters))
+
+    def page(self, offset, limit, sort="exit", descending=True, **filters):
+        if sort not in HISTORY_SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sort}")
+        sources = self._sources(**filters)
+        if sort != "exit":
+            pages = [source.page(0, offset + limit, sort, descending, **filters) for source in sources]
+            merged = heapq.merge(*pages, key=SORT_VALUES[sort], reverse=descending)
+            return list(islice(merged, offset, offset + limit))
+
+        # Tiers do not overlap in time, so exit order is their concatenation
+        if descending:
+            sources.reverse()
+        records = []
+        for source in sources:
+            if len(records) >= limit:
+                break
+            count = source.count(**filters)
+            if offset >= count:
+                offset -= count
+                continue
+            records += source.page(offset, limit - len(records), "exit", descending, **filters)
+            offset = 0
+        return records
+
+
+class ArchiveJob(BackgroundJob):
+    # Moves the hot sessions that ended before `cutoff` into the archive.
+    # The partitions are written on a background thread from a reader of
+    # the hot tier; install(engine, storage) commits them, trims the hot
+    # tier and lets the storage backend drop its copy, and returns how many
+    # sessions moved. install() must run on the thread that owns the
+    # engine, after any history warmup has been installed.
+    name = "history-archive"
+
+    def __init__(self, engine, cutoff):
+        super().__init__()
+        history = engine.history
+        self.archive = history.archive
+        self.cutoff = max(cutoff, self.archive.cutoff)
+        self.end_day = day_of(self.cutoff - 1)
+        hot = history.hot
+        self.count = hot.count(end_day=self.end_day)
+        self.reader = hot.open_reader() if self.count and hasattr(hot, "open_reader") else hot
+        self.hot = hot
+        self.pending = None
+
+    def work(self):
+        if self.count:
+            self.pending = self.archive.write(self.reader.columns(end_day=self.end_day))
+
+    def finish(self):
+        if self.reader is not self.hot:
+            self.reader.close()
+
+    def discard(self):
+        if self.pending is not None:
+            self.archive.discard(self.pending)
+        return 0
+
+    def apply(self, engine, storage):
+        if self.pending is None:
+            return 0
+        history = engine.history
+        if history.hot is not self.hot or self.hot.count(end_day=self.end_day) != self.count:
+            # Changed underneath us; the next run starts over
+            return self.discard()
+        self.archive.commit(self.pending, self.cutoff)
+        history.retire(self.cutoff)
+        storage.prune_history(engine)
+        return self.count
+
+
+def archive_dir(data_dir=None):
+    return os.path.join(data_dir, ARCHIVE_DIR) if data_dir else ARCHIVE_DIR
+
+
+def attach_archive(engine, directory, retention_days=None):
+    # The engine's history served across the archive in `directory`, if
+    # one exists or retention is on; otherwise the history is left alone
+    if retention_days is None and not HistoryArchive.exists(directory):
+        return None
+    return HistoryArchive(directory).open().attach(engine)
+
+
+def main():
+    from parking_cli import add_lot_arguments, open_lot
+
+    parser = argparse.ArgumentParser(description="Archive parking sessions older than a retention period")
+    add_lot_arguments(parser)
+    parser.add_argument("--days", type=int, required=True, help="keep sessions of the last DAYS days hot")
+    args = parser.parse_args()
+
+    engine, storage = open_lot(args, retention_days=args.days)
+    try:
+        history = engine.history
+        started = time.perf_counter()
+        moved = ArchiveJob(engine, retention_cutoff(args.days, engine.now())).run_now(engine, storage)
+    finally:
+        storage.close(engine)
+    print(f"Archived {moved} sessions in {time.perf_counter() - started:.2f} s; "
+          f"{len(history.hot)} hot, {len(history.archive)} archived in {len(history.archive.partitions)} partitions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import time
+from parking_cli import add_lot_arguments, open_lot
+from parking_engine import ParkingError
+
+# Operations per batch when replaying a gate log
+REPLAY_BATCH = 10000
+
+
+def read_operations(path):
+    # Gate log: one JSON operation per line, see ParkingEngine.run_batch
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay(engine, storage, operations, batch_size=REPLAY_BATCH):
+    # (applied, failed); each batch is stored and flushed as one unit
+    applied = failed = 0
+    chunk = []
+    for operation in operations:
+        chunk.append(operation)
+        if len(chunk) >= batch_size:
+            ok, bad = apply_chunk(engine, storage, chunk)
+            applied, failed, chunk = applied + ok, failed + bad, []
+    if chunk:
+        ok, bad = apply_chunk(engine, storage, chunk)
+        applied, failed = applied + ok, failed + bad
+    return applied, failed
+
+
+def apply_chunk(engine, storage, operations):
+    results = engine.run_batch(operations)
+    storage.flush()
+    storage.save(engine)
+    failed = sum(1 for result in results if isinstance(result, ParkingError))
+    return len(results) - failed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply parking operations in bulk")
+    add_lot_arguments(parser)
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="apply a JSON-lines gate log")
+    replay_parser.add_argument("log")
+    replay_parser.add_argument("--batch", type=int, default=REPLAY_BATCH, help="operations per batch")
+    import_parser = commands.add_parser("import", help="merge a legacy parking_data.json file")
+    import_parser.add_argument("file")
+    commands.add_parser("checkout", help="check out every parked vehicle")
+    args = parser.parse_args()
+
+    options = {"sync_each_event": False} if args.storage == "journal" else {}
+    engine, storage = open_lot(args, options)
+    engine.subscribe(storage.record)
+    started = time.perf_counter()
+    try:
+        if args.command == "replay":
+            applied, failed = replay(engine, storage, read_operations(args.log), args.batch)
+            print(f"Applied {applied} operations, {failed} failed")
+        elif args.command == "import":
+            with open(args.file, "r") as f:
+                summary = engine.import_dict(json.load(f))
+            storage.flush()
+            storage.save(engine)
+            print(f"Parked {summary['parked']} ({summary['moved']} moved), "
+                  f"{summary['reservations']} reservations, {summary['sessions']} sessions "
+                  f"({summary['sessions_skipped']} older sessions skipped)")
+            if summary["skipped"]:
+                print(f"Skipped vehicles: {', '.join(summary['skipped'])}")
+        else:
+            results = engine.remove_many()
+            storage.flush()
+            storage.save(engine)
+            fees = sum(result.fee for result in results if not isinstance(result, ParkingError))
+            print(f"Checked out {len(results)} vehicles, ₹{fees:.2f} in fees")
+    finally:
+        storage.close(engine)
+    print(f"Done in {time.perf_counter() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from parking_engine import ParkingEngine, VEHICLE_TYPES
+from parking_history import MemoryHistory
+from parking_records import SessionRecord, day_of
+from parking_storage import create_storage
+
+DEFAULT_SPOTS = [50, 1000, 10000]
+DEFAULT_HISTORY = [10000, 100000]
+FULL_HISTORY = [10000, 100000, 1000000, 10000000]
+# Full-file JSON rewrites above this size take minutes per call
+JSON_SAVE_LIMIT = 1000000
+
+
+def percentiles(samples_ns):
+    samples = sorted(samples_ns)
+    if not samples:
+        return {}
+
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] / 1000
+
+    return {
+        "count": len(samples),
+        "p50_us": pick(0.50),
+        "p95_us": pick(0.95),
+        "p99_us": pick(0.99),
+        "max_us": samples[-1] / 1000,
+        "mean_us": sum(samples) / len(samples) / 1000
+    }
+
+
+def timed(fn, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        fn(i)
+        samples.append(time.perf_counter_ns() - start)
+    return percentiles(samples)
+
+
+def synthesize_history(size, seed=1, end_ts=None):
+    # Sessions spread over the last year, appended in exit order
+    rng = random.Random(seed)
+    end_ts = end_ts or int(time.time())
+    start_ts = end_ts - 365 * 86400
+    step = (end_ts - start_ts) / max(1, size)
+    history = MemoryHistory()
+    for i in range(size):
+        exit_ts = int(start_ts + i * step)
+        duration = rng.randint(300, 8 * 3600)
+        vtype = rng.choice(VEHICLE_TYPES)
+        history.append(SessionRecord(f"TN{rng.randint(0, 99):02d}AB{rng.randint(0, 9999):04d}",
+                                     vtype, "Owner", exit_ts - duration, exit_ts,
+                                     round(duration / 3600, 2), 20.0))
+    return history
+
+
+def build_engine(spots, history_size, occupancy=0.8, seed=1):
+    engine = ParkingEngine(total_spots=spots)
+    engine.history = synthesize_history(history_size, seed)
+    now = int(time.time())
+    for i in range(int(spots * occupancy)):
+        engine.park(f"LIVE{i:06d}", VEHICLE_TYPES[i % len(VEHICLE_TYPES)], "Owner", now=now - 3600)
+    return engine
+
+
+def bench_engine(engine, iterations):
+    results = {}
+    park_samples, search_samples, remove_samples = [], [], []
+
+    # Fill the free spots, look the new vehicles up, then release them
+    # again, until enough samples are collected
+    i = 0
+    while len(park_samples) < iterations:
+        parked = []
+        while len(parked) < engine.available_count and len(park_samples) < iterations:
+            start = time.perf_counter_ns()
+            parked.append(engine.park(f"BENCH{i:07d}", "Car", "Owner"))
+            park_samples.append(time.perf_counter_ns() - start)
+            i += 1
+        for spot in parked:
+            plate = engine.parking_spots[spot]
+            start = time.perf_counter_ns()
+            engine.find_vehicle(plate)
+            search_samples.append(time.perf_counter_ns() - start)
+        for spot in parked:
+            start = time.perf_counter_ns()
+            engine.remove(spot)
+            remove_samples.append(time.perf_counter_ns() - start)
+
+    results["park_vehicle"] = percentiles(park_samples)
+    results["search_vehicle"] = percentiles(search_samples)
+    results["remove_vehicle"] = percentiles(remove_samples)
+
+    today = day_of(int(time.time()))
+    results["revenue_for_day"] = timed(lambda i: engine.history.revenue_for_day(today), iterations)
+    results["reprice_history"] = timed(lambda i: engine.tariff.reprice(engine.history), 3)
+    results["history_page"] = timed(lambda i: engine.history.page(i * 100 % max(1, len(engine.history)), 100),
+                                    min(iterations, 200))
+    return results
+
+
+def bench_storage(kind, engine, iterations, workdir):
+    directory = tempfile.mkdtemp(dir=workdir)
+    options = {
+        "json": {"path": os.path.join(directory, "parking_data.json")},
+        "journal": {"directory": os.path.join(directory, "journal"), "legacy_path": None},
+        "sqlite": {"path": os.path.join(directory, "parking.db"), "legacy_path": None}
+    }[kind]
+    results = {}
+    try:
+        # Seed the store with the synthetic state
+        storage = create_storage(kind, **options)
+        seed = ParkingEngine(total_spots=engine.total_spots)
+        storage.load(seed)
+        if kind == "sqlite":
+            seed.history.extend(engine.history)
+            seed.load_state(engine.parked_vehicles, engine.reservations, seed.history)
+            storage._write_state(seed)
+        else:
+            seed.load_state(engine.parked_vehicles, engine.reservations, engine.history)
+            if kind == "journal":
+                storage.pending_sessions = [record.to_dict() for record in engine.history]
+                storage.compact(seed)
+        storage.save(seed)
+        seed.subscribe(storage.record)
+
+        # Steady-state gate events: one park or exit plus its save
+        count = min(iterations, 20) if kind == "json" else iterations
+        parked = []
+
+        def event(i):
+            if i % 2 == 0:
+                parked.append(seed.park(f"SAVE{i:07d}", "Car", "Owner"))
+            else:
+                seed.remove(parked.pop())
+            storage.save(seed)
+
+        results["save_data"] = timed(event, count)
+        storage.close(seed)
+        results["bytes_on_disk"] = sum(os.path.getsize(os.path.join(root, name))
+                                       for root, _, names in os.walk(directory) for name in names)
+
+        def load(i):
+            loaded = ParkingEngine(total_spots=engine.total_spots)
+            store = create_storage(kind, **options)
+            store.load(loaded)
+            store.close(loaded)
+
+        results["load_data"] = timed(load, 3)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_ui(engine, iterations):
+    # UI paths need a display; run under Xvfb (e.g. xvfb-run) on servers
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return {"skipped": f"no display: {e}"}
+
+    from parking_storage import JsonStorage
+    from parking_system import ParkingManagementSystem
+
+    class NullStorage(JsonStorage):
+        def load(self, engine, background=False):
+            return None
+
+        def save(self, engine):
+            pass
+
+    try:
+        root.withdraw()
+        app = ParkingManagementSystem(root, storage=NullStorage())
+        app.engine.set_layout(engine.layout)
+        app.engine.load_state(engine.parked_vehicles, engine.reservations, engine.history)
+        app.rebuild_tables()
+        app.layout_parking_map()
+        root.update()
+
+        results = {}
+        parked = []
+
+        def event(i):
+            if i % 2 == 0:
+                parked.append(app.engine.park(f"UI{i:07d}", "Car", "Owner"))
+            else:
+                app.engine.remove(parked.pop())
+            app.update_display()
+            root.update_idletasks()
+
+        results["update_display"] = timed(event, min(iterations, 200))
+        results["draw_parking_map"] = timed(lambda i: app.draw_parking_map(), min(iterations, 200))
+        results["layout_parking_map"] = timed(lambda i: app.layout_parking_map(), 5)
+        return results
+    finally:
+        root.destroy()
+
+
+def run(spot_sizes, history_sizes, iterations, storages, ui, workdir):
+    report = {
+        "generated": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": iterations,
+        "scenarios": []
+    }
+    for history_size in history_sizes:
+        for spots in spot_sizes:
+            print(f"Benchmarking {spots} spots, {history_size} sessions...")
+            started = time.perf_counter()
+            tracemalloc.start()
+            engine = build_engine(spots, history_size)
+            build_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results = bench_engine(engine, iterations)
+
+            scenario = {
+                "spots": spots,
+                "history": history_size,
+                "engine": results,
+                "memory": {
+                    "current_bytes": build_memory[0],
+                    "peak_bytes": build_memory[1],
+                    "bytes_per_session": build_memory[0] / max(1, history_size)
+                },
+                "storage": {}
+            }
+            for kind in storages:
+                if kind == "json" and history_size > JSON_SAVE_LIMIT:
+                    scenario["storage"][kind] = {"skipped": "history too large for full rewrites"}
+                    continue
+                scenario["storage"][kind] = bench_storage(kind, engine, iterations, workdir)
+            if ui:
+                scenario["ui"] = bench_ui(engine, iterations)
+            scenario["seconds"] = time.perf_counter() - started
+            report["scenarios"].append(scenario)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parking Management System benchmarks")
+    parser.add_argument("--spots", type=int, nargs="+", default=DEFAULT_SPOTS)
+    parser.add_argument("--history", type=int, nargs="+", default=None)
+    parser.add_argument("--full", action="store_true",
+                        help=f"history sizes {FULL_HISTORY} (slow)")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--storage", nargs="+", default=["json", "journal", "sqlite"])
+    parser.add_argument("--ui", action="store_true", help="also time Tk paths (needs a display)")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    history_sizes = args.history or (FULL_HISTORY if args.full else DEFAULT_HISTORY)
+    workdir = tempfile.mkdtemp(prefix="parking_bench_")
+    try:
+        report = run(args.spots, history_sizes, args.iterations, args.storage, args.ui, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
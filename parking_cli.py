@@ -0,0 +1,47 @@
+from parking_archive import ARCHIVE_DIR, archive_dir, attach_archive
+from parking_engine import DEFAULT_RATES, ParkingEngine
+from parking_lot import ALLOCATION_STRATEGIES, DEFAULT_STRATEGY, LotLayout
+from parking_occupancy import OccupancyBackfill
+from parking_plates import PlateIndexBuild
+from parking_storage import STORAGE_BACKENDS, create_storage
+from parking_tariff import Tariff
+
+
+def add_lot_arguments(parser, storage="json"):
+    # The options open_lot() reads: where the lot's data lives and how the
+    # lot is laid out and priced
+    parser.add_argument("--storage", choices=sorted(STORAGE_BACKENDS), default=storage,
+                        help=f"persistence backend (default: {storage})")
+    parser.add_argument("--data-dir", metavar="DIR",
+                        help="keep this lot's data under DIR instead of the working directory")
+    parser.add_argument("--archive-dir", metavar="DIR",
+                        help=f"archive location (default: {ARCHIVE_DIR} under the data directory)")
+    parser.add_argument("--spots", type=int, default=50)
+    parser.add_argument("--lot", metavar="CONFIG",
+                        help="lot layout file with levels, zones and bay sizes (overrides --spots)")
+    parser.add_argument("--strategy", choices=sorted(ALLOCATION_STRATEGIES), default=DEFAULT_STRATEGY)
+    parser.add_argument("--tariff", metavar="CONFIG",
+                        help="tariff file with tiers, peak windows, caps and grace period")
+
+
+def open_lot(args, storage_options=None, retention_days=None, backfill=False, plates=False):
+    # (engine, storage) for the add_lot_arguments() options: the stored
+    # state and the whole history loaded, the archive attached (created
+    # when retention_days is given), and on request the occupancy series
+    # and plate index rebuilt from that history. Close the storage when
+    # done.
+    layout = LotLayout.load(args.lot) if args.lot else None
+    tariff = Tariff.load(args.tariff, DEFAULT_RATES) if args.tariff else None
+    engine = ParkingEngine(total_spots=args.spots, layout=layout, strategy=args.strategy, tariff=tariff)
+    storage = create_storage(args.storage, args.data_dir, **(storage_options or {}))
+    storage.load(engine)
+    try:
+        attach_archive(engine, args.archive_dir or archive_dir(args.data_dir), retention_days)
+        if backfill:
+            OccupancyBackfill(engine).run_now(engine)
+        if plates:
+            PlateIndexBuild(engine).run_now(engine)
+    except BaseException:
+        storage.close(engine)
+        raise
+    return engine, storage
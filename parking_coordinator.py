@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs, quote, urlsplit
+from parking_plates import MATCH_KINDS, PLATE_SEARCH_LIMIT
+from parking_server import DEFAULT_PORT, ParkingServer, RequestError, field
+
+SHARD_TIMEOUT = 5.0
+SHARD_START_TIMEOUT = 30.0
+DASHBOARD_INTERVAL = 2.0
+# Writes forwarded to the shard named in the body's "shard" field
+FORWARDED = ("/park", "/exit", "/reserve", "/cancel", "/batch")
+
+
+class ShardError(Exception):
+    pass
+
+
+class ShardClient:
+    # Keep-alive HTTP/1.1 client for one shard's gate server, over a Unix
+    # socket (the usual case, one process per lot on this machine) or TCP.
+    # Idle connections are pooled so concurrent requests don't queue.
+    def __init__(self, name, path=None, host="127.0.0.1", port=None, timeout=SHARD_TIMEOUT):
+        self.name = name
+        self.path = path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = []
+
+    async def _connect(self):
+        if self.path is not None:
+            return await asyncio.open_unix_connection(self.path)
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, target, body=None):
+        # (status, payload). Pooled connections the shard is known to have
+        # closed are skipped; a GET that still fails on one is retried once
+        # on a fresh connection. Writes are never retried, since the shard
+        # may have applied the first attempt.
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        for attempt in range(2):
+            reader, writer = self._pooled()
+            fresh = reader is None
+            if fresh:
+                reader, writer = await self._connect()
+            try:
+                result = await asyncio.wait_for(self._exchange(reader, writer, method, target, data),
+                                                self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                writer.close()
+                if fresh or attempt or method != "GET":
+                    raise
+                continue
+            except BaseException:
+                writer.close()
+                raise
+            self._idle.append((reader, writer))
+            return result
+
+    def _pooled(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None, None
+
+    async def _exchange(self, reader, writer, method, target, data):
+        writer.write((f"{method} {target} HTTP/1.1\r\nHost: {self.name}\r\n"
+                      f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n")
+                     .encode("latin-1") + data)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("shard closed the connection")
+        status = int(status_line.split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await reader.readexactly(length))
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class Coordinator:
+    # Fans dashboard queries out to every shard at once and merges the
+    # answers; each shard keeps its own engine and store, so no process
+    # here holds lot state. Writes are forwarded to the shard they name.
+    # Shards that fail or time out are reported, not fatal.
+    def __init__(self, shards):
+        self.shards = {shard.name: shard for shard in shards}
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        for shard in self.shards.values():
+            shard.close()
+
+    async def gather(self, method, target, body=None):
+        # {name: payload}, {name: error message}
+        names = list(self.shards)
+        replies = await asyncio.gather(*(self.shards[name].request(method, target, body) for name in names),
+                                       return_exceptions=True)
+        results, errors = {}, {}
+        for name, reply in zip(names, replies):
+            if isinstance(reply, BaseException):
+                errors[name] = f"{type(reply).__name__}: {reply}" if str(reply) else type(reply).__name__
+            elif reply[0] != 200:
+                errors[name] = reply[1].get("error", f"status {reply[0]}")
+            else:
+                results[name] = reply[1]
+        return results, errors
+
+    async def status(self):
+        results, errors = await self.gather("GET", "/status")
+        totals = defaultdict(float)
+        for status in results.values():
+            for key in ("total_spots", "occupied", "available", "reserved", "sessions",
+                        "today_revenue", "total_revenue", "events"):
+                totals[key] += status.get(key, 0)
+        capacity = totals["total_spots"]
+        merged = {key: int(value) if key not in ("today_revenue", "total_revenue") else round(value, 2)
+                  for key, value in totals.items()}
+        # Capacity-weighted, i.e. the utilisation of all shards as one lot
+        merged["utilisation"] = (sum(status["utilisation"] * status["total_spots"] for status in results.values())
+                                 / capacity if capacity else 0.0)
+        return dict(merged, shards=results, errors=errors)
+
+    async def occupancy(self, resolution="hour", since=None):
+        target = f"/occupancy?resolution={resolution}" + (f"&since={since}" if since is not None else "")
+        results, errors = await self.gather("GET", target)
+        # Means add up across shards bucket by bucket; peaks of different
+        # shards need not coincide, so their sum is only an upper bound
+        buckets = defaultdict(lambda: [0.0, 0])
+        for occupancy in results.values():
+            for ts, mean, peak in occupancy["series"]:
+                buckets[ts][0] += mean
+                buckets[ts][1] += peak
+        return {
+            "capacity": sum(occupancy["capacity"] for occupancy in results.values()),
+            "mean": sum(occupancy["mean"] for occupancy in results.values()),
+            "series": [(ts, mean, peak_bound) for ts, (mean, peak_bound) in sorted(buckets.items())],
+            "shards": {name: {"capacity": occupancy["capacity"], "peak": occupancy["peak"],
+                              "peak_ts": occupancy["peak_ts"], "mean": occupancy["mean"]}
+                       for name, occupancy in results.items()},
+            "errors": errors
+        }
+
+    async def revenue(self, start_day=None, end_day=None):
+        query = "&".join(f"{name}={day}" for name, day in (("from", start_day), ("to", end_day)) if day)
+        results, errors = await self.gather("GET", "/revenue" + ("?" + query if query else ""))
+        days = defaultdict(lambda: {"sessions": 0, "revenue": 0.0})
+        for revenue in results.values():
+            for day, totals in revenue["days"].items():
+                days[day]["sessions"] += totals["sessions"]
+                days[day]["revenue"] += totals["revenue"]
+        return {"days": dict(sorted(days.items())),
+                "shards": {name: sum(totals["revenue"] for totals in revenue["days"].values())
+                           for name, revenue in results.items()},
+                "errors": errors}
+
+    async def plates(self, text, limit=PLATE_SEARCH_LIMIT):
+        results, errors = await self.gather("GET", f"/plates?q={quote(text)}&limit={limit}")
+        matches = [dict(match, shard=name) for name, found in results.items() for match in found["matches"]]
+        # Same ranking as PlateIndex.search, across shards
+        matches.sort(key=lambda match: (MATCH_KINDS.index(match["kind"]), match["distance"],
+                                        match["spot"] is None, -match["last_seen"], match["plate"]))
+        return {"matches": matches[:limit], "errors": errors}
+
+    async def search(self, vehicle):
+        results, errors = await self.gather("GET", f"/search?vehicle={quote(vehicle)}")
+        for name, found in results.items():
+            if found["found"]:
+                return dict(found, shard=name, errors=errors)
+        return {"found": False, "vehicle": vehicle.strip().upper(), "errors": errors}
+
+    async def forward(self, path, body):
+        name = body.pop("shard", None)
+        if name not in self.shards:
+            raise RequestError(400, f"Unknown or missing shard {name!r}; one of {', '.join(self.shards)}")
+        try:
+            status, payload = await self.shards[name].request("POST", path, body)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            raise RequestError(500, f"Shard {name} unavailable: {type(e).__name__}")
+        if status != 200:
+            raise RequestError(status, payload.get("error", ""))
+        return dict(payload, shard=name)
+
+
+class CoordinatorServer(ParkingServer):
+    # The gate server's HTTP front end over a Coordinator
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/")
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        coordinator = self.service
+        if path in FORWARDED:
+            if method != "POST":
+                raise RequestError(405, f"{path} expects POST")
+            try:
+                body = json.loads(body or b"{}")
+            except ValueError:
+                raise RequestError(400, "Body must be JSON")
+            if not isinstance(body, dict):
+                raise RequestError(400, "Body must be a JSON object")
+            return await coordinator.forward(path, body)
+        if method != "GET":
+            raise RequestError(405, f"{path} expects GET")
+        if path == "/status":
+            return await coordinator.status()
+        if path == "/occupancy":
+            return await coordinator.occupancy(query.get("resolution", "hour"),
+                                               field(query, "since", int, required=False))
+        if path == "/revenue":
+            return await coordinator.revenue(query.get("from"), query.get("to"))
+        if path == "/plates":
+            if not query.get("q", "").strip():
+                raise RequestError(400, "Missing query parameter q")
+            limit = field(query, "limit", int, required=False)
+            return await coordinator.plates(query["q"], PLATE_SEARCH_LIMIT if limit is None else limit)
+        if path == "/search":
+            if not query.get("vehicle", "").strip():
+                raise RequestError(400, "Missing query parameter vehicle")
+            return await coordinator.search(query["vehicle"])
+        raise RequestError(404, f"Unknown path {url.path}")
+
+
+def load_shards(path):
+    # {"shards": [{"name": "north", "socket": "run/north.sock", "data_dir":
+    #   "sites/north", "spots": 200, "lot": null, "tariff": null,
+    #   "storage": "journal"}, {"name": "east", "host": "10.0.0.5", "port": 8080}]}
+    with open(path, "r") as f:
+        return json.load(f)["shards"]
+
+
+def spawn_shard(config):
+    # One gate server process per shard, owning its own data directory
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "parking_server.py"),
+               "--unix", config["socket"], "--data-dir", config.get("data_dir", config["name"])]
+    for option in ("spots", "lot", "strategy", "tariff", "storage"):
+        if config.get(option) is not None:
+            command += [f"--{option}", str(config[option])]
+    if os.path.exists(config["socket"]):
+        os.unlink(config["socket"])
+    return subprocess.Popen(command)
+
+
+def wait_for_sockets(configs, processes, timeout=SHARD_START_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    for config, process in zip(configs, processes):
+        while not os.path.exists(config["socket"]):
+            if process.poll() is not None:
+                raise ShardError(f"Shard {config['name']} exited with code {process.returncode}")
+            if time.monotonic() > deadline:
+                raise ShardError(f"Shard {config['name']} did not start")
+            time.sleep(0.05)
+
+
+def print_dashboard(status):
+    print(f"\n{time.strftime('%H:%M:%S')}  {'shard':<14}{'spots':>7}{'occupied':>10}{'free':>7}"
+          f"{'util':>7}{'today ₹':>12}{'total ₹':>14}")
+    for name, shard in sorted(status["shards"].items()):
+        print(f"{'':10}{name:<14}{shard['total_spots']:>7}{shard['occupied']:>10}{shard['available']:>7}"
+              f"{shard['utilisation']:>7.0%}{shard['today_revenue']:>12.2f}{shard['total_revenue']:>14.2f}")
+    for name, error in sorted(status["errors"].items()):
+        print(f"{'':10}{name:<14}unavailable: {error}")
+    print(f"{'':10}{'all':<14}{status.get('total_spots', 0):>7}{status.get('occupied', 0):>10}"
+          f"{status.get('available', 0):>7}{status['utilisation']:>7.0%}"
+          f"{status.get('today_revenue', 0):>12.2f}{status.get('total_revenue', 0):>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merged view over several parking gate servers")
+    parser.add_argument("shards", help="shard list file, see load_shards()")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a gate server process for every shard with a socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--dashboard", action="store_true", help="print the merged status periodically")
+    parser.add_argument("--interval", type=float, default=DASHBOARD_INTERVAL)
+    args = parser.parse_args()
+
+    configs = load_shards(args.shards)
+    processes = []
+    if args.spawn:
+        spawned = [config for config in configs if "socket" in config]
+        processes = [spawn_shard(config) for config in spawned]
+        wait_for_sockets(spawned, processes)
+    coordinator = Coordinator(ShardClient(config["name"], config.get("socket"), config.get("host", "127.0.0.1"),
+                                          config.get("port")) for config in configs)
+    server = CoordinatorServer(coordinator)
+
+    async def dashboard():
+        while True:
+            print_dashboard(await coordinator.status())
+            await asyncio.sleep(args.interval)
+
+    async def run():
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, task.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass
+        watcher = loop.create_task(dashboard()) if args.dashboard else None
+        try:
+            await server.serve(args.host, args.port,
+                               lambda s: print(f"Coordinating {len(configs)} shards on "
+                                               f"http://{args.host}:{args.port}", flush=True))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Gate servers flush and close their stores on SIGTERM
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
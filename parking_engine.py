@@ -0,0 +1,490 @@
+import time
+from contextlib import contextmanager
+from parking_history import MemoryHistory
+from parking_lot import DEFAULT_STRATEGY, LotLayout, create_strategy
+from parking_occupancy import OccupancySeries
+from parking_plates import PLATE_SEARCH_LIMIT, PlateIndex
+from parking_records import ParkedVehicle, Reservation, SessionRecord, VehicleType
+from parking_reservations import EXPIRE, ReservationBook
+from parking_tariff import Tariff
+
+VEHICLE_TYPES = [vtype.value for vtype in VehicleType]
+DEFAULT_RATES = {"Car": 20, "Bike": 10, "Truck": 30, "SUV": 25}
+
+
+class ParkingError(Exception):
+    pass
+
+
+class ParkingEngine:
+    def __init__(self, total_spots=50, rates=None, layout=None, strategy=DEFAULT_STRATEGY,
+                 tariff=None, clock=None):
+        # Seconds since the epoch, like time.time; replays and simulations
+        # pass a ManualClock so "now" is whatever the log says it is
+        self.clock = clock or time.time
+        self.layout = layout or LotLayout.flat(total_spots)
+        self.total_spots = len(self.layout)
+        self.strategy = strategy
+        self.tariff = tariff or Tariff(DEFAULT_RATES if rates is None else rates)
+        self.tariff.follow_clock(self.clock)
+        self.rates = self.tariff.rates
+
+        # Data structures
+        self.parking_spots = {}
+        self.parked_vehicles = {}
+        self.history = MemoryHistory()
+        self.occupancy = OccupancySeries()
+        self.reservations = ReservationBook()
+        # Spots whose reservation window is running right now
+        self.reserved_spots = set()
+
+        # Indexes
+        self.plate_index = {}
+        # Every plate seen, for partial and fuzzy search; rebuilt from the
+        # history by PlateIndexBuild after loading
+        self.plates = PlateIndex()
+        self.allocator = create_strategy(strategy, self.layout)
+
+        # Event listeners, called with every state change (persistence etc.)
+        self.listeners = []
+        # Events held back while a batch() is open
+        self._batch = None
+
+        self._rebuild_indexes()
+
+    def now(self):
+        return int(self.clock())
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _emit(self, event):
+        if self._batch is not None:
+            self._batch.append(event)
+            return
+        for listener in self.listeners:
+            listener(event)
+
+    @contextmanager
+    def batch(self):
+        # Operations inside the block are applied one by one as usual, but
+        # their events reach listeners as one {"op": "batch"} event at the
+        # end, so storage writes them together (one journal line, one
+        # fsync) and the UI refreshes once. A nested batch joins the outer.
+        if self._batch is not None:
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+        finally:
+            events, self._batch = self._batch, None
+            if events:
+                self._emit({"op": "batch", "events": events})
+
+    def _rebuild_indexes(self):
+        self.parking_spots = dict.fromkeys(self.layout.spots)
+        self.plate_index.clear()
+        for spot, vehicle in self.parked_vehicles.items():
+            if spot not in self.parking_spots:
+                raise ParkingError(f"Spot {spot} does not exist in this lot layout!")
+            self.parking_spots[spot] = vehicle.vehicle
+            self.plate_index[vehicle.vehicle] = spot
+            self.plates.add(vehicle.vehicle, vehicle.entry_ts)
+        self.reservations.reset({spot: info.size for spot, info in self.layout.spots.items()})
+        self.allocator.reset(spot for spot in self.parking_spots if self.is_free(spot))
+
+    def set_layout(self, layout, strategy=None):
+        # Switch lot topology or allocation strategy; parked vehicles keep
+        # their spot numbers, which must exist in the new layout
+        self.layout = layout
+        self.total_spots = len(layout)
+        self.strategy = strategy or self.strategy
+        self.allocator = create_strategy(self.strategy, layout)
+        self._rebuild_indexes()
+
+    def spot_info(self, spot):
+        return self.layout.spots.get(spot)
+
+    def is_free(self, spot):
+        return self.parking_spots.get(spot) is None and spot not in self.reserved_spots
+
+    @property
+    def occupied_count(self):
+        return len(self.parked_vehicles)
+
+    @property
+    def available_count(self):
+        # A hold can start while its spot is still occupied; count it once
+        held = sum(1 for spot in self.reserved_spots if self.parking_spots[spot] is None)
+        return self.total_spots - len(self.parked_vehicles) - held
+
+    def find_vehicle(self, vehicle_num):
+        return self.plate_index.get(vehicle_num.strip().upper())
+
+    def search_plates(self, text, limit=PLATE_SEARCH_LIMIT):
+        # Ranked partial/fuzzy matches over parked and historical plates
+        return self.plates.search(text, limit, self.plate_index)
+
+    def park(self, vehicle_num, vehicle_type, owner, phone="", now=None):
+        vehicle_num = vehicle_num.strip().upper()
+        owner = owner.strip()
+        if not vehicle_num or not owner:
+            raise ParkingError("Please fill vehicle number and owner name!")
+        if vehicle_type not in self.rates:
+            raise ParkingError(f"Unknown vehicle type {vehicle_type}!")
+
+        # Check if vehicle already parked
+        if vehicle_num in self.plate_index:
+            raise ParkingError(f"Vehicle {vehicle_num} is already parked at spot {self.plate_index[vehicle_num]}!")
+
+        # Find available spot
+        spot = self.allocator.allocate(vehicle_type, self.is_free)
+        if spot is None:
+            if self.available_count > 0:
+                raise ParkingError(f"No free spot is large enough for a {vehicle_type}!")
+            raise ParkingError("No parking spots available!")
+
+        # Park the vehicle
+        vehicle = ParkedVehicle(vehicle_num, vehicle_type, owner, phone.strip(),
+                                self.now() if now is None else now)
+        self._admit(spot, vehicle)
+        return spot
+
+    def _admit(self, spot, vehicle):
+        self._occupy(spot, vehicle)
+        self.occupancy.record(vehicle.entry_ts, len(self.parked_vehicles))
+        self._emit(dict(vehicle.to_dict(), op="park", spot=spot))
+
+    def _occupy(self, spot, vehicle):
+        self.parked_vehicles[spot] = vehicle
+        self.parking_spots[spot] = vehicle.vehicle
+        self.plate_index[vehicle.vehicle] = spot
+        self.plates.add(vehicle.vehicle, vehicle.entry_ts)
+
+    def _release(self, spot):
+        vehicle = self.parked_vehicles.pop(spot)
+        self.parking_spots[spot] = None
+        del self.plate_index[vehicle.vehicle]
+        self.allocator.release(spot)
+        return vehicle
+
+    def remove(self, spot_num, now=None):
+        if spot_num not in self.parked_vehicles:
+            raise ParkingError(f"No vehicle parked at spot {spot_num}!")
+
+        vehicle = self.parked_vehicles[spot_num]
+        exit_ts = self.now() if now is None else now
+        duration = (exit_ts - vehicle.entry_ts) / 3600
+
+        # Calculate fee
+        fee = self.tariff.price(vehicle.type, vehicle.entry_ts, exit_ts)
+
+        record = SessionRecord(vehicle.vehicle, vehicle.type, vehicle.owner,
+                               vehicle.entry_ts, exit_ts, round(duration, 2), fee)
+        self._close_session(record)
+
+        # Release the spot
+        self._release(spot_num)
+        self.occupancy.record(exit_ts, len(self.parked_vehicles))
+        self._emit({"op": "exit", "spot": spot_num, "record": record.to_dict()})
+        return record
+
+    def _close_session(self, record):
+        self.history.append(record)
+        self.plates.add(record.vehicle, record.exit_ts, 1)
+
+    def reserve(self, spot, holder="", start=None, end=None, now=None):
+        # Hold a spot from `start` (default now) until `end`; without an end
+        # the hold lasts until cancelled. Returns False if the spot is
+        # already held for part of that window.
+        now = self.now() if now is None else now
+        start = now if start is None else start
+        if spot not in self.parking_spots:
+            raise ParkingError(f"Spot {spot} does not exist!")
+        if end is not None and end <= max(start, now):
+            raise ParkingError("A reservation must end after it starts and in the future!")
+        if start <= now and self.parking_spots[spot] is not None:
+            raise ParkingError(f"Spot {spot} is already occupied!")
+        if not self.reservations.is_available(spot, start, end):
+            return False
+        reservation = Reservation(spot, holder.strip(), start, end)
+        self._hold(reservation, now)
+        self._emit(dict(reservation.to_dict(), op="reserve"))
+        return True
+
+    def reserve_any(self, holder="", start=None, end=None, vehicle_type=None, now=None):
+        # Reserve the spot the allocation strategy would hand out, or for a
+        # later window a bay the vehicle fits that is open for all of it
+        now = self.now() if now is None else now
+        start = now if start is None else start
+        if vehicle_type is not None and vehicle_type not in self.rates:
+            raise ParkingError(f"Unknown vehicle type {vehicle_type}!")
+        if start <= now:
+            # Free right now, skipping spots with a later hold in the window
+            skipped = []
+            while True:
+                spot = self.allocator.allocate(vehicle_type, self.is_free)
+                if spot is None or self.reservations.is_available(spot, start, end):
+                    break
+                skipped.append(spot)
+            for candidate in skipped:
+                self.allocator.release(candidate)
+        else:
+            spot = self.reservations.find_spot(start, end, self.allocator.sizes_for(vehicle_type))
+        if spot is None:
+            raise ParkingError("No spot is free for that time!")
+        if not self.reserve(spot, holder, start, end, now):
+            raise ParkingError("No spot is free for that time!")
+        return spot
+
+    def cancel_reservation(self, spot, start_ts=None, now=None):
+        # Cancels the hold running now, or the one starting at `start_ts`
+        now = self.now() if now is None else now
+        if start_ts is None:
+            reservation = self.reservations.covering(spot, now)
+        else:
+            reservation = self.reservations.find(spot, start_ts)
+        if reservation is None:
+            raise ParkingError(f"Spot {spot} has no such reservation!")
+        self._unhold(reservation, now)
+        self._emit({"op": "cancel", "spot": spot, "start_ts": reservation.start_ts})
+        return reservation
+
+    def update_reservations(self, now=None):
+        # Reservation scheduler tick: activate holds whose window has begun
+        # and release the ones that ran out. Only due entries are looked at,
+        # so calling this often is cheap. Returns the number of changes.
+        now = self.now() if now is None else now
+        changes = 0
+        for kind, reservation in self.reservations.due(now):
+            spot = reservation.spot
+            if kind == EXPIRE:
+                self._unhold(reservation, now)
+                self._emit({"op": "cancel", "spot": spot, "start_ts": reservation.start_ts,
+                            "expired": True})
+            elif reservation.covers(now):
+                self.reserved_spots.add(spot)
+                self._emit({"op": "activate", "spot": spot, "start_ts": reservation.start_ts})
+            else:
+                continue
+            changes += 1
+        return changes
+
+    def next_reservation_change(self):
+        return self.reservations.next_change()
+
+    def _hold(self, reservation, now):
+        self.reservations.add(reservation)
+        if reservation.covers(now):
+            self.reserved_spots.add(reservation.spot)
+
+    def _unhold(self, reservation, now):
+        spot = reservation.spot
+        self.reservations.remove(spot, reservation.start_ts)
+        if spot in self.reserved_spots and self.reservations.covering(spot, now) is None:
+            self.reserved_spots.discard(spot)
+            if self.parking_spots[spot] is None:
+                self.allocator.release(spot)
+
+    def clear(self):
+        self._reset()
+        self._emit({"op": "clear"})
+
+    # Batch operations
+
+    def run_batch(self, operations):
+        # Apply a list of operations, e.g. a replayed gate log, in one batch:
+        #   {"op": "park", "vehicle", "type", "owner", "phone"?, "ts"?}
+        #   {"op": "exit", "spot" or "vehicle", "ts"?}
+        #   {"op": "reserve", "spot"?, "holder"?, "start_ts"?, "end_ts"?, "type"?, "ts"?}
+        #   {"op": "cancel", "spot", "start_ts"?, "ts"?}
+        # One failing operation does not stop the rest; the result list holds
+        # each operation's return value or its ParkingError.
+        results = []
+        with self.batch():
+            for operation in operations:
+                try:
+                    results.append(self._run_operation(operation))
+                except ParkingError as e:
+                    results.append(e)
+        return results
+
+    def _run_operation(self, operation):
+        op = operation.get("op")
+        now = operation.get("ts")
+        if op == "park":
+            return self.park(operation.get("vehicle", ""), operation.get("type"),
+                             operation.get("owner", ""), operation.get("phone", ""), now)
+        if op == "exit":
+            spot = operation.get("spot")
+            if spot is None:
+                spot = self.find_vehicle(operation.get("vehicle", ""))
+                if spot is None:
+                    raise ParkingError(f"Vehicle {operation.get('vehicle')} is not parked!")
+            return self.remove(spot, now)
+        if op == "reserve":
+            if operation.get("spot") is None:
+                return self.reserve_any(operation.get("holder", ""), operation.get("start_ts"),
+                                        operation.get("end_ts"), operation.get("type"), now)
+            if not self.reserve(operation["spot"], operation.get("holder", ""), operation.get("start_ts"),
+                                operation.get("end_ts"), now):
+                raise ParkingError(f"Spot {operation['spot']} is already reserved for that time!")
+            return operation["spot"]
+        if op == "cancel":
+            return self.cancel_reservation(operation.get("spot"), operation.get("start_ts"), now)
+        raise ParkingError(f"Unknown operation {op}!")
+
+    def park_many(self, vehicles, now=None):
+        # vehicles: (vehicle number, type, owner, phone) tuples
+        return self.run_batch({"op": "park", "vehicle": vehicle, "type": vtype, "owner": owner,
+                               "phone": phone, "ts": now} for vehicle, vtype, owner, phone in vehicles)
+
+    def remove_many(self, spots=None, now=None):
+        # Mass checkout, of every parked vehicle by default; all of them
+        # leave at the same time
+        now = self.now() if now is None else now
+        spots = sorted(self.parked_vehicles) if spots is None else spots
+        return self.run_batch({"op": "exit", "spot": spot, "ts": now} for spot in spots)
+
+    def import_dict(self, data, now=None):
+        # Merge a legacy parking_data.json document into the running lot in
+        # one batch. Vehicles keep their spot when it exists and is free and
+        # are given another one otherwise; plates already parked are
+        # skipped. Sessions are added in exit order after the existing
+        # history (which is kept in exit order), so sessions that closed
+        # before its latest one are skipped.
+        now = self.now() if now is None else now
+        summary = {"parked": 0, "moved": 0, "reservations": 0, "sessions": 0, "skipped": []}
+        with self.batch():
+            for spot_str, info in sorted(data.get("parked_vehicles", {}).items(), key=lambda item: int(item[0])):
+                vehicle = ParkedVehicle.from_dict(info)
+                spot = int(spot_str)
+                if vehicle.vehicle in self.plate_index or vehicle.type not in self.rates:
+                    summary["skipped"].append(vehicle.vehicle)
+                    continue
+                if spot not in self.parking_spots or not self.is_free(spot) \
+                        or self.layout.spots[spot].size not in self.allocator.sizes_for(vehicle.type):
+                    spot = self.allocator.allocate(vehicle.type, self.is_free)
+                    if spot is None:
+                        summary["skipped"].append(vehicle.vehicle)
+                        continue
+                    summary["moved"] += 1
+                self._admit(spot, vehicle)
+                summary["parked"] += 1
+
+            if "reservations" in data:
+                reservations = [Reservation.from_dict(r) for r in data["reservations"]]
+            else:
+                reservations = [Reservation(spot, "", now) for spot in data.get("reserved_spots", [])]
+            for reservation in reservations:
+                if reservation.end_ts is not None and reservation.end_ts <= now:
+                    continue
+                try:
+                    if self.reserve(reservation.spot, reservation.holder, max(reservation.start_ts, now),
+                                    reservation.end_ts, now):
+                        summary["reservations"] += 1
+                except ParkingError:
+                    pass
+
+            latest = self.history.page(0, 1)[0].exit_ts if len(self.history) else None
+            records = sorted((SessionRecord.from_dict(h) for h in data.get("history", [])),
+                             key=lambda record: record.exit_ts)
+            for record in records:
+                if latest is not None and record.exit_ts < latest:
+                    continue
+                self._close_session(record)
+                self._emit({"op": "session", "record": record.to_dict()})
+                summary["sessions"] += 1
+        summary["sessions_skipped"] = len(records) - summary["sessions"]
+        return summary
+
+    def _reset(self):
+        self.parked_vehicles.clear()
+        self.history.clear()
+        self.reservations.clear()
+        self.reserved_spots.clear()
+        self.occupancy = OccupancySeries()
+        self.occupancy.record(self.now(), 0)
+        self.plates = PlateIndex()
+        self._rebuild_indexes()
+
+    def apply_event(self, event):
+        # Re-apply a recorded event without re-deciding spots or fees, used
+        # when replaying a journal. Listeners are not notified.
+        op = event["op"]
+        if op == "park":
+            vehicle = ParkedVehicle.from_dict(event)
+            self._occupy(event["spot"], vehicle)
+            self.occupancy.record(vehicle.entry_ts, len(self.parked_vehicles))
+        elif op == "exit":
+            record = SessionRecord.from_dict(event["record"])
+            self._close_session(record)
+            self._release(event["spot"])
+            self.occupancy.record(record.exit_ts, len(self.parked_vehicles))
+        elif op == "reserve":
+            # Events from before time windows only carry the spot
+            self._hold(Reservation.from_dict(event), self.now())
+        elif op == "activate":
+            self.reserved_spots.add(event["spot"])
+        elif op == "cancel":
+            reservation = self.reservations.find(event["spot"], event["start_ts"])
+            if reservation is not None:
+                self._unhold(reservation, self.now())
+        elif op == "session":
+            self._close_session(SessionRecord.from_dict(event["record"]))
+        elif op == "batch":
+            for inner in event["events"]:
+                self.apply_event(inner)
+        elif op == "clear":
+            self._reset()
+        else:
+            raise ParkingError(f"Unknown event {op}!")
+
+    def state_dict(self):
+        # Live state only, without the session history
+        return {
+            "parked_vehicles": {
+                spot: vehicle.to_dict() for spot, vehicle in self.parked_vehicles.items()
+            },
+            "reserved_spots": list(self.reserved_spots),
+            "reservations": [reservation.to_dict() for reservation in self.reservations]
+        }
+
+    def to_dict(self):
+        # Archived sessions live in their own files
+        history = getattr(self.history, "hot", self.history)
+        return dict(self.state_dict(), history=[record.to_dict() for record in history])
+
+    def load_dict(self, data, history=None):
+        parked = {
+            int(spot_str): ParkedVehicle.from_dict(info)
+            for spot_str, info in data.get("parked_vehicles", {}).items()
+        }
+        if history is None:
+            history = MemoryHistory(SessionRecord.from_dict(h) for h in data.get("history", []))
+        if "reservations" in data:
+            reservations = [Reservation.from_dict(r) for r in data["reservations"]]
+        else:
+            reservations = data.get("reserved_spots", [])
+        self.load_state(parked, reservations, history)
+
+    def load_state(self, parked_vehicles, reservations, history):
+        # Reservations may also be bare spot numbers (older data), which are
+        # held until cancelled. Holds that ran out while the system was down
+        # are released by the next update_reservations().
+        now = self.now()
+        reservations = list(reservations)
+        self.parked_vehicles = dict(parked_vehicles)
+        self.history = history
+        # Live series from now on; the past is rebuilt by OccupancyBackfill
+        self.occupancy = OccupancySeries()
+        self.occupancy.record(now, len(self.parked_vehicles))
+        self.reservations.clear()
+        self.reserved_spots = set()
+        self.plates = PlateIndex()
+        for reservation in reservations:
+            if not isinstance(reservation, Reservation):
+                reservation = Reservation(reservation, "", 0)
+            self._hold(reservation, now)
+        self._rebuild_indexes()
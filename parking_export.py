@@ -0,0 +1,244 @@
+import argparse
+import csv
+import json
+import os
+import time
+from array import array
+from parking_jobs import BackgroundJob
+from parking_records import LEGACY_ENTRY_FORMAT, format_time
+
+EXPORT_CHUNK = 10000
+
+# (name, type) per dataset; "q" and "d" are array typecodes
+SESSION_COLUMNS = (("vehicle", "str"), ("type", "str"), ("owner", "str"),
+                   ("entry_ts", "q"), ("exit_ts", "q"), ("entry_time", "str"), ("exit_time", "str"),
+                   ("duration", "d"), ("fee", "d"))
+DAILY_COLUMNS = (("day", "str"), ("sessions", "q"), ("revenue", "d"))
+OCCUPANCY_COLUMNS = (("ts", "q"), ("time", "str"), ("mean", "d"), ("peak", "q"))
+PARKED_COLUMNS = (("spot", "q"), ("vehicle", "str"), ("type", "str"), ("owner", "str"),
+                  ("phone", "str"), ("entry_ts", "q"))
+
+
+class CsvWriter:
+    extension = ".csv"
+
+    def __init__(self, base, name, columns):
+        self.path = f"{base}_{name}{self.extension}"
+        self._file = open(self.path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([column for column, _ in columns])
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonLinesWriter:
+    extension = ".jsonl"
+
+    def __init__(self, base, name, columns):
+        self.path = f"{base}_{name}{self.extension}"
+        self.names = [column for column, _ in columns]
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def write(self, rows):
+        names = self.names
+        self._file.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n"
+                              for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class ColumnarWriter:
+    # One directory per dataset with a file per column: numbers as raw
+    # little-endian arrays (numpy.fromfile reads them directly), strings one
+    # per line, and schema.json describing both
+    extension = ""
+
+    def __init__(self, base, name, columns):
+        self.path = f"{base}_{name}"
+        self.columns = columns
+        self.rows = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._files = [open(os.path.join(self.path, column + (".txt" if kind == "str" else ".bin")), "wb")
+                       for column, kind in columns]
+
+    def write(self, rows):
+        for index, (column, kind) in enumerate(self.columns):
+            values = [row[index] for row in rows]
+            if kind == "str":
+                text = "".join(str(value).replace("\n", " ") + "\n" for value in values)
+                self._files[index].write(text.encode("utf-8"))
+            else:
+                data = array(kind, values)
+                if data.itemsize > 1 and array('H', [1]).tobytes()[0] != 1:
+                    data.byteswap()
+                data.tofile(self._files[index])
+        self.rows += len(rows)
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        schema = {
+            "rows": self.rows,
+            "columns": [{"name": column, "type": {"str": "utf8-lines", "q": "int64", "d": "float64"}[kind]}
+                        for column, kind in self.columns]
+        }
+        with open(os.path.join(self.path, "schema.json"), "w") as f:
+            json.dump(schema, f, indent=2)
+
+
+EXPORT_FORMATS = {
+    "csv": CsvWriter,
+    "jsonl": JsonLinesWriter,
+    "columnar": ColumnarWriter,
+}
+
+
+def chunked(rows, size=EXPORT_CHUNK):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ExportJob(BackgroundJob):
+    # Writes a report in chunks: a text summary, then the sessions, per-day
+    # revenue, hourly occupancy and parked vehicles as datasets in the
+    # chosen format. Small datasets are copied when the job is created (on
+    # the thread that owns the engine); sessions are paged from a reader of
+    # the history while the job runs. run() can be called inline or on a
+    # worker thread with start(); `written`/`total` report progress and
+    # setting `cancelled` stops at the next chunk.
+    name = "report-export"
+
+    def __init__(self, engine, base_path, fmt="csv", start_day=None, end_day=None,
+                 chunk_size=EXPORT_CHUNK):
+        super().__init__()
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt}")
+        self.base_path = base_path
+        self.writer = EXPORT_FORMATS[fmt]
+        self.start_day = start_day
+        self.end_day = end_day
+        self.chunk_size = chunk_size
+        self.total = engine.history.count(start_day=start_day, end_day=end_day)
+        # The worker reads through its own SQLite connection or its own copy
+        # of the in-memory rows, which the engine keeps appending to and
+        # archiving trims from the front
+        self.history = engine.history
+        self.reader = engine.history.open_reader() if hasattr(engine.history, "open_reader") \
+            else engine.history
+        self.written = 0
+        self.files = []
+
+        now = engine.now()
+        stats = engine.history.stats
+        self.daily = [(day, stats.sessions_by_day[day], stats.revenue_by_day[day])
+                      for day in sorted(stats.revenue_by_day)
+                      if (not start_day or day >= start_day) and (not end_day or day <= end_day)]
+        self.occupancy = [(ts, format_time(ts, LEGACY_ENTRY_FORMAT), mean, peak)
+                          for ts, mean, peak in engine.occupancy.series("hour")]
+        self.parked = [(spot, v.vehicle, v.type.value, v.owner, v.phone, v.entry_ts)
+                       for spot, v in sorted(engine.parked_vehicles.items())]
+        self.summary = [
+            "PARKING MANAGEMENT SYSTEM - REPORT",
+            f"Generated: {format_time(now)}",
+            f"Period: {start_day or 'start'} to {end_day or 'today'}",
+            "=" * 60,
+            "",
+            "CURRENT STATUS:",
+            f"Total Spots: {engine.total_spots}",
+            f"Occupied: {engine.occupied_count}",
+            f"Available: {engine.available_count}",
+            f"Reserved: {len(engine.reserved_spots)}",
+            "",
+            f"Revenue in period: ₹{sum(revenue for _, _, revenue in self.daily):.2f}",
+            f"Transactions in period: {self.total}",
+            f"Peak occupancy: {engine.occupancy.peak}/{engine.total_spots}",
+            "",
+            "CURRENTLY PARKED VEHICLES:",
+            "-" * 60,
+        ] + [f"Spot {spot}: {vehicle} ({vtype}) - {owner}" for spot, vehicle, vtype, owner, _, _ in self.parked]
+
+    @property
+    def progress(self):
+        return self.written / self.total if self.total else 1.0
+
+    def work(self):
+        self._write_summary()
+        self._write("sessions", SESSION_COLUMNS, self._session_chunks(self.reader))
+        self._write("daily", DAILY_COLUMNS, chunked(self.daily, self.chunk_size))
+        self._write("occupancy", OCCUPANCY_COLUMNS, chunked(self.occupancy, self.chunk_size))
+        self._write("parked", PARKED_COLUMNS, chunked(self.parked, self.chunk_size))
+
+    def finish(self):
+        if self.reader is not self.history:
+            self.reader.close()
+
+    def _write_summary(self):
+        path = f"{self.base_path}_summary.txt"
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in self.summary)
+        self.files.append(path)
+
+    def _write(self, name, columns, chunks):
+        writer = self.writer(self.base_path, name, columns)
+        self.files.append(writer.path)
+        try:
+            for chunk in chunks:
+                if self.cancelled:
+                    break
+                writer.write(chunk)
+        finally:
+            writer.close()
+
+    def _session_chunks(self, history):
+        # Oldest first; sessions closed after the job started are past the
+        # end and not included
+        offset = 0
+        while offset < self.total and not self.cancelled:
+            page = history.page(offset, min(self.chunk_size, self.total - offset), sort="exit",
+                                descending=False, start_day=self.start_day, end_day=self.end_day)
+            if not page:
+                break
+            yield [(r.vehicle, r.type.value, r.owner, r.entry_ts, r.exit_ts,
+                    format_time(r.entry_ts, LEGACY_ENTRY_FORMAT), format_time(r.exit_ts, LEGACY_ENTRY_FORMAT),
+                    r.duration, r.fee) for r in page]
+            offset += len(page)
+            self.written = offset
+
+
+def main():
+    from parking_cli import add_lot_arguments, open_lot
+
+    parser = argparse.ArgumentParser(description="Export parking sessions and statistics")
+    add_lot_arguments(parser)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--from", dest="start_day", help="first exit day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end_day", help="last exit day, YYYY-MM-DD")
+    parser.add_argument("--output", default=f"parking_report_{time.strftime('%Y%m%d_%H%M%S')}",
+                        help="path prefix for the exported files")
+    args = parser.parse_args()
+
+    engine, storage = open_lot(args, backfill=True)
+    try:
+        job = ExportJob(engine, args.output, args.format, args.start_day, args.end_day)
+        job.run()
+    finally:
+        storage.close(engine)
+    if job.error is not None:
+        raise job.error
+    for path in job.files:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
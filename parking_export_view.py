@@ -0,0 +1,97 @@
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+from datetime import datetime
+from parking_export import EXPORT_FORMATS, ExportJob
+
+EXPORT_POLL_MS = 100
+
+
+class ExportDialog:
+    # Export options and a progress bar. The job runs on a worker thread and
+    # is polled from the Tk loop, so the window stays responsive while a
+    # long history is written out; closing the dialog cancels it.
+    def __init__(self, root, engine):
+        self.root = root
+        self.engine = engine
+        self.job = None
+
+        self.window = tk.Toplevel(root)
+        self.window.title("Export Report")
+        self.window.configure(bg="#34495e")
+        self.window.resizable(False, False)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        form = tk.Frame(self.window, bg="#34495e")
+        form.pack(fill=tk.X, padx=15, pady=(15, 5))
+
+        tk.Label(form, text="Format:", bg="#34495e", fg="#ecf0f1").grid(row=0, column=0, sticky="w")
+        self.format_box = ttk.Combobox(form, values=list(EXPORT_FORMATS), width=10, state="readonly")
+        self.format_box.set("csv")
+        self.format_box.grid(row=0, column=1, sticky="w", padx=5, pady=3)
+
+        tk.Label(form, text="From:", bg="#34495e", fg="#ecf0f1").grid(row=1, column=0, sticky="w")
+        self.start_entry = tk.Entry(form, width=12)
+        self.start_entry.grid(row=1, column=1, sticky="w", padx=5, pady=3)
+
+        tk.Label(form, text="To:", bg="#34495e", fg="#ecf0f1").grid(row=2, column=0, sticky="w")
+        self.end_entry = tk.Entry(form, width=12)
+        self.end_entry.grid(row=2, column=1, sticky="w", padx=5, pady=3)
+
+        self.progress = ttk.Progressbar(self.window, length=300, maximum=1.0)
+        self.progress.pack(padx=15, pady=5)
+        self.status_label = tk.Label(self.window, text="", bg="#34495e", fg="#95a5a6")
+        self.status_label.pack()
+
+        buttons = tk.Frame(self.window, bg="#34495e")
+        buttons.pack(pady=(5, 15))
+        self.export_button = tk.Button(buttons, text="Export", command=self.start,
+                                       bg="#16a085", fg="white", cursor="hand2", width=10)
+        self.export_button.pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Cancel", command=self.close,
+                  bg="#7f8c8d", fg="white", cursor="hand2", width=10).pack(side=tk.LEFT, padx=5)
+
+    def start(self):
+        days = []
+        for entry in (self.start_entry, self.end_entry):
+            day = entry.get().strip()
+            if day:
+                try:
+                    datetime.strptime(day, '%Y-%m-%d')
+                except ValueError:
+                    messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format!", parent=self.window)
+                    return
+            days.append(day or None)
+
+        base_path = filedialog.asksaveasfilename(
+            parent=self.window, title="Export report as",
+            initialfile=f"parking_report_{datetime.fromtimestamp(self.engine.now()).strftime('%Y%m%d_%H%M%S')}")
+        if not base_path:
+            return
+
+        self.job = ExportJob(self.engine, base_path, self.format_box.get(), *days)
+        self.job.start()
+        self.export_button.config(state=tk.DISABLED)
+        self.root.after(EXPORT_POLL_MS, self.check_job)
+
+    def check_job(self):
+        job = self.job
+        if job is None:
+            return
+        self.progress["value"] = job.progress
+        self.status_label.config(text=f"{job.written:,} of {job.total:,} sessions")
+        if not job.done.is_set():
+            self.root.after(EXPORT_POLL_MS, self.check_job)
+            return
+
+        self.job = None
+        self.window.destroy()
+        if job.error is not None:
+            messagebox.showerror("Error", f"Export failed: {job.error}")
+        else:
+            messagebox.showinfo("Success", "Report exported successfully!\n\n" + "\n".join(job.files))
+
+    def close(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+        self.window.destroy()
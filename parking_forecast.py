@@ -0,0 +1,299 @@
+import argparse
+import math
+import time
+from array import array
+from parking_jobs import BackgroundJob
+from parking_occupancy import HOUR, WEEK_HOURS, utc_offset
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Minutes ahead served by AvailabilityForecast
+FORECAST_HORIZONS = (15, 30, 60)
+# Stays are binned by this many seconds; anything past the last bin (24 h)
+# lands in it
+DWELL_BIN = 300
+DWELL_BINS = 288
+# Arrival hours with fewer sessions than this use the lot-wide dwell profile
+MIN_SLOT_SESSIONS = 20
+# A cached forecast is recomputed at most once a second while the lot
+# changes, and at least once a minute while it does not
+FORECAST_MIN_INTERVAL = 1
+FORECAST_TTL = 60
+# The learned profiles are re-derived from the counts at most this often
+MODEL_REFRESH = 300
+# Arrivals inside a horizon are summed in steps of this many seconds
+ARRIVAL_STEP = 300
+WEEK = WEEK_HOURS * HOUR
+
+
+def week_hour(ts, offset):
+    # Hour-of-week slot, Monday 00:00 first, as in OccupancySeries
+    hours = (ts + offset) // HOUR
+    return ((hours // 24 + 3) % 7) * 24 + hours % 24
+
+
+class ForecastProfile:
+    # What the history says about traffic: arrivals per hour of the week and
+    # a histogram of stay lengths per arrival hour. Only counts, so profiles
+    # built from different stretches of history add up, and a closing
+    # session is one add().
+    def __init__(self, offset):
+        # One UTC offset for every timestamp, as Tariff does, so the NumPy
+        # and the plain path agree; AvailabilityForecast takes it from the
+        # engine's clock
+        self.offset = offset
+        self.arrivals = array('d', [0.0]) * WEEK_HOURS
+        self.dwell = array('d', [0.0]) * (WEEK_HOURS * DWELL_BINS)
+        self.sessions = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.version = 0
+
+    def add(self, entry_ts, exit_ts):
+        slot = week_hour(entry_ts, self.offset)
+        self.arrivals[slot] += 1
+        self.dwell[slot * DWELL_BINS + min(max(0, exit_ts - entry_ts) // DWELL_BIN, DWELL_BINS - 1)] += 1
+        self.sessions += 1
+        self._span(entry_ts, entry_ts)
+        self.version += 1
+
+    def add_columns(self, entry_ts, exit_ts):
+        # Whole history columns at once; one NumPy pass when NumPy is
+        # installed, a plain loop otherwise
+        if np is None:
+            for entry, exit_ in zip(entry_ts, exit_ts):
+                self.add(entry, exit_)
+            return
+        entry = np.asarray(entry_ts, dtype=np.int64)
+        if not len(entry):
+            return
+        stay = np.asarray(exit_ts, dtype=np.int64) - entry
+        slots = week_hour(entry, self.offset)
+        bins = np.clip(stay // DWELL_BIN, 0, DWELL_BINS - 1)
+        arrivals = np.frombuffer(self.arrivals, dtype=np.float64) + np.bincount(slots, minlength=WEEK_HOURS)
+        dwell = np.frombuffer(self.dwell, dtype=np.float64) + \
+            np.bincount(slots * DWELL_BINS + bins, minlength=WEEK_HOURS * DWELL_BINS)
+        self.arrivals = array('d', arrivals.tobytes())
+        self.dwell = array('d', dwell.tobytes())
+        self.sessions += len(entry)
+        self._span(int(entry.min()), int(entry.max()))
+        self.version += 1
+
+    def _span(self, first, last):
+        if self.first_ts is None or first < self.first_ts:
+            self.first_ts = first
+        if self.last_ts is None or last > self.last_ts:
+            self.last_ts = last
+
+    def merge(self, other):
+        for slot in range(WEEK_HOURS):
+            self.arrivals[slot] += other.arrivals[slot]
+        for index in range(WEEK_HOURS * DWELL_BINS):
+            self.dwell[index] += other.dwell[index]
+        self.sessions += other.sessions
+        if other.first_ts is not None:
+            self._span(other.first_ts, other.last_ts)
+        self.version += 1
+
+    def model(self):
+        # (arrivals per second for each hour of the week, survival table:
+        # per hour of the week, the share of stays lasting at least k bins,
+        # mean stay in seconds)
+        weeks = max(1.0, (self.last_ts - self.first_ts) / WEEK) if self.sessions else 1.0
+        rates = [count / weeks / HOUR for count in self.arrivals]
+        if np is not None:
+            counts = np.frombuffer(self.dwell, dtype=np.float64).reshape(WEEK_HOURS, DWELL_BINS)
+            overall = counts.sum(axis=0)
+            totals = counts.sum(axis=1)
+            sparse = totals < MIN_SLOT_SESSIONS
+            counts = np.where(sparse[:, None], overall, counts)
+            totals = np.where(sparse, overall.sum(), totals)
+            tails = counts[:, ::-1].cumsum(axis=1)[:, ::-1]
+            survival = np.divide(tails, totals[:, None], out=np.zeros_like(tails), where=totals[:, None] > 0)
+            stays = (overall * (np.arange(DWELL_BINS) + 0.5)).sum() * DWELL_BIN
+            mean = stays / overall.sum() if overall.sum() else float(HOUR)
+            return rates, survival.tolist(), mean
+
+        def tail_shares(counts, total):
+            shares = [0.0] * DWELL_BINS
+            running = 0.0
+            for k in range(DWELL_BINS - 1, -1, -1):
+                running += counts[k]
+                shares[k] = running / total if total else 0.0
+            return shares
+
+        overall = [0.0] * DWELL_BINS
+        per_slot = []
+        for slot in range(WEEK_HOURS):
+            counts = self.dwell[slot * DWELL_BINS:(slot + 1) * DWELL_BINS]
+            per_slot.append(counts)
+            for k, count in enumerate(counts):
+                overall[k] += count
+        total = sum(overall)
+        overall_survival = tail_shares(overall, total)
+        survival = []
+        for counts in per_slot:
+            slot_total = sum(counts)
+            survival.append(overall_survival if slot_total < MIN_SLOT_SESSIONS
+                            else tail_shares(counts, slot_total))
+        mean = sum(count * (k + 0.5) for k, count in enumerate(overall)) * DWELL_BIN / total if total else float(HOUR)
+        return rates, survival, mean
+
+
+class AvailabilityForecast:
+    # Expected free spots a few minutes ahead: what is free now, plus the
+    # parked vehicles likely to have left by then given how long they have
+    # stayed, minus the arrivals likely to still be parked. Engine events
+    # keep the profile current and mark the cached answer stale; forecast()
+    # only recomputes when it is stale and a second has passed, so signage
+    # can poll it as often as it likes. Call it on the engine's thread.
+    def __init__(self, engine, horizons=FORECAST_HORIZONS):
+        self.engine = engine
+        self.horizons = horizons
+        self.profile = ForecastProfile(utc_offset(int(engine.now())))
+        self._model = None
+        self._model_version = -1
+        self._model_ts = None
+        self._cache = None
+        self._cache_ts = None
+        self.dirty = True
+        self.refreshes = 0
+
+    def on_event(self, event):
+        op = event["op"]
+        if op == "batch":
+            for inner in event["events"]:
+                self.on_event(inner)
+            return
+        if op in ("exit", "session"):
+            record = event["record"]
+            self.profile.add(record["entry_ts"], record["exit_ts"])
+        elif op == "clear":
+            self.profile = ForecastProfile(self.profile.offset)
+            self._model = None
+        self.dirty = True
+
+    def install(self, profile):
+        # Sessions a ForecastBuild counted in the background
+        self.profile.merge(profile)
+        self._model = None
+        self.dirty = True
+
+    def forecast(self, now=None):
+        now = self.engine.now() if now is None else now
+        age = None if self._cache_ts is None else now - self._cache_ts
+        if age is None or age >= FORECAST_TTL or age < 0 or (self.dirty and age >= FORECAST_MIN_INTERVAL):
+            self.refresh(now)
+        return self._cache
+
+    def refresh(self, now):
+        profile = self.profile
+        if self._model is None or (profile.version != self._model_version
+                                   and now - self._model_ts >= MODEL_REFRESH):
+            self._model = profile.model()
+            self._model_version = profile.version
+            self._model_ts = now
+        rates, survival, mean = self._model
+        engine = self.engine
+        offset = profile.offset
+        available = engine.available_count
+
+        def surviving(table, seconds):
+            return table[min(max(0, seconds) // DWELL_BIN, DWELL_BINS - 1)]
+
+        parked = [(survival[week_hour(vehicle.entry_ts, offset)], now - vehicle.entry_ts)
+                  for vehicle in engine.parked_vehicles.values()]
+        expected = {}
+        for minutes in self.horizons:
+            horizon = minutes * 60
+            leaving = 0.0
+            for table, stayed in parked:
+                still = surviving(table, stayed)
+                if still > 0:
+                    leaving += 1 - surviving(table, stayed + horizon) / still
+                else:
+                    # Longer than any stay on record
+                    leaving += 1 - math.exp(-horizon / mean)
+            arriving = 0.0
+            for start in range(0, horizon, ARRIVAL_STEP):
+                step = min(ARRIVAL_STEP, horizon - start)
+                ts = now + start + step // 2
+                slot = week_hour(ts, offset)
+                arriving += rates[slot] * step * surviving(survival[slot], now + horizon - ts)
+            expected[str(minutes)] = round(min(engine.total_spots, max(0.0, available + leaving - arriving)), 1)
+        self._cache = {"at": now, "available": available, "occupied": engine.occupied_count,
+                       "sessions_learned": profile.sessions, "expected_free": expected}
+        self._cache_ts = now
+        self.dirty = False
+        self.refreshes += 1
+
+
+class ForecastBuild(BackgroundJob):
+    # Counts the session history into a ForecastProfile on a background
+    # thread. Create it after the forecast is subscribed to the engine, so
+    # sessions closing meanwhile are counted there instead; install(forecast)
+    # must run on the thread that owns the engine.
+    name = "forecast-build"
+
+    def __init__(self, engine, forecast):
+        super().__init__()
+        # Hot sessions are read on the worker through a reader of the hot
+        # tier, up to the ones held now; later ones reach the forecast as
+        # events
+        history = engine.history
+        self.archive = getattr(history, "archive", None)
+        self.hot = getattr(history, "hot", history)
+        self.reader = self.hot.open_reader()
+        self.rows = len(self.hot)
+        self.offset = forecast.profile.offset
+        self.profile = None
+
+    def work(self):
+        profile = ForecastProfile(self.offset)
+        if self.archive is not None:
+            for partition in self.archive.select():
+                columns = partition.columns()
+                profile.add_columns(columns["entry_ts"], columns["exit_ts"])
+        columns = self.reader.columns()
+        profile.add_columns(columns["entry_ts"][:self.rows], columns["exit_ts"][:self.rows])
+        self.profile = profile
+
+    def finish(self):
+        if self.reader is not self.hot:
+            self.reader.close()
+
+    def apply(self, forecast):
+        forecast.install(self.profile)
+
+
+def main():
+    from parking_cli import add_lot_arguments, open_lot
+
+    parser = argparse.ArgumentParser(description="Forecast free spots from the stored history")
+    add_lot_arguments(parser)
+    args = parser.parse_args()
+
+    engine, storage = open_lot(args)
+    try:
+        forecast = AvailabilityForecast(engine)
+        started = time.perf_counter()
+        ForecastBuild(engine, forecast).run_now(forecast)
+        learned = time.perf_counter() - started
+        started = time.perf_counter()
+        result = forecast.forecast()
+        computed = time.perf_counter() - started
+    finally:
+        storage.close(engine)
+
+    print(f"Free now: {result['available']} of {engine.total_spots}")
+    for minutes, free in result["expected_free"].items():
+        print(f"Expected free in {minutes} min: {free:.1f}")
+    print(f"Learned {result['sessions_learned']} sessions in {learned * 1000:.0f} ms "
+          f"({'NumPy' if np is not None else 'pure Python'}), forecast in {computed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
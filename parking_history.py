@@ -0,0 +1,333 @@
+import bisect
+import sys
+from array import array
+from collections import defaultdict
+from parking_jobs import BackgroundJob
+from parking_records import (SessionRecord, VEHICLE_TYPE_CODES, VEHICLE_TYPE_LIST,
+                             day_end, day_of, day_start)
+
+# Sortable history columns; "exit" is the order sessions were closed in
+HISTORY_SORT_KEYS = ("exit", "entry", "vehicle", "type", "owner", "duration", "fee")
+
+
+class HistoryStats:
+    # Running aggregates over closed sessions. They are built once when the
+    # history is loaded and then updated on every append, so dashboard
+    # queries cost the same no matter how long the history is.
+    def __init__(self, records=()):
+        self.clear()
+        for record in records:
+            self.add(record)
+
+    def clear(self):
+        self.count = 0
+        self.revenue = 0.0
+        self.duration = 0.0
+        self.revenue_by_day = defaultdict(float)
+        self.sessions_by_day = defaultdict(int)
+        self.type_counts = defaultdict(int)
+        self._day = (0, 0, None)
+
+    def day_key(self, ts):
+        # Sessions mostly arrive in exit order, so remember the bounds of the
+        # last day seen instead of formatting every timestamp
+        start, end, day = self._day
+        if not start <= ts < end:
+            day = day_of(ts)
+            self._day = (day_start(day), day_end(day), day)
+        return day
+
+    def add(self, record):
+        self.add_values(record.type, record.exit_ts, record.duration, record.fee)
+
+    def add_values(self, vtype, exit_ts, duration, fee):
+        # Sessions are bucketed by the day they ended, so a new day simply
+        # starts a new bucket
+        day = self.day_key(exit_ts)
+        self.count += 1
+        self.revenue += fee
+        self.duration += duration
+        self.revenue_by_day[day] += fee
+        self.sessions_by_day[day] += 1
+        self.type_counts[vtype] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.revenue += other.revenue
+        self.duration += other.duration
+        for day, revenue in other.revenue_by_day.items():
+            self.revenue_by_day[day] += revenue
+        for day, sessions in other.sessions_by_day.items():
+            self.sessions_by_day[day] += sessions
+        for vtype, count in other.type_counts.items():
+            self.type_counts[vtype] += count
+
+    def load_totals(self, duration, day_rows, type_rows):
+        # Seed from pre-aggregated rows: (day, sessions, revenue) and (type, count)
+        self.clear()
+        self.duration = duration
+        for day, sessions, revenue in day_rows:
+            self.count += sessions
+            self.revenue += revenue
+            self.sessions_by_day[day] = sessions
+            self.revenue_by_day[day] = revenue
+        for vtype, count in type_rows:
+            self.type_counts[vtype] = count
+
+
+class HistoryQueries:
+    # Aggregate queries shared by the history implementations
+    def revenue_for_day(self, day):
+        return self.stats.revenue_by_day.get(day, 0)
+
+    def total_revenue(self):
+        return self.stats.revenue
+
+    def duration_stats(self):
+        # (sessions, total hours, average hours)
+        count = self.stats.count
+        return count, self.stats.duration, (self.stats.duration / count if count else 0.0)
+
+    def type_counts(self):
+        return dict(self.stats.type_counts)
+
+
+class MemoryHistory(HistoryQueries):
+    # In-memory session history stored column by column: compact arrays for
+    # timestamps, durations, fees and type codes, interned strings for plates
+    # and owners. SessionRecord objects are only built when rows are read.
+    # Storage backends can swap in their own history object as long as it
+    # offers the same query methods.
+    def __init__(self, records=()):
+        self.vehicles = []
+        self.owners = []
+        self.types = array('B')
+        self.entry_ts = array('q')
+        self.exit_ts = array('q')
+        self.durations = array('d')
+        self.fees = array('d')
+        self.stats = HistoryStats()
+        # Sessions dropped from the front, so cursors stay valid
+        self.base = 0
+        self._version = 0
+        self._query_cache = None
+        self.extend(records)
+
+    def __len__(self):
+        return len(self.exit_ts)
+
+    def __getitem__(self, index):
+        return SessionRecord(self.vehicles[index], VEHICLE_TYPE_LIST[self.types[index]],
+                             self.owners[index], self.entry_ts[index], self.exit_ts[index],
+                             self.durations[index], self.fees[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, record):
+        self.vehicles.append(sys.intern(record.vehicle))
+        self.owners.append(sys.intern(record.owner))
+        self.types.append(VEHICLE_TYPE_CODES[record.type])
+        self.entry_ts.append(record.entry_ts)
+        self.exit_ts.append(record.exit_ts)
+        self.durations.append(record.duration)
+        self.fees.append(record.fee)
+        self.stats.add(record)
+        self._version += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def extend_columns(self, columns):
+        # Append rows given column by column, as columns() returns them
+        intern = sys.intern
+        self.vehicles += [intern(vehicle) for vehicle in columns["vehicle"]]
+        self.owners += [intern(owner) for owner in columns["owner"]]
+        self.types.extend(columns["type"])
+        self.entry_ts.extend(columns["entry_ts"])
+        self.exit_ts.extend(columns["exit_ts"])
+        self.durations.extend(columns["duration"])
+        self.fees.extend(columns["fee"])
+        add_values = self.stats.add_values
+        for code, exit_ts, duration, fee in zip(columns["type"], columns["exit_ts"],
+                                                columns["duration"], columns["fee"]):
+            add_values(VEHICLE_TYPE_LIST[code], exit_ts, duration, fee)
+        self._version += 1
+
+    @classmethod
+    def from_columns(cls, columns):
+        history = cls()
+        history.extend_columns(columns)
+        return history
+
+    def clear(self):
+        self.__init__()
+
+    def open_reader(self):
+        # A copy of the rows held now, sharing the aggregates, to hand to one
+        # worker thread: appends, drops and the query cache here do not
+        # reach it. Call this on the owner's thread.
+        reader = MemoryHistory()
+        reader.vehicles = self.vehicles[:]
+        reader.owners = self.owners[:]
+        reader.types = self.types[:]
+        reader.entry_ts = self.entry_ts[:]
+        reader.exit_ts = self.exit_ts[:]
+        reader.durations = self.durations[:]
+        reader.fees = self.fees[:]
+        reader.stats = self.stats
+        reader.base = self.base
+        return reader
+
+    def close(self):
+        pass
+
+    def prepend(self, older):
+        # Put sessions that closed before everything already held (e.g. loaded
+        # later in the background) in front
+        self.vehicles = older.vehicles + self.vehicles
+        self.owners = older.owners + self.owners
+        self.types = older.types + self.types
+        self.entry_ts = older.entry_ts + self.entry_ts
+        self.exit_ts = older.exit_ts + self.exit_ts
+        self.durations = older.durations + self.durations
+        self.fees = older.fees + self.fees
+        self.stats.merge(older.stats)
+        self._version += 1
+
+    def drop_before(self, ts):
+        # Forget the sessions that ended before `ts` (archived elsewhere);
+        # returns how many
+        count = bisect.bisect_left(self.exit_ts, ts)
+        if not count:
+            return 0
+        self.vehicles = self.vehicles[count:]
+        self.owners = self.owners[count:]
+        self.types = self.types[count:]
+        self.entry_ts = self.entry_ts[count:]
+        self.exit_ts = self.exit_ts[count:]
+        self.durations = self.durations[count:]
+        self.fees = self.fees[count:]
+        self.stats = HistoryStats()
+        for index in range(len(self)):
+            self.stats.add_values(VEHICLE_TYPE_LIST[self.types[index]], self.exit_ts[index],
+                                  self.durations[index], self.fees[index])
+        self.base += count
+        self._version += 1
+        return count
+
+    def columns(self, start_day=None, end_day=None):
+        # Raw columns for bulk (e.g. NumPy) processing; types are codes into
+        # VEHICLE_TYPE_LIST. A day range is a slice, copied; the full
+        # history is returned without copying.
+        columns = {
+            "vehicle": self.vehicles,
+            "owner": self.owners,
+            "type": self.types,
+            "entry_ts": self.entry_ts,
+            "exit_ts": self.exit_ts,
+            "duration": self.durations,
+            "fee": self.fees
+        }
+        if not start_day and not end_day:
+            return columns
+        lo, hi = self._day_range(start_day, end_day)
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def _day_range(self, start_day, end_day):
+        # Sessions are appended in exit order, so a date range is a slice
+        lo, hi = 0, len(self)
+        if start_day:
+            lo = bisect.bisect_left(self.exit_ts, day_start(start_day))
+        if end_day:
+            hi = bisect.bisect_left(self.exit_ts, day_end(end_day))
+        return lo, hi
+
+    def recent(self, limit):
+        return [self[i] for i in range(len(self) - 1, max(-1, len(self) - 1 - limit), -1)]
+
+    def find_by_plate(self, vehicle_num):
+        return [self[i] for i, plate in enumerate(self.vehicles) if plate == vehicle_num]
+
+    def cursor(self):
+        # Position after the latest session, for plate_counts()
+        return self.base + len(self)
+
+    def plate_counts(self, after=None, upto=None):
+        # (plate, sessions, last exit) for the sessions between two cursors
+        counts = {}
+        last_seen = {}
+        exit_ts = self.exit_ts
+        base = self.base
+        for index in range(max(0, (after or 0) - base), len(self) if upto is None else max(0, upto - base)):
+            plate = self.vehicles[index]
+            counts[plate] = counts.get(plate, 0) + 1
+            last_seen[plate] = exit_ts[index]
+        return [(plate, count, last_seen[plate]) for plate, count in counts.items()]
+
+    def _sort_column(self, sort):
+        if sort == "type":
+            return [VEHICLE_TYPE_LIST[code].value for code in self.types]
+        return {
+            "entry": self.entry_ts,
+            "vehicle": self.vehicles,
+            "owner": self.owners,
+            "duration": self.durations,
+            "fee": self.fees
+        }[sort]
+
+    def _select(self, sort="exit", plate=None, vtype=None, start_day=None, end_day=None):
+        # Row numbers matching a query, in ascending sort order. The last
+        # result is cached until the history changes, so paging through one
+        # query only pays for the filter and sort once.
+        if sort not in HISTORY_SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sort}")
+        key = (self._version, sort, plate, vtype, start_day, end_day)
+        if self._query_cache is not None and self._query_cache[0] == key:
+            return self._query_cache[1]
+
+        lo, hi = self._day_range(start_day, end_day)
+        rows = range(lo, hi)
+        if plate:
+            vehicles = self.vehicles
+            rows = [i for i in rows if vehicles[i].startswith(plate)]
+        if vtype:
+            code, types = VEHICLE_TYPE_CODES[vtype], self.types
+            rows = [i for i in rows if types[i] == code]
+        if sort != "exit":
+            column = self._sort_column(sort)
+            rows = sorted(rows, key=column.__getitem__)
+
+        self._query_cache = (key, rows)
+        return rows
+
+    def count(self, **filters):
+        return len(self._select(**filters))
+
+    def page(self, offset, limit, sort="exit", descending=True, **filters):
+        rows = self._select(sort, **filters)
+        if descending:
+            start = max(0, len(rows) - offset - limit)
+            stop = max(0, len(rows) - offset)
+            return [self[i] for i in reversed(rows[start:stop])]
+        return [self[i] for i in rows[offset:offset + limit]]
+
+
+class HistoryWarmup(BackgroundJob):
+    # Builds the older part of a history from a record iterator, either
+    # inline or on a background thread. install(engine) must run on the
+    # thread that owns the engine.
+    name = "history-warmup"
+
+    def __init__(self, read_records):
+        super().__init__()
+        self.read_records = read_records
+        self.history = None
+
+    def work(self):
+        self.history = MemoryHistory(self.read_records())
+
+    def apply(self, engine):
+        engine.history.prepend(self.history)
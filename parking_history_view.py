@@ -0,0 +1,252 @@
+import tkinter as tk
+from tkinter import ttk, messagebox
+from datetime import datetime
+from parking_engine import VEHICLE_TYPES
+from parking_records import format_time
+
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGES = 5
+
+HISTORY_COLUMNS = ("Vehicle", "Type", "Owner", "Entry", "Exit", "Duration", "Fee")
+HISTORY_SORT_COLUMNS = {
+    "Vehicle": "vehicle",
+    "Type": "type",
+    "Owner": "owner",
+    "Entry": "entry",
+    "Exit": "exit",
+    "Duration": "duration",
+    "Fee": "fee"
+}
+
+
+def history_row(record):
+    return (
+        record.vehicle,
+        record.type,
+        record.owner,
+        format_time(record.entry_ts),
+        format_time(record.exit_ts),
+        record.duration,
+        record.fee
+    )
+
+
+class HistoryView:
+    # History grid that only holds a sliding window of pages. Pages are
+    # fetched from the history object as the user scrolls, and sorting and
+    # filtering are done by the history's own query methods, so browsing a
+    # long history keeps the widget (and memory) small.
+    def __init__(self, parent, get_history):
+        self.get_history = get_history
+        self.sort = "exit"
+        self.descending = True
+        self.filters = {}
+        self.window_start = 0
+        self.window_rows = 0
+        self.total = 0
+        self._loading = False
+
+        # Filter bar
+        filter_frame = tk.Frame(parent, bg="#34495e")
+        filter_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+
+        tk.Label(filter_frame, text="Plate:", bg="#34495e", fg="#ecf0f1").pack(side=tk.LEFT)
+        self.plate_entry = tk.Entry(filter_frame, width=12)
+        self.plate_entry.pack(side=tk.LEFT, padx=(2, 8))
+
+        tk.Label(filter_frame, text="Type:", bg="#34495e", fg="#ecf0f1").pack(side=tk.LEFT)
+        self.type_filter = ttk.Combobox(filter_frame, values=["All"] + VEHICLE_TYPES,
+                                        width=7, state="readonly")
+        self.type_filter.set("All")
+        self.type_filter.pack(side=tk.LEFT, padx=(2, 8))
+
+        tk.Label(filter_frame, text="From:", bg="#34495e", fg="#ecf0f1").pack(side=tk.LEFT)
+        self.start_entry = tk.Entry(filter_frame, width=11)
+        self.start_entry.pack(side=tk.LEFT, padx=(2, 8))
+
+        tk.Label(filter_frame, text="To:", bg="#34495e", fg="#ecf0f1").pack(side=tk.LEFT)
+        self.end_entry = tk.Entry(filter_frame, width=11)
+        self.end_entry.pack(side=tk.LEFT, padx=(2, 8))
+
+        tk.Button(filter_frame, text="Apply", command=self.apply_filters,
+                  bg="#16a085", fg="white", cursor="hand2").pack(side=tk.LEFT, padx=2)
+        tk.Button(filter_frame, text="Reset", command=self.reset_filters,
+                  bg="#7f8c8d", fg="white", cursor="hand2").pack(side=tk.LEFT, padx=2)
+
+        self.status_label = tk.Label(filter_frame, text="", bg="#34495e", fg="#95a5a6")
+        self.status_label.pack(side=tk.RIGHT)
+
+        # Grid
+        history_frame = tk.Frame(parent, bg="#34495e")
+        history_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        self.scrollbar = ttk.Scrollbar(history_frame)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree = ttk.Treeview(history_frame, columns=HISTORY_COLUMNS, show="headings",
+                                 yscrollcommand=self.on_tree_scroll, height=12)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        self.scrollbar.config(command=self.tree.yview)
+
+        headings = {"Vehicle": "Vehicle No.", "Type": "Type", "Owner": "Owner",
+                    "Entry": "Entry Time", "Exit": "Exit Time",
+                    "Duration": "Duration (hrs)", "Fee": "Fee (₹)"}
+        for column in HISTORY_COLUMNS:
+            if column in HISTORY_SORT_COLUMNS:
+                self.tree.heading(column, text=headings[column],
+                                  command=lambda c=column: self.sort_by(c))
+            else:
+                self.tree.heading(column, text=headings[column])
+
+        self.tree.column("Vehicle", width=90)
+        self.tree.column("Type", width=60)
+        self.tree.column("Owner", width=90)
+        self.tree.column("Entry", width=120)
+        self.tree.column("Exit", width=120)
+        self.tree.column("Duration", width=90, anchor="center")
+        self.tree.column("Fee", width=70, anchor="center")
+
+    @property
+    def max_rows(self):
+        return HISTORY_PAGE_SIZE * HISTORY_MAX_PAGES
+
+    def fetch(self, offset, limit):
+        return self.get_history().page(offset, limit, sort=self.sort,
+                                       descending=self.descending, **self.filters)
+
+    def reload(self):
+        self.tree.delete(*self.tree.get_children())
+        self.window_start = 0
+        self.window_rows = 0
+        self.total = self.get_history().count(**self.filters)
+        self.load_next()
+        self.tree.yview_moveto(0)
+
+    def apply_filters(self):
+        filters = {}
+        plate = self.plate_entry.get().strip().upper()
+        if plate:
+            filters["plate"] = plate
+        if self.type_filter.get() != "All":
+            filters["vtype"] = self.type_filter.get()
+        for key, entry in (("start_day", self.start_entry), ("end_day", self.end_entry)):
+            day = entry.get().strip()
+            if day:
+                try:
+                    datetime.strptime(day, '%Y-%m-%d')
+                except ValueError:
+                    messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format!")
+                    return
+                filters[key] = day
+        self.filters = filters
+        self.reload()
+
+    def reset_filters(self):
+        for entry in (self.plate_entry, self.start_entry, self.end_entry):
+            entry.delete(0, tk.END)
+        self.type_filter.set("All")
+        self.filters = {}
+        self.sort = "exit"
+        self.descending = True
+        self.reload()
+
+    def sort_by(self, column):
+        key = HISTORY_SORT_COLUMNS[column]
+        if self.sort == key:
+            self.descending = not self.descending
+        else:
+            self.sort = key
+            self.descending = key in ("exit", "entry", "duration", "fee")
+        self.reload()
+
+    def on_tree_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._loading:
+            return
+        if float(last) > 0.9 and self.window_start + self.window_rows < self.total:
+            self.tree.after_idle(self.load_next)
+        elif float(first) < 0.1 and self.window_start > 0:
+            self.tree.after_idle(self.load_previous)
+
+    def top_row(self):
+        # Absolute offset of the first visible row
+        first, _ = self.tree.yview()
+        return self.window_start + int(first * self.window_rows)
+
+    def keep_top_row(self, row):
+        if self.window_rows:
+            self.tree.yview_moveto((row - self.window_start) / self.window_rows)
+
+    def load_next(self):
+        if self._loading:
+            return
+        self._loading = True
+        try:
+            top = self.top_row()
+            records = self.fetch(self.window_start + self.window_rows, HISTORY_PAGE_SIZE)
+            for record in records:
+                self.tree.insert("", tk.END, values=history_row(record))
+            self.window_rows += len(records)
+
+            # Drop pages from the top once the window is full
+            excess = self.window_rows - self.max_rows
+            if excess > 0:
+                self.tree.delete(*self.tree.get_children()[:excess])
+                self.window_start += excess
+                self.window_rows -= excess
+            self.keep_top_row(top)
+        finally:
+            self._loading = False
+        self.update_status()
+
+    def load_previous(self):
+        if self._loading:
+            return
+        self._loading = True
+        try:
+            top = self.top_row()
+            offset = max(0, self.window_start - HISTORY_PAGE_SIZE)
+            records = self.fetch(offset, self.window_start - offset)
+            for index, record in enumerate(records):
+                self.tree.insert("", index, values=history_row(record))
+            self.window_start = offset
+            self.window_rows += len(records)
+
+            # Drop pages from the bottom once the window is full
+            excess = self.window_rows - self.max_rows
+            if excess > 0:
+                self.tree.delete(*self.tree.get_children()[-excess:])
+                self.window_rows -= excess
+            self.keep_top_row(top)
+        finally:
+            self._loading = False
+        self.update_status()
+
+    def matches(self, record):
+        plate = self.filters.get("plate")
+        vtype = self.filters.get("vtype")
+        day = record.exit_day
+        return ((not plate or record.vehicle.startswith(plate))
+                and (not vtype or record.type == vtype)
+                and day >= self.filters.get("start_day", day)
+                and day <= self.filters.get("end_day", day))
+
+    def on_new_record(self, record):
+        if not self.matches(record):
+            return
+        self.total += 1
+        # Newest-first view scrolled to the top: show the session right away
+        if self.sort == "exit" and self.descending and self.window_start == 0:
+            self.tree.insert("", 0, values=history_row(record))
+            self.window_rows += 1
+            if self.window_rows > self.max_rows:
+                self.tree.delete(self.tree.get_children()[-1])
+                self.window_rows -= 1
+        self.update_status()
+
+    def update_status(self):
+        if self.window_rows:
+            self.status_label.config(
+                text=f"Showing {self.window_start + 1}-{self.window_start + self.window_rows} of {self.total}")
+        else:
+            self.status_label.config(text=f"{self.total} sessions")
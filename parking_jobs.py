@@ -0,0 +1,59 @@
+import threading
+
+
+class BackgroundJob:
+    # Work done off the thread that owns the engine. A subclass copies what
+    # it needs from the engine in __init__ (on the owner's thread), does the
+    # slow part in work() and applies the outcome in apply(), which
+    # install() calls back on the owner's thread. run() can be called inline
+    # or on a worker thread with start(); `done` is set once it has
+    # finished, with any exception kept in `error` for install() to raise.
+    # A cancelled job's outcome goes to discard() instead of apply().
+    name = "background-job"
+
+    def __init__(self):
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def work(self):
+        raise NotImplementedError
+
+    def finish(self):
+        # Worker-side cleanup after work(), whether or not it succeeded
+        pass
+
+    def apply(self, *args):
+        raise NotImplementedError
+
+    def discard(self):
+        return None
+
+    def run(self):
+        try:
+            self.work()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finish()
+            self.done.set()
+
+    def start(self):
+        threading.Thread(target=self.run, name=self.name, daemon=True).start()
+        return self
+
+    def run_now(self, *args):
+        # run() and install() on the calling thread, for tools that have
+        # nothing else to do meanwhile
+        self.run()
+        return self.install(*args)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def install(self, *args):
+        if self.error is not None:
+            raise self.error
+        if self.cancelled:
+            return self.discard()
+        return self.apply(*args)
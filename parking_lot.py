@@ -0,0 +1,187 @@
+import heapq
+import json
+from collections import defaultdict
+
+# Bay sizes from smallest to largest; a vehicle fits its own size and up
+SPOT_SIZES = ("small", "standard", "large")
+VEHICLE_SIZES = {"Bike": "small", "Car": "standard", "SUV": "standard", "Truck": "large"}
+DEFAULT_STRATEGY = "nearest"
+
+
+class FreeSpotIndex:
+    # Min-heap of candidate spot numbers, ordered by key(spot). Spots that got
+    # occupied or reserved while sitting in the heap are dropped lazily when
+    # they reach the top.
+    def __init__(self, spots=(), key=None):
+        self.key = key or (lambda spot: spot)
+        self.reset(spots)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, spot):
+        if spot not in self._members:
+            heapq.heappush(self._heap, (self.key(spot), spot))
+            self._members.add(spot)
+
+    def peek(self, is_free):
+        # Priority of the best free spot, or None
+        while self._heap:
+            priority, spot = self._heap[0]
+            if is_free(spot):
+                return priority
+            heapq.heappop(self._heap)
+            self._members.discard(spot)
+        return None
+
+    def pop(self, is_free):
+        if self.peek(is_free) is None:
+            return None
+        _, spot = heapq.heappop(self._heap)
+        self._members.discard(spot)
+        return spot
+
+    def reset(self, spots):
+        self._heap = [(self.key(spot), spot) for spot in spots]
+        heapq.heapify(self._heap)
+        self._members = {spot for _, spot in self._heap}
+
+
+class Spot:
+    __slots__ = ("number", "level", "zone", "size", "distance", "level_rank")
+
+    def __init__(self, number, level, zone, size, distance, level_rank=0):
+        if size not in SPOT_SIZES:
+            raise ValueError(f"Unknown spot size {size}")
+        self.number = number
+        self.level = level
+        self.zone = zone
+        self.size = size
+        self.distance = distance
+        self.level_rank = level_rank
+
+    @property
+    def label(self):
+        return f"{self.level}/{self.zone}"
+
+
+class LotLayout:
+    # Levels, zones and bays of one lot. Bays are numbered 1..N in config
+    # order (level by level, zone by zone), so spot numbers stay the plain
+    # integers the rest of the system uses.
+    def __init__(self, spots):
+        self.spots = {spot.number: spot for spot in spots}
+        self.levels = list(dict.fromkeys(spot.level for spot in spots))
+
+    def __len__(self):
+        return len(self.spots)
+
+    @classmethod
+    def flat(cls, total_spots):
+        # The original single-row lot: every bay takes any vehicle and the
+        # lowest number is the closest to the exit
+        return cls([Spot(number, "Ground", "Main", "large", number)
+                    for number in range(1, total_spots + 1)])
+
+    @classmethod
+    def from_dict(cls, data):
+        # {"levels": [{"name": "G", "distance": 0, "zones": [
+        #     {"name": "A", "distance": 0, "spots": 40, "size": "standard"},
+        #     {"name": "B", "spots": {"small": 20, "large": 6}}]}]}
+        # A zone's bays get increasing distances starting from the level's
+        # plus the zone's own distance to the exit.
+        spots = []
+        for rank, level in enumerate(data["levels"]):
+            for zone in level["zones"]:
+                counts = zone["spots"]
+                if not isinstance(counts, dict):
+                    counts = {zone.get("size", "standard"): counts}
+                distance = level.get("distance", 0) + zone.get("distance", 0)
+                for size, count in counts.items():
+                    for _ in range(count):
+                        spots.append(Spot(len(spots) + 1, level["name"], zone["name"],
+                                          size, distance, rank))
+                        distance += 1
+        if not spots:
+            raise ValueError("Lot layout has no spots")
+        return cls(spots)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+class AllocationStrategy:
+    # Picks a free spot for a vehicle. Free spots sit in one heap per bay
+    # size, ordered by priority(); a vehicle may take any size it fits, and
+    # by default gets the best top across those heaps, so allocation is
+    # O(log n) however large the lot is.
+    def __init__(self, layout):
+        self.layout = layout
+        self.indexes = {size: FreeSpotIndex(key=self.priority) for size in SPOT_SIZES}
+
+    def priority(self, spot):
+        raise NotImplementedError
+
+    def sizes_for(self, vehicle_type):
+        if vehicle_type is None:
+            return SPOT_SIZES
+        return SPOT_SIZES[SPOT_SIZES.index(VEHICLE_SIZES[vehicle_type]):]
+
+    def reset(self, free_spots):
+        by_size = defaultdict(list)
+        for spot in free_spots:
+            by_size[self.layout.spots[spot].size].append(spot)
+        for size, index in self.indexes.items():
+            index.reset(by_size[size])
+
+    def release(self, spot):
+        self.indexes[self.layout.spots[spot].size].push(spot)
+
+    def allocate(self, vehicle_type, is_free):
+        best = None
+        for size in self.sizes_for(vehicle_type):
+            priority = self.indexes[size].peek(is_free)
+            if priority is not None and (best is None or priority < best[0]):
+                best = (priority, size)
+        if best is None:
+            return None
+        return self.indexes[best[1]].pop(is_free)
+
+
+class NearestToExit(AllocationStrategy):
+    def priority(self, spot):
+        return (self.layout.spots[spot].distance, spot)
+
+
+class SizeFit(AllocationStrategy):
+    # Smallest bay the vehicle fits, nearest first, so large bays stay free
+    # for the vehicles that need them
+    def priority(self, spot):
+        return (self.layout.spots[spot].distance, spot)
+
+    def allocate(self, vehicle_type, is_free):
+        for size in self.sizes_for(vehicle_type):
+            spot = self.indexes[size].pop(is_free)
+            if spot is not None:
+                return spot
+        return None
+
+
+class FillLevelFirst(AllocationStrategy):
+    # Fill the first level completely before opening the next one
+    def priority(self, spot):
+        info = self.layout.spots[spot]
+        return (info.level_rank, info.distance, spot)
+
+
+ALLOCATION_STRATEGIES = {
+    "nearest": NearestToExit,
+    "size-fit": SizeFit,
+    "level-first": FillLevelFirst,
+}
+
+
+def create_strategy(name, layout):
+    return ALLOCATION_STRATEGIES[name](layout)
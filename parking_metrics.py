@@ -0,0 +1,201 @@
+import bisect
+import cProfile
+import functools
+import inspect
+import os
+import time
+from array import array
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+BYTES_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+METRICS_PREFIX = "parking_"
+DUMP_INTERVAL = 10.0
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bound plus +Inf
+        self.counts = array('q', [0]) * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    # Counters, gauges and histograms, rendered in the Prometheus text
+    # format. Nothing is measured unless instrument() has wrapped a method,
+    # so code paths of an uninstrumented process are untouched and cost
+    # nothing; a wrapped call costs two perf_counter() reads and a bisect.
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+
+    def counter(self, name, help_text=""):
+        self.counters.setdefault(name, 0)
+        self.help.setdefault(name, help_text)
+        return name
+
+    def inc(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, read, help_text=""):
+        # `read` is called when metrics are rendered
+        self.gauges[name] = read
+        self.help[name] = help_text
+
+    def histogram(self, name, bounds=LATENCY_BUCKETS, help_text=""):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+            self.help[name] = help_text
+        return histogram
+
+    def timed(self, name, fn):
+        # `fn` wrapped to time every call into `<name>_seconds` and count
+        # the calls that raised
+        histogram = self.histogram(f"{name}_seconds", help_text=f"Time spent in {name}")
+        errors = self.counter(f"{name}_errors_total", f"Calls to {name} that raised")
+        counters = self.counters
+        perf_counter = time.perf_counter
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException:
+                    counters[errors] += 1
+                    raise
+                finally:
+                    histogram.observe(perf_counter() - started)
+
+            return wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                counters[errors] += 1
+                raise
+            finally:
+                histogram.observe(perf_counter() - started)
+
+        return wrapper
+
+    def instrument(self, obj, names, prefix=""):
+        # Replace the named methods on one object with timed wrappers. Do
+        # this before the methods are handed out as callbacks (button
+        # commands, engine listeners), which keep the unwrapped ones.
+        for name in names:
+            setattr(obj, name, self.timed(prefix + name, getattr(obj, name)))
+
+    def instrument_storage(self, storage):
+        # Time the persistence calls and, for backends that count what they
+        # write, histogram the bytes each flush and save put on disk
+        self.instrument(storage, ("record", "flush", "save"), "storage_")
+        if not hasattr(storage, "bytes_written"):
+            return
+        self.gauge("storage_bytes_written_total", lambda: storage.bytes_written,
+                   "Bytes written by the storage backend")
+        # One watermark for both, so bytes recorded since the previous call
+        # count towards whichever of flush and save comes next, once
+        state = [storage.bytes_written]
+        for name in ("flush", "save"):
+            histogram = self.histogram(f"storage_{name}_bytes", BYTES_BUCKETS,
+                                       f"Bytes written per storage {name}")
+            setattr(storage, name, self._measure_bytes(storage, getattr(storage, name), histogram, state))
+
+    @staticmethod
+    def _measure_bytes(storage, fn, histogram, state):
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                written = storage.bytes_written
+                histogram.observe(written - state[0])
+                state[0] = written
+
+        return wrapper
+
+    def instrument_engine(self, engine):
+        self.instrument(engine, ("park", "remove", "run_batch", "update_reservations"), "engine_")
+        self.gauge("history_sessions", lambda: len(engine.history), "Closed sessions in the history")
+        self.gauge("parked_vehicles", lambda: engine.occupied_count, "Vehicles parked now")
+        self.gauge("available_spots", lambda: engine.available_count, "Free spots now")
+        self.gauge("known_plates", lambda: len(engine.plates), "Distinct plates in the search index")
+
+    def render(self):
+        lines = []
+        prefix = self.prefix
+        for name, value in sorted(self.counters.items()):
+            full = prefix + name
+            lines += [f"# HELP {full} {self.help.get(name, '')}", f"# TYPE {full} counter", f"{full} {value}"]
+        for name, read in sorted(self.gauges.items()):
+            full = prefix + name
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines += [f"# HELP {full} {self.help.get(name, '')}", f"# TYPE {full} gauge", f"{full} {value}"]
+        for name, histogram in sorted(self.histograms.items()):
+            full = prefix + name
+            lines += [f"# HELP {full} {self.help.get(name, '')}", f"# TYPE {full} histogram"]
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{full}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{full}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{full}_sum {histogram.sum}")
+            lines.append(f"{full}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        # Atomic, so a scraper reading the file never sees half of it
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class Profiler:
+    # cProfile that can be switched on and off while the process runs;
+    # stats accumulate across runs and are written to `path` on stop()
+    def __init__(self, path):
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.profile.enable()
+            self.running = True
+
+    def stop(self):
+        if self.running:
+            self.profile.disable()
+            self.running = False
+            self.profile.dump_stats(self.path)
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+        return self.running
@@ -0,0 +1,308 @@
+import time
+from array import array
+from itertools import chain
+from parking_jobs import BackgroundJob
+
+HOUR = 3600
+DAY = 86400
+WEEK_HOURS = 7 * 24
+# (name, bucket seconds, buckets kept): two days of minutes, a bit over a
+# year of hours, ten years of days
+ROLLUPS = (("minute", 60, 2 * 1440), ("hour", HOUR, 400 * 24), ("day", DAY, 3660))
+
+
+def utc_offset(ts):
+    return time.localtime(ts).tm_gmtoff
+
+
+class OccupancyRing:
+    # Fixed-size ring of time buckets. Each bucket holds the time-weighted
+    # occupancy (vehicle-seconds), the seconds observed and the peak, so the
+    # mean for a bucket is area / seconds. Old buckets are overwritten.
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.size = size
+        self.ids = array('q', [-1]) * size
+        self.area = array('d', [0.0]) * size
+        self.seconds = array('d', [0.0]) * size
+        self.peaks = array('l', [0]) * size
+        self.latest = -1
+        # Buckets at or below this are known to be overwritten later
+        self.floor = -1
+
+    def _slot(self, bucket):
+        slot = bucket % self.size
+        if self.ids[slot] != bucket:
+            self.ids[slot] = bucket
+            self.area[slot] = 0.0
+            self.seconds[slot] = 0.0
+            self.peaks[slot] = 0
+        if bucket > self.latest:
+            self.latest = bucket
+        return slot
+
+    def add(self, start, end, value):
+        # Spread a constant stretch [start, end) over the buckets it covers;
+        # anything older than the ring can hold is skipped
+        resolution = self.resolution
+        bucket = start // resolution
+        if bucket == (end - 1) // resolution:
+            # Common case: the stretch stays inside one bucket
+            if bucket > self.floor:
+                slot = self._slot(bucket)
+                self.area[slot] += value * (end - start)
+                self.seconds[slot] += end - start
+                if value > self.peaks[slot]:
+                    self.peaks[slot] = value
+            return
+        bucket = max(bucket, end // resolution - self.size + 1, self.floor + 1)
+        while bucket * resolution < end:
+            lo = max(start, bucket * resolution)
+            hi = min(end, (bucket + 1) * resolution)
+            if hi > lo:
+                slot = self._slot(bucket)
+                self.area[slot] += value * (hi - lo)
+                self.seconds[slot] += hi - lo
+                if value > self.peaks[slot]:
+                    self.peaks[slot] = value
+            bucket += 1
+
+    def mark(self, ts, value):
+        bucket = ts // self.resolution
+        if bucket > self.latest - self.size and bucket > self.floor:
+            slot = self._slot(bucket)
+            if value > self.peaks[slot]:
+                self.peaks[slot] = value
+
+    def merge(self, other):
+        for slot in range(other.size):
+            bucket = other.ids[slot]
+            if bucket < 0 or bucket <= self.latest - self.size:
+                continue
+            mine = self._slot(bucket)
+            self.area[mine] += other.area[slot]
+            self.seconds[mine] += other.seconds[slot]
+            self.peaks[mine] = max(self.peaks[mine], other.peaks[slot])
+
+    def buckets(self, since=None):
+        # (bucket start in local epoch seconds, mean, peak), oldest first
+        first = self.latest - self.size + 1
+        if since is not None:
+            first = max(first, since // self.resolution)
+        rows = []
+        for bucket in range(max(first, 0), self.latest + 1):
+            slot = bucket % self.size
+            if self.ids[slot] == bucket and self.seconds[slot]:
+                rows.append((bucket * self.resolution, self.area[slot] / self.seconds[slot],
+                             self.peaks[slot]))
+        return rows
+
+
+class OccupancySeries:
+    # Occupancy over time as a step function: record() is called with the
+    # occupied count after every park and exit, and the stretch since the
+    # previous call is folded into minute/hour/day rollups, hour-of-week
+    # accumulators and all-time totals. Peak, mean utilisation and the
+    # hour-of-day heatmap are then read straight off the accumulators.
+    # Timestamps are shifted to local time once, when they come in.
+    def __init__(self):
+        self.rings = {name: OccupancyRing(resolution, size) for name, resolution, size in ROLLUPS}
+        self.week_area = array('d', [0.0]) * WEEK_HOURS
+        self.week_seconds = array('d', [0.0]) * WEEK_HOURS
+        self.week_peaks = array('l', [0]) * WEEK_HOURS
+        self.total_area = 0.0
+        self.total_seconds = 0.0
+        self.peak = 0
+        self.peak_ts = None
+        self.value = 0
+        self.first_ts = None
+        self.last_ts = None
+        self._offset = (0, 0, 0)
+
+    def local(self, ts):
+        # Local-time seconds; the UTC offset is looked up once per hour
+        start, end, offset = self._offset
+        if not start <= ts < end:
+            offset = utc_offset(ts)
+            start = ts - ts % HOUR
+            self._offset = (start, start + HOUR, offset)
+        return ts + offset
+
+    def record(self, ts, occupied):
+        if self.last_ts is None:
+            self.first_ts = ts
+        else:
+            if ts < self.last_ts:
+                ts = self.last_ts  # out-of-order clock; keep the series monotonic
+            self._accumulate(self.last_ts, ts, self.value)
+        self.value = occupied
+        self.last_ts = ts
+
+        local = self.local(ts)
+        for ring in self.rings.values():
+            ring.mark(local, occupied)
+        hour = self._week_hour(local)
+        if occupied > self.week_peaks[hour]:
+            self.week_peaks[hour] = occupied
+        if occupied > self.peak:
+            self.peak = occupied
+            self.peak_ts = ts
+
+    def advance(self, ts):
+        # Fold the open stretch up to `ts` without a state change
+        if self.last_ts is not None and ts > self.last_ts:
+            self.record(ts, self.value)
+
+    @staticmethod
+    def _week_hour(local):
+        # The epoch was a Thursday; slot 0 is Monday 00:00
+        hours = local // HOUR
+        return ((hours // 24 + 3) % 7) * 24 + hours % 24
+
+    def _accumulate(self, start, end, value):
+        if end <= start:
+            return
+        self.total_area += value * (end - start)
+        self.total_seconds += end - start
+        start, end = self.local(start), self.local(end)
+        for ring in self.rings.values():
+            ring.add(start, end, value)
+
+        # Whole weeks add evenly to every hour-of-week slot
+        weeks = (end - start) // (WEEK_HOURS * HOUR)
+        if weeks:
+            for hour in range(WEEK_HOURS):
+                self.week_area[hour] += value * HOUR * weeks
+                self.week_seconds[hour] += HOUR * weeks
+            start += weeks * WEEK_HOURS * HOUR
+        while start < end:
+            hi = min(end, start - start % HOUR + HOUR)
+            hour = self._week_hour(start)
+            self.week_area[hour] += value * (hi - start)
+            self.week_seconds[hour] += hi - start
+            if value > self.week_peaks[hour]:
+                self.week_peaks[hour] = value
+            start = hi
+
+    def merge(self, other):
+        # Add a series covering an earlier, disjoint stretch of time
+        for name, ring in self.rings.items():
+            ring.merge(other.rings[name])
+        for hour in range(WEEK_HOURS):
+            self.week_area[hour] += other.week_area[hour]
+            self.week_seconds[hour] += other.week_seconds[hour]
+            self.week_peaks[hour] = max(self.week_peaks[hour], other.week_peaks[hour])
+        self.total_area += other.total_area
+        self.total_seconds += other.total_seconds
+        if other.peak > self.peak:
+            self.peak = other.peak
+            self.peak_ts = other.peak_ts
+
+    # Queries
+
+    def peak_occupancy(self):
+        return self.peak, self.peak_ts
+
+    def mean_occupancy(self, now=None):
+        area, seconds = self.total_area, self.total_seconds
+        if now is not None and self.last_ts is not None and now > self.last_ts:
+            area += self.value * (now - self.last_ts)
+            seconds += now - self.last_ts
+        return area / seconds if seconds else float(self.value)
+
+    def utilisation(self, capacity, now=None):
+        return self.mean_occupancy(now) / capacity if capacity else 0.0
+
+    def heatmap(self):
+        # 7 x 24 mean occupancy, Monday first; None where nothing was seen
+        return [[self.week_area[day * 24 + hour] / self.week_seconds[day * 24 + hour]
+                 if self.week_seconds[day * 24 + hour] else None
+                 for hour in range(24)] for day in range(7)]
+
+    def hour_of_day(self):
+        # Mean occupancy per hour of the day across all weekdays
+        means = []
+        for hour in range(24):
+            area = sum(self.week_area[day * 24 + hour] for day in range(7))
+            seconds = sum(self.week_seconds[day * 24 + hour] for day in range(7))
+            means.append(area / seconds if seconds else None)
+        return means
+
+    def series(self, resolution="hour", since=None):
+        # [(bucket start ts, mean, peak)] from one rollup
+        ring = self.rings[resolution]
+        local_since = None if since is None else self.local(since)
+        rows = ring.buckets(local_since)
+        if not rows:
+            return rows
+        # Bucket starts are local; shift them back with the current offset
+        offset = utc_offset(rows[-1][0])
+        return [(start - offset, mean, peak) for start, mean, peak in rows]
+
+
+def sessions_series(entry_ts, exit_ts, parked_entry_ts, until):
+    # Rebuild the series up to `until` from closed sessions and the entry
+    # times of vehicles still parked
+    deltas = {}
+    for ts in entry_ts:
+        if ts < until:
+            deltas[ts] = deltas.get(ts, 0) + 1
+    for ts in exit_ts:
+        if ts < until:
+            deltas[ts] = deltas.get(ts, 0) - 1
+    for ts in parked_entry_ts:
+        if ts < until:
+            deltas[ts] = deltas.get(ts, 0) + 1
+
+    series = OccupancySeries()
+    # Buckets that would fall out of the rings by `until` are not filled
+    local_until = until + utc_offset(until)
+    for ring in series.rings.values():
+        ring.floor = local_until // ring.resolution - ring.size
+    occupied = 0
+    for ts in sorted(deltas):
+        occupied += deltas[ts]
+        series.record(ts, occupied)
+    series.advance(until)
+    return series
+
+
+class OccupancyBackfill(BackgroundJob):
+    # Builds the series for the time before the engine started from the
+    # session history, on a background thread; install(engine) merges it
+    # into the live series and must run on the thread that owns the engine.
+    name = "occupancy-backfill"
+
+    def __init__(self, engine):
+        super().__init__()
+        # All sessions are read on the worker: the archived ones from their
+        # partitions, the hot ones through a reader of the hot tier, up to
+        # the ones held now
+        history = engine.history
+        self.archive = getattr(history, "archive", None)
+        self.hot = getattr(history, "hot", history)
+        self.reader = self.hot.open_reader()
+        self.rows = len(self.hot)
+        self.parked_entry_ts = [vehicle.entry_ts for vehicle in engine.parked_vehicles.values()]
+        self.until = engine.occupancy.first_ts or engine.now()
+        self.series = None
+
+    def work(self):
+        entry_ts, exit_ts = [], []
+        if self.archive is not None:
+            for partition in self.archive.select():
+                columns = partition.columns()
+                entry_ts.append(columns["entry_ts"])
+                exit_ts.append(columns["exit_ts"])
+        columns = self.reader.columns()
+        entry_ts.append(columns["entry_ts"][:self.rows])
+        exit_ts.append(columns["exit_ts"][:self.rows])
+        self.series = sessions_series(chain.from_iterable(entry_ts), chain.from_iterable(exit_ts),
+                                      self.parked_entry_ts, self.until)
+
+    def finish(self):
+        if self.reader is not self.hot:
+            self.reader.close()
+
+    def apply(self, engine):
+        engine.occupancy.merge(self.series)
@@ -0,0 +1,232 @@
+import heapq
+from array import array
+from collections import Counter
+from itertools import chain
+from parking_jobs import BackgroundJob
+
+# Characters number-plate cameras mix up, folded onto one form so O/0 and
+# I/1 misreads still match
+CONFUSABLES = str.maketrans("OQDILZSB", "00011258")
+# Match kinds, best first
+MATCH_KINDS = ("exact", "confusable", "prefix", "substring", "fuzzy")
+PLATE_SEARCH_LIMIT = 20
+# Trigrams shared by more plates than this (a state prefix, say) say little
+# about a fuzzy match and cost the most to count, so they are left out
+FUZZY_GRAM_LIMIT = 50000
+FUZZY_CANDIDATES = 500
+
+
+def normalise_plate(text):
+    return "".join(ch for ch in text.upper() if ch.isalnum())
+
+
+def plate_key(plate):
+    return normalise_plate(plate).translate(CONFUSABLES)
+
+
+def plate_grams(key):
+    # Trigrams of the key padded with start/end markers, plus the first
+    # character as "^X" so one-character prefixes can be looked up too
+    padded = "^" + key + "$"
+    grams = {padded[i:i + 3] for i in range(len(padded) - 2)}
+    grams.add(padded[:2])
+    return grams
+
+
+def edit_distance(a, b, limit):
+    # Levenshtein distance, or limit + 1 once it is certain to exceed limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class PlateMatch:
+    __slots__ = ("plate", "kind", "distance", "spot", "sessions", "last_seen")
+
+    def __init__(self, plate, kind, distance, spot, sessions, last_seen):
+        self.plate = plate
+        self.kind = kind
+        self.distance = distance
+        self.spot = spot
+        self.sessions = sessions
+        self.last_seen = last_seen
+
+    def to_dict(self):
+        return {
+            "plate": self.plate,
+            "kind": self.kind,
+            "distance": self.distance,
+            "spot": self.spot,
+            "sessions": self.sessions,
+            "last_seen": self.last_seen
+        }
+
+
+class PlateIndex:
+    # Every plate seen, current and historical, once each, with its session
+    # count and when it was last seen. Plates are indexed by the trigrams of
+    # their confusable-folded form: a substring query intersects the
+    # posting lists of its trigrams, and a fuzzy query counts shared
+    # trigrams to pick a few candidates for an edit-distance check, so no
+    # query walks the whole plate list.
+    def __init__(self):
+        self.plates = []
+        self.keys = []
+        self.ids = {}
+        self.sessions = array('l')
+        self.last_seen = array('q')
+        # gram -> ids of the plates containing it, in increasing order
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.plates)
+
+    def add(self, plate, ts=0, sessions=0):
+        plate_id = self.ids.get(plate)
+        if plate_id is None:
+            plate_id = len(self.plates)
+            key = plate_key(plate)
+            self.ids[plate] = plate_id
+            self.plates.append(plate)
+            self.keys.append(key)
+            self.sessions.append(0)
+            self.last_seen.append(0)
+            postings = self.postings
+            for gram in plate_grams(key):
+                ids = postings.get(gram)
+                if ids is None:
+                    ids = postings[gram] = array('l')
+                ids.append(plate_id)
+        self.sessions[plate_id] += sessions
+        if ts > self.last_seen[plate_id]:
+            self.last_seen[plate_id] = ts
+
+    def _containing(self, key, limit, parked):
+        # Ids of plates whose key contains `key`
+        postings = self.postings
+        if len(key) < 3:
+            # Too short for a trigram: prefixes only, which "^X" / "^XY"
+            # list exactly. These can be a good share of all plates, so only
+            # the parked and the most recently seen are ranked.
+            ids = postings.get("^" + key, ())
+            ranked = {self.ids[plate] for plate in parked if self.keys[self.ids[plate]].startswith(key)}
+            ranked.update(heapq.nlargest(limit, ids, key=self.last_seen.__getitem__))
+            return ranked
+        lists = []
+        for i in range(len(key) - 2):
+            ids = postings.get(key[i:i + 3])
+            if ids is None:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for ids in lists[1:]:
+            if len(candidates) < 64:
+                break  # cheaper to check the few left directly
+            candidates.intersection_update(ids)
+        keys = self.keys
+        return [plate_id for plate_id in candidates if key in keys[plate_id]]
+
+    def _similar(self, key, max_distance):
+        # (id, distance) of plates within max_distance edits of `key`. Two
+        # strings k edits apart share all but at most 3k of their padded
+        # trigrams, which bounds the candidates before any distance is
+        # computed.
+        grams = plate_grams(key)
+        grams.discard("^" + key[:1])
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        common = [ids for ids in lists if len(ids) <= FUZZY_GRAM_LIMIT]
+        needed = len(grams) - 3 * max_distance - (len(lists) - len(common))
+        if needed < 1:
+            return []
+        counts = Counter(chain.from_iterable(common))
+        candidates = heapq.nlargest(FUZZY_CANDIDATES, (item for item in counts.items() if item[1] >= needed),
+                                    key=lambda item: item[1])
+        matches = []
+        for plate_id, _ in candidates:
+            distance = edit_distance(key, self.keys[plate_id], max_distance)
+            if distance <= max_distance:
+                matches.append((plate_id, distance))
+        return matches
+
+    def search(self, text, limit=PLATE_SEARCH_LIMIT, parked=None, max_distance=None):
+        # Ranked PlateMatch list: exact, then plates equal up to confusable
+        # characters, prefix, substring and finally near misses by edit
+        # distance; ties go to vehicles parked now (`parked` maps plate to
+        # spot), then the most recently seen
+        query = normalise_plate(text)
+        if not query:
+            return []
+        key = query.translate(CONFUSABLES)
+        parked = parked or {}
+        plates, keys = self.plates, self.keys
+
+        ranked = []
+        found = set()
+        for plate_id in self._containing(key, limit, parked):
+            plate = plates[plate_id]
+            if plate == query:
+                kind = 0
+            elif keys[plate_id] == key:
+                kind = 1
+            elif keys[plate_id].startswith(key):
+                kind = 2
+            else:
+                kind = 3
+            found.add(plate_id)
+            ranked.append((kind, 0, plate not in parked, -self.last_seen[plate_id], plate, plate_id))
+
+        if len(ranked) < limit and len(key) >= 3:
+            if max_distance is None:
+                max_distance = 1 if len(key) <= 6 else 2
+            for plate_id, distance in self._similar(key, max_distance):
+                if plate_id not in found:
+                    plate = plates[plate_id]
+                    ranked.append((4, distance, plate not in parked, -self.last_seen[plate_id], plate, plate_id))
+
+        return [PlateMatch(plate, MATCH_KINDS[kind], distance, parked.get(plate),
+                           self.sessions[plate_id], self.last_seen[plate_id])
+                for kind, distance, _, _, plate, plate_id in heapq.nsmallest(limit, ranked)]
+
+
+class PlateIndexBuild(BackgroundJob):
+    # Indexes the plates of the session history on a background thread. The
+    # history position is noted up front; install(engine) adds what was
+    # appended since, plus the parked vehicles, and swaps the index into the
+    # engine. install() must run on the thread that owns the engine.
+    name = "plate-index"
+
+    def __init__(self, engine):
+        super().__init__()
+        history = engine.history
+        self.upto = history.cursor()
+        # SQLite connections belong to one thread; read through our own
+        self.history = history
+        self.reader = history.open_reader() if hasattr(history, "open_reader") else history
+        self.index = None
+
+    def work(self):
+        index = PlateIndex()
+        for plate, sessions, last_seen in self.reader.plate_counts(upto=self.upto):
+            index.add(plate, last_seen, sessions)
+        self.index = index
+
+    def finish(self):
+        if self.reader is not self.history:
+            self.reader.close()
+
+    def apply(self, engine):
+        index = self.index
+        for plate, sessions, last_seen in engine.history.plate_counts(after=self.upto):
+            index.add(plate, last_seen, sessions)
+        for vehicle in engine.parked_vehicles.values():
+            index.add(vehicle.vehicle, vehicle.entry_ts)
+        engine.plates = index
@@ -0,0 +1,165 @@
+import time
+from datetime import datetime, timedelta
+from enum import Enum
+
+LEGACY_ENTRY_FORMAT = '%Y-%m-%d %H:%M:%S'
+DISPLAY_TIME_FORMAT = '%Y-%m-%d %I:%M %p'
+DAY_FORMAT = '%Y-%m-%d'
+
+
+class VehicleType(str, Enum):
+    # Members compare and hash like their plain string values, so rate
+    # tables and older code keyed by "Car" keep working
+    CAR = "Car"
+    BIKE = "Bike"
+    TRUCK = "Truck"
+    SUV = "SUV"
+
+    def __str__(self):
+        return self.value
+
+    def __format__(self, spec):
+        return format(self.value, spec)
+
+
+VEHICLE_TYPE_LIST = list(VehicleType)
+VEHICLE_TYPE_CODES = {vtype: code for code, vtype in enumerate(VEHICLE_TYPE_LIST)}
+
+
+class ManualClock:
+    # Stands in for time.time where time must not move on its own (replays,
+    # simulations, tests): it reads whatever it was last set to
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def set(self, ts):
+        self.now = ts
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def format_time(ts, fmt=DISPLAY_TIME_FORMAT):
+    return time.strftime(fmt, time.localtime(ts))
+
+
+def day_of(ts):
+    return time.strftime(DAY_FORMAT, time.localtime(ts))
+
+
+def day_start(day):
+    return int(datetime.strptime(day, DAY_FORMAT).timestamp())
+
+
+def day_end(day):
+    # Start of the following day
+    return int((datetime.strptime(day, DAY_FORMAT) + timedelta(days=1)).timestamp())
+
+
+def parse_time(text, fmt):
+    return int(datetime.strptime(text, fmt).timestamp())
+
+
+class ParkedVehicle:
+    __slots__ = ("vehicle", "type", "owner", "phone", "entry_ts")
+
+    def __init__(self, vehicle, vtype, owner, phone, entry_ts):
+        self.vehicle = vehicle
+        self.type = VehicleType(vtype)
+        self.owner = owner
+        self.phone = phone
+        self.entry_ts = entry_ts
+
+    def to_dict(self):
+        return {
+            "vehicle": self.vehicle,
+            "type": self.type.value,
+            "owner": self.owner,
+            "phone": self.phone,
+            "entry_ts": self.entry_ts
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if "entry_ts" in data:
+            entry_ts = data["entry_ts"]
+        else:
+            entry_ts = parse_time(data["entry_time"], LEGACY_ENTRY_FORMAT)
+        return cls(data["vehicle"], data["type"], data["owner"], data.get("phone", ""), entry_ts)
+
+
+class SessionRecord:
+    __slots__ = ("vehicle", "type", "owner", "entry_ts", "exit_ts", "duration", "fee")
+
+    def __init__(self, vehicle, vtype, owner, entry_ts, exit_ts, duration, fee):
+        self.vehicle = vehicle
+        self.type = VehicleType(vtype)
+        self.owner = owner
+        self.entry_ts = entry_ts
+        self.exit_ts = exit_ts
+        self.duration = duration
+        self.fee = fee
+
+    def __eq__(self, other):
+        if not isinstance(other, SessionRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return (f"SessionRecord({self.vehicle!r}, {self.type.value!r}, {self.owner!r}, "
+                f"{self.entry_ts}, {self.exit_ts}, {self.duration}, {self.fee})")
+
+    @property
+    def exit_day(self):
+        return day_of(self.exit_ts)
+
+    def to_dict(self):
+        return {
+            "vehicle": self.vehicle,
+            "type": self.type.value,
+            "owner": self.owner,
+            "entry_ts": self.entry_ts,
+            "exit_ts": self.exit_ts,
+            "duration": self.duration,
+            "fee": self.fee
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # Older files stored pre-formatted display strings
+        if "exit_ts" in data:
+            entry_ts, exit_ts = data["entry_ts"], data["exit_ts"]
+        else:
+            entry_ts = parse_time(data["entry_time"], DISPLAY_TIME_FORMAT)
+            exit_ts = parse_time(data["exit_time"], DISPLAY_TIME_FORMAT)
+        return cls(data["vehicle"], data["type"], data["owner"], entry_ts, exit_ts,
+                   data["duration"], data["fee"])
+
+
+class Reservation:
+    # Hold on one spot from start_ts until end_ts; end_ts None never expires
+    __slots__ = ("spot", "holder", "start_ts", "end_ts")
+
+    def __init__(self, spot, holder, start_ts, end_ts=None):
+        self.spot = spot
+        self.holder = holder
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+
+    def covers(self, ts):
+        return self.start_ts <= ts and (self.end_ts is None or ts < self.end_ts)
+
+    def to_dict(self):
+        return {
+            "spot": self.spot,
+            "holder": self.holder,
+            "start_ts": self.start_ts,
+            "end_ts": self.end_ts
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["spot"], data.get("holder", ""), data.get("start_ts", 0), data.get("end_ts"))
@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import time
+from parking_engine import DEFAULT_RATES, ParkingEngine, ParkingError
+from parking_lot import ALLOCATION_STRATEGIES, DEFAULT_STRATEGY, LotLayout
+from parking_metrics import Profiler
+from parking_records import ManualClock, Reservation
+from parking_tariff import Tariff
+
+# Mismatches listed in the report; any beyond are only counted
+REPLAY_MISMATCHES_KEPT = 100
+# Events an EventRecorder buffers before writing them out
+RECORD_FLUSH_EVERY = 100
+
+
+def event_time(event):
+    # When a recorded event happened, where the event says so
+    op = event["op"]
+    if op == "park":
+        return event["entry_ts"]
+    if op in ("exit", "session"):
+        return event["record"]["exit_ts"]
+    return None
+
+
+def leaf_events(events):
+    # Events with the batches unpacked
+    for event in events:
+        if event["op"] == "batch":
+            yield from leaf_events(event["events"])
+        else:
+            yield event
+
+
+def read_log(path):
+    # (starting state or None, recorded events oldest first) from either a
+    # JSON-lines event log, one event or journal entry {"seq", "event"} per
+    # line, or a journal directory, whose log starts from its snapshot
+    state = None
+    snapshot_seq = 0
+    if os.path.isdir(path):
+        snapshot_path = os.path.join(path, "snapshot.json")
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot["seq"]
+            state = snapshot.get("state", snapshot)
+        path = os.path.join(path, "journal.log")
+    events = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # torn write from a crash
+            if "event" in entry:
+                if entry["seq"] <= snapshot_seq:
+                    continue
+                entry = entry["event"]
+            events.append(entry)
+    return state, events
+
+
+class EventRecorder:
+    # Engine listener keeping every event in a JSON-lines log for Replayer.
+    # Unlike the journal, which is cut back at every snapshot, the log only
+    # grows, so a whole day of gate traffic can be replayed later.
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lines = []
+
+    def record(self, event):
+        self._lines.append(json.dumps(event, separators=(",", ":")))
+        if len(self._lines) >= RECORD_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._file.write("\n".join(self._lines) + "\n")
+            self._lines = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class Replayer:
+    # Runs a recorded log again at full speed on a fresh engine whose clock
+    # is a ManualClock set from the events. Spots, fees and reservation
+    # changes are decided again by the current code and checked against what
+    # was recorded; a second engine applies the log as recorded (as loading a
+    # journal does) to give the end state the first one must reach.
+    def __init__(self, make_engine, state, events):
+        # make_engine(clock) -> ParkingEngine
+        self.make_engine = make_engine
+        self.state = state
+        self.events = events
+        self.mismatches = []
+        self.mismatch_count = 0
+        self.recorded_fees = 0.0
+        self.replayed_fees = 0.0
+        self.index = 0
+
+    def mismatch(self, op, detail):
+        self.mismatch_count += 1
+        if len(self.mismatches) < REPLAY_MISMATCHES_KEPT:
+            self.mismatches.append({"event": self.index, "op": op, "detail": detail})
+
+    def start_ts(self):
+        # The first time the log gives, or just before a reservation window
+        # booked ahead of it, since bookings carry no time of their own
+        earliest = None
+        for event in leaf_events(self.events):
+            ts = event_time(event)
+            if event["op"] == "reserve":
+                ts = event.get("start_ts", 0) - 1
+            elif ts is None:
+                continue
+            earliest = ts if earliest is None else min(earliest, ts)
+            if event["op"] != "reserve":
+                return earliest
+        return int(time.time()) if earliest is None else earliest
+
+    def new_engine(self):
+        clock = ManualClock(self.start_ts())
+        engine = self.make_engine(clock)
+        if self.state is not None:
+            engine.load_dict(self.state)
+        return engine, clock
+
+    def run(self):
+        engine, clock = self.new_engine()
+        started = time.perf_counter()
+        for event in self.events:
+            self.replay(engine, clock, event)
+        replay_seconds = time.perf_counter() - started
+
+        expected, expected_clock = self.new_engine()
+        started = time.perf_counter()
+        events = 0
+        for event in leaf_events(self.events):
+            ts = event_time(event)
+            if ts is not None and ts > expected_clock.now:
+                expected_clock.set(ts)
+            expected.apply_event(event)
+            events += 1
+        apply_seconds = time.perf_counter() - started
+
+        self.index = events
+        self.compare(engine, expected)
+        return {
+            "events": events,
+            "replay_seconds": replay_seconds,
+            "events_per_second": events / replay_seconds if replay_seconds else None,
+            "apply_seconds": apply_seconds,
+            "applied_per_second": events / apply_seconds if apply_seconds else None,
+            "sessions": len(engine.history),
+            "recorded_fees": round(self.recorded_fees, 2),
+            "replayed_fees": round(self.replayed_fees, 2),
+            "mismatch_count": self.mismatch_count,
+            "mismatches": self.mismatches
+        }
+
+    def replay(self, engine, clock, event):
+        op = event["op"]
+        if op == "batch":
+            with engine.batch():
+                for inner in event["events"]:
+                    self.replay(engine, clock, inner)
+            return
+        self.index += 1
+        ts = event_time(event)
+        if ts is not None and ts > clock.now:
+            clock.set(ts)
+        try:
+            if op == "park":
+                self.replay_park(engine, event)
+            elif op == "exit":
+                self.replay_exit(engine, event)
+            elif op == "reserve":
+                reservation = Reservation.from_dict(event)
+                if not engine.reserve(reservation.spot, reservation.holder, reservation.start_ts,
+                                      reservation.end_ts):
+                    self.mismatch(op, f"spot {reservation.spot} was already reserved")
+            elif op == "activate":
+                # The scheduler tick that started the hold
+                clock.set(max(clock.now, event["start_ts"]))
+                engine.update_reservations()
+                if event["spot"] not in engine.reserved_spots:
+                    self.mismatch(op, f"spot {event['spot']} is not reserved")
+            elif op == "cancel":
+                self.replay_cancel(engine, clock, event)
+            elif op == "session":
+                # Imported, nothing to decide
+                engine.apply_event(event)
+            elif op == "clear":
+                engine.clear()
+            else:
+                self.mismatch(op, "unknown operation")
+        except ParkingError as e:
+            self.mismatch(op, str(e))
+
+    def replay_park(self, engine, event):
+        spot = engine.park(event["vehicle"], event["type"], event["owner"], event.get("phone", ""),
+                           event["entry_ts"])
+        if spot != event["spot"]:
+            self.mismatch("park", f"{event['vehicle']} got spot {spot}, recorded {event['spot']}")
+
+    def replay_exit(self, engine, event):
+        recorded = event["record"]
+        self.recorded_fees += recorded["fee"]
+        spot = engine.find_vehicle(recorded["vehicle"])
+        if spot is None:
+            self.mismatch("exit", f"{recorded['vehicle']} is not parked")
+            return
+        record = engine.remove(spot, recorded["exit_ts"])
+        self.replayed_fees += record.fee
+        replayed = record.to_dict()
+        if replayed != recorded:
+            changed = ", ".join(f"{name} {replayed[name]} (recorded {recorded[name]})"
+                                for name in recorded if replayed.get(name) != recorded[name])
+            self.mismatch("exit", f"{recorded['vehicle']}: {changed}")
+
+    def replay_cancel(self, engine, clock, event):
+        spot, start_ts = event["spot"], event["start_ts"]
+        if not event.get("expired"):
+            engine.cancel_reservation(spot, start_ts)
+            return
+        # The scheduler tick that ended the hold
+        reservation = engine.reservations.find(spot, start_ts)
+        if reservation is None:
+            return
+        if reservation.end_ts is not None:
+            clock.set(max(clock.now, reservation.end_ts))
+        engine.update_reservations()
+        if engine.reservations.find(spot, start_ts) is not None:
+            self.mismatch("cancel", f"hold on spot {spot} did not expire")
+
+    def compare(self, engine, expected):
+        actual_state, expected_state = engine.state_dict(), expected.state_dict()
+        for key in ("parked_vehicles", "reservations"):
+            if actual_state[key] != expected_state[key]:
+                self.mismatch("state", f"{key} differ from the recorded end state")
+        if sorted(actual_state["reserved_spots"]) != sorted(expected_state["reserved_spots"]):
+            self.mismatch("state", "reserved spots differ from the recorded end state")
+        if len(engine.history) != len(expected.history):
+            self.mismatch("state", f"{len(engine.history)} sessions, recorded {len(expected.history)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded gate event log and verify the outcomes")
+    parser.add_argument("log", help="JSON-lines event log (--record-events, journal.log) or a journal directory")
+    parser.add_argument("--state", metavar="FILE",
+                        help="state the log starts from (parking_data.json or snapshot.json)")
+    parser.add_argument("--spots", type=int, default=50)
+    parser.add_argument("--lot", metavar="CONFIG", help="lot layout file")
+    parser.add_argument("--strategy", choices=sorted(ALLOCATION_STRATEGIES), default=DEFAULT_STRATEGY)
+    parser.add_argument("--tariff", metavar="CONFIG", help="tariff file")
+    parser.add_argument("--profile", metavar="FILE", help="profile the replay with cProfile, stats written to FILE")
+    parser.add_argument("--output", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    state, events = read_log(args.log)
+    if args.state:
+        with open(args.state, "r") as f:
+            state = json.load(f)
+        state = state.get("state", state)
+    layout = LotLayout.load(args.lot) if args.lot else None
+    tariff = Tariff.load(args.tariff, DEFAULT_RATES) if args.tariff else None
+
+    def make_engine(clock):
+        return ParkingEngine(total_spots=args.spots, layout=layout, strategy=args.strategy,
+                             tariff=tariff, clock=clock)
+
+    replayer = Replayer(make_engine, state, events)
+    profiler = Profiler(args.profile) if args.profile else None
+    if profiler is not None:
+        profiler.start()
+    try:
+        report = replayer.run()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+    print(f"Replayed {report['events']} events in {report['replay_seconds']:.3f} s "
+          f"({report['events_per_second'] or 0:,.0f} events/s; applying as recorded: "
+          f"{report['applied_per_second'] or 0:,.0f} events/s)")
+    print(f"Fees: ₹{report['replayed_fees']:.2f} replayed, ₹{report['recorded_fees']:.2f} recorded")
+    for mismatch in report["mismatches"]:
+        print(f"  #{mismatch['event']} {mismatch['op']}: {mismatch['detail']}")
+    if report["mismatch_count"] > len(report["mismatches"]):
+        print(f"  ... and {report['mismatch_count'] - len(report['mismatches'])} more")
+    print("All outcomes match the recording" if not report["mismatch_count"]
+          else f"{report['mismatch_count']} mismatches")
+    if profiler is not None:
+        print(f"Profile written to {args.profile}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    if report["mismatch_count"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
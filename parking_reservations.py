@@ -0,0 +1,189 @@
+import bisect
+import heapq
+import math
+from collections import defaultdict
+from parking_lot import SPOT_SIZES, FreeSpotIndex
+
+# Scheduler entry kinds; at equal times an expiry runs before a start so
+# back-to-back holds on one spot hand over cleanly
+EXPIRE = 0
+ACTIVATE = 1
+
+
+def window_end(end_ts):
+    return math.inf if end_ts is None else end_ts
+
+
+class ReservationBook:
+    # Time-windowed holds. Each spot keeps its holds sorted by start time;
+    # holds on one spot never overlap, so their ends are sorted too and
+    # checking a window is a single bisect. A heap of upcoming starts and
+    # ends tells the scheduler what changes next without rescanning.
+    # "Any spot of these sizes for this window" is answered from indexes
+    # kept per bay size: a lazy heap of spots with no holds at all, and the
+    # free windows of the booked spots, sorted by where they open (after
+    # the last hold, between two holds) or close (before the first hold).
+    def __init__(self):
+        self.by_spot = {}
+        self.schedule = []
+        self.sizes = {}
+        self.unbooked = {}
+        self.after_last = {}
+        self.between = {}
+        self.before_first = {}
+        # spot -> [(index, entry)] of its free windows in those indexes
+        self._gaps = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for _, holds in self.by_spot.values():
+            yield from holds
+
+    def reset(self, sizes):
+        # Called with {spot: bay size} whenever the layout is rebuilt
+        self.sizes = dict(sizes)
+        by_size = defaultdict(list)
+        for spot, size in self.sizes.items():
+            if spot not in self.by_spot:
+                by_size[size].append(spot)
+        self.unbooked = {size: FreeSpotIndex(by_size[size]) for size in SPOT_SIZES}
+        self.after_last = {size: [] for size in SPOT_SIZES}
+        self.between = {size: [] for size in SPOT_SIZES}
+        self.before_first = {size: [] for size in SPOT_SIZES}
+        self._gaps = {}
+        for spot in self.by_spot:
+            self._index_gaps(spot)
+
+    def clear(self):
+        self.by_spot.clear()
+        self.schedule = []
+        self._gaps = {}
+        for indexes in (self.after_last, self.between, self.before_first):
+            for entries in indexes.values():
+                entries.clear()
+        self._count = 0
+
+    def _index_gaps(self, spot):
+        # Re-file the free windows of one booked spot after its holds changed
+        for entries, entry in self._gaps.pop(spot, ()):
+            del entries[bisect.bisect_left(entries, entry)]
+        size = self.sizes.get(spot)
+        entry = self.by_spot.get(spot)
+        if size is None or entry is None:
+            return
+        starts, holds = entry
+        gaps = [(self.before_first[size], (starts[0], spot))]
+        for hold, following in zip(holds, starts[1:]):
+            if hold.end_ts < following:
+                gaps.append((self.between[size], (hold.end_ts, following, spot)))
+        if holds[-1].end_ts is not None:
+            gaps.append((self.after_last[size], (holds[-1].end_ts, spot)))
+        for entries, entry in gaps:
+            bisect.insort(entries, entry)
+        self._gaps[spot] = gaps
+
+    def is_available(self, spot, start_ts, end_ts=None):
+        entry = self.by_spot.get(spot)
+        if entry is None:
+            return True
+        starts, holds = entry
+        index = bisect.bisect_left(starts, window_end(end_ts))
+        return index == 0 or window_end(holds[index - 1].end_ts) <= start_ts
+
+    def covering(self, spot, ts):
+        entry = self.by_spot.get(spot)
+        if entry is None:
+            return None
+        starts, holds = entry
+        index = bisect.bisect_right(starts, ts)
+        if index and holds[index - 1].covers(ts):
+            return holds[index - 1]
+        return None
+
+    def holds_for(self, spot):
+        entry = self.by_spot.get(spot)
+        return list(entry[1]) if entry else []
+
+    def add(self, reservation):
+        starts, holds = self.by_spot.setdefault(reservation.spot, ([], []))
+        index = bisect.bisect_left(starts, reservation.start_ts)
+        starts.insert(index, reservation.start_ts)
+        holds.insert(index, reservation)
+        self._count += 1
+        heapq.heappush(self.schedule, (reservation.start_ts, ACTIVATE, reservation.spot, reservation.start_ts))
+        if reservation.end_ts is not None:
+            heapq.heappush(self.schedule, (reservation.end_ts, EXPIRE, reservation.spot, reservation.start_ts))
+        self._index_gaps(reservation.spot)
+
+    def remove(self, spot, start_ts):
+        # Scheduler entries of removed holds are skipped when they come due
+        entry = self.by_spot.get(spot)
+        if entry is None:
+            return None
+        starts, holds = entry
+        index = bisect.bisect_left(starts, start_ts)
+        if index == len(starts) or starts[index] != start_ts:
+            return None
+        del starts[index]
+        reservation = holds.pop(index)
+        self._count -= 1
+        if not holds:
+            del self.by_spot[spot]
+            if spot in self.sizes:
+                self.unbooked[self.sizes[spot]].push(spot)
+        self._index_gaps(spot)
+        return reservation
+
+    def find(self, spot, start_ts):
+        entry = self.by_spot.get(spot)
+        if entry is None:
+            return None
+        starts, holds = entry
+        index = bisect.bisect_left(starts, start_ts)
+        if index < len(starts) and starts[index] == start_ts:
+            return holds[index]
+        return None
+
+    def find_spot(self, start_ts, end_ts=None, sizes=SPOT_SIZES):
+        # A spot of one of `sizes` (smallest first) left open for the whole
+        # window: the lowest one with no holds at all, else the booked spot
+        # whose last hold ends closest before the window, then one with a
+        # gap between two holds around it, then the one whose first hold
+        # starts soonest after it. Whether the spot is free right now is the
+        # caller's business.
+        end = window_end(end_ts)
+        for size in sizes:
+            spot = self.unbooked[size].peek(lambda candidate: candidate not in self.by_spot)
+            if spot is not None:
+                return spot
+            after_last = self.after_last[size]
+            index = bisect.bisect_right(after_last, (start_ts, math.inf))
+            if index:
+                return after_last[index - 1][1]
+            # Gaps opening at or before the start, nearest first
+            between = self.between[size]
+            for index in range(bisect.bisect_right(between, (start_ts, math.inf, math.inf)) - 1, -1, -1):
+                if between[index][1] >= end:
+                    return between[index][2]
+            before_first = self.before_first[size]
+            index = bisect.bisect_left(before_first, (end, -math.inf))
+            if index < len(before_first):
+                return before_first[index][1]
+        return None
+
+    def next_change(self):
+        return self.schedule[0][0] if self.schedule else None
+
+    def due(self, now):
+        # (kind, reservation) for every start or end reached by `now`
+        changes = []
+        while self.schedule and self.schedule[0][0] <= now:
+            ts, kind, spot, start_ts = heapq.heappop(self.schedule)
+            reservation = self.find(spot, start_ts)
+            # Skip entries of holds that were cancelled (or replaced)
+            if reservation is not None and (kind == ACTIVATE or reservation.end_ts == ts):
+                changes.append((kind, reservation))
+        return changes
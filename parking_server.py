@@ -0,0 +1,541 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+from urllib.parse import parse_qs, urlsplit
+from parking_archive import ARCHIVE_INTERVAL, ArchiveJob, retention_cutoff
+from parking_cli import add_lot_arguments, open_lot
+from parking_engine import ParkingError
+from parking_forecast import AvailabilityForecast, ForecastBuild
+from parking_metrics import DUMP_INTERVAL, Metrics, Profiler
+from parking_plates import PLATE_SEARCH_LIMIT
+from parking_records import day_of
+from parking_replay import EventRecorder
+
+DEFAULT_PORT = 8080
+FLUSH_INTERVAL = 0.005
+FLUSH_BATCH = 1000
+RESERVATION_TICK = 1.0
+MAX_BODY = 64 * 1024
+# /batch bodies carry whole gate logs
+MAX_BATCH_BODY = 16 * 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ParkingService:
+    # Gate events against one engine. Every call runs on the event loop
+    # thread (or, with a dispatch function, on whatever thread owns the
+    # engine), so mutations never interleave. Persistence is group-committed:
+    # a mutation is applied and recorded straight away, but its caller only
+    # gets an answer after the next flush has made the whole batch durable.
+    def __init__(self, engine, storage=None, flush_interval=FLUSH_INTERVAL,
+                 flush_batch=FLUSH_BATCH, dispatch=None, forecast=None):
+        self.engine = engine
+        self.forecast_cache = forecast
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.dispatch = dispatch
+        self.events = 0
+        self._batch = None
+        self._pending = 0
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.storage is not None:
+            self._wakeup = asyncio.Event()
+            self._tasks.append(loop.create_task(self._flush_loop()))
+        # An embedding window runs its own reservation scheduler
+        if self.dispatch is None:
+            self._tasks.append(loop.create_task(self._reservation_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self.storage is not None:
+            self.flush()
+
+    async def _call(self, fn, *args, durable=False):
+        if self.dispatch is None:
+            result = fn(*args)
+        else:
+            result = await self.dispatch(fn, *args)
+        if durable:
+            self.events += 1
+            if self.storage is not None:
+                await self._durable()
+        return result
+
+    async def _durable(self):
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+        batch = self._batch
+        self._pending += 1
+        if self._pending >= self.flush_batch:
+            self._wakeup.set()
+        await asyncio.shield(batch)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.flush()
+
+    async def _reservation_loop(self):
+        while True:
+            await asyncio.sleep(RESERVATION_TICK)
+            changes = self.engine.update_reservations()
+            if changes:
+                self.events += changes
+                if self.storage is not None and self._batch is None:
+                    # Nobody waits on these, but they go out with the next flush
+                    self._batch = asyncio.get_running_loop().create_future()
+
+    def flush(self):
+        # One fsync/commit for every event recorded since the last flush
+        if self._batch is None:
+            return
+        batch, self._batch, self._pending = self._batch, None, 0
+        try:
+            self.storage.flush()
+            self.storage.save(self.engine)
+        except Exception as e:
+            batch.set_exception(e)
+            # Nobody may be left waiting on the batch
+            batch.exception()
+            return
+        batch.set_result(None)
+
+    # Operations
+
+    async def park(self, vehicle, vtype, owner, phone=""):
+        spot = await self._call(self.engine.park, vehicle, vtype, owner, phone, durable=True)
+        return {"spot": spot}
+
+    async def exit(self, spot=None, vehicle=None):
+        def remove():
+            if spot is not None:
+                return self.engine.remove(spot)
+            found = self.engine.find_vehicle(vehicle)
+            if found is None:
+                raise ParkingError(f"Vehicle {vehicle.strip().upper()} is not currently parked.")
+            return self.engine.remove(found)
+
+        record = await self._call(remove, durable=True)
+        return record.to_dict()
+
+    async def reserve(self, spot=None, holder="", start=None, end=None, vtype=None):
+        if spot is None:
+            spot = await self._call(self.engine.reserve_any, holder, start, end, vtype, durable=True)
+            return {"spot": spot, "reserved": True}
+        reserved = await self._call(self.engine.reserve, spot, holder, start, end, durable=True)
+        return {"spot": spot, "reserved": reserved}
+
+    async def cancel(self, spot, start=None):
+        reservation = await self._call(self.engine.cancel_reservation, spot, start, durable=True)
+        return reservation.to_dict()
+
+    async def batch(self, operations):
+        # Many operations, one event in storage and one flush
+        results = await self._call(self.engine.run_batch, operations, durable=True)
+        return {"results": [batch_result(result) for result in results]}
+
+    async def occupancy(self, resolution="hour", since=None):
+        def read():
+            occupancy = self.engine.occupancy
+            return {
+                "capacity": self.engine.total_spots,
+                "peak": occupancy.peak,
+                "peak_ts": occupancy.peak_ts,
+                "mean": occupancy.mean_occupancy(self.engine.now()),
+                "series": occupancy.series(resolution, since),
+                "heatmap": occupancy.heatmap()
+            }
+
+        return await self._call(read)
+
+    async def forecast(self):
+        if self.forecast_cache is None:
+            raise RequestError(404, "Forecasts are not enabled")
+        return await self._call(self.forecast_cache.forecast)
+
+    async def availability(self, spot, start=None, end=None):
+        # Whether `spot` is free of holds from `start` (default now) to `end`
+        def check():
+            window_start = self.engine.now() if start is None else start
+            return {
+                "spot": spot,
+                "available": spot in self.engine.parking_spots
+                and self.engine.reservations.is_available(spot, window_start, end),
+                "holds": [r.to_dict() for r in self.engine.reservations.holds_for(spot)]
+            }
+
+        return await self._call(check)
+
+    async def search(self, vehicle):
+        def find():
+            spot = self.engine.find_vehicle(vehicle)
+            if spot is None:
+                return {"found": False, "vehicle": vehicle.strip().upper()}
+            info = self.engine.spot_info(spot)
+            return dict(self.engine.parked_vehicles[spot].to_dict(), found=True, spot=spot,
+                        level=info.level, zone=info.zone)
+
+        return await self._call(find)
+
+    async def plates(self, text, limit=PLATE_SEARCH_LIMIT):
+        def find():
+            return {"matches": [match.to_dict() for match in self.engine.search_plates(text, limit)]}
+
+        return await self._call(find)
+
+    async def revenue(self, start_day=None, end_day=None):
+        def read():
+            stats = self.engine.history.stats
+            return {"days": {day: {"sessions": stats.sessions_by_day[day], "revenue": revenue}
+                             for day, revenue in stats.revenue_by_day.items()
+                             if (not start_day or day >= start_day) and (not end_day or day <= end_day)}}
+
+        return await self._call(read)
+
+    async def status(self):
+        def snapshot():
+            engine = self.engine
+            now = engine.now()
+            return {
+                "total_spots": engine.total_spots,
+                "occupied": engine.occupied_count,
+                "available": engine.available_count,
+                "reserved": len(engine.reserved_spots),
+                "sessions": len(engine.history),
+                "today_revenue": engine.history.revenue_for_day(day_of(now)),
+                "total_revenue": engine.history.total_revenue(),
+                "peak": engine.occupancy.peak,
+                "utilisation": engine.occupancy.utilisation(engine.total_spots, now)
+            }
+
+        return dict(await self._call(snapshot), events=self.events)
+
+
+def batch_result(result):
+    if isinstance(result, ParkingError):
+        return {"error": str(result)}
+    if isinstance(result, int):
+        return {"spot": result}
+    return result.to_dict()
+
+
+def field(body, name, kind=str, required=True):
+    value = body.get(name)
+    if value is None:
+        if required:
+            raise RequestError(400, f"Missing field {name}")
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise RequestError(400, f"Invalid field {name}")
+
+
+class ParkingServer:
+    # Minimal HTTP/1.1 + JSON front end for gate terminals:
+    #   POST /park {"vehicle", "type", "owner", "phone"}
+    #   POST /exit {"spot"} or {"vehicle"}
+    #   POST /reserve {"spot", "holder", "start_ts", "end_ts"} (no spot: any
+    #        spot, optionally one that fits "type")
+    #   POST /cancel {"spot", "start_ts"} (no start: the hold running now)
+    #   POST /batch {"operations": [...]} (see ParkingEngine.run_batch)
+    #   GET  /availability?spot=...&start_ts=...&end_ts=...
+    #   GET  /occupancy?resolution=minute|hour|day&since=...
+    #   GET  /revenue?from=YYYY-MM-DD&to=YYYY-MM-DD
+    #   GET  /search?vehicle=...
+    #   GET  /plates?q=...&limit=...
+    #   GET  /forecast (expected free spots in 15/30/60 minutes)
+    #   GET  /status
+    #   GET  /metrics (Prometheus text, when metrics are on)
+    # Connections are kept alive, so a gate holds one socket open.
+    def __init__(self, service, metrics=None):
+        self.service = service
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.instrument(self, ("respond",), "http_")
+            metrics.instrument(service, ("flush",), "group_commit_")
+            metrics.gauge("events_applied", lambda: service.events, "Mutations applied since start")
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/")
+        routes = {
+            "/park": "POST", "/exit": "POST", "/reserve": "POST", "/cancel": "POST",
+            "/search": "GET", "/availability": "GET", "/occupancy": "GET", "/status": "GET",
+            "/plates": "GET", "/revenue": "GET", "/batch": "POST", "/forecast": "GET"
+        }
+        if self.metrics is not None:
+            routes["/metrics"] = "GET"
+        if path not in routes:
+            raise RequestError(404, f"Unknown path {url.path}")
+        if method != routes[path]:
+            raise RequestError(405, f"{path} expects {routes[path]}")
+
+        if method == "POST":
+            try:
+                body = json.loads(body or b"{}")
+            except ValueError:
+                raise RequestError(400, "Body must be JSON")
+            if not isinstance(body, dict):
+                raise RequestError(400, "Body must be a JSON object")
+
+        if path == "/park":
+            return await self.service.park(field(body, "vehicle"), field(body, "type"),
+                                           field(body, "owner"),
+                                           field(body, "phone", required=False) or "")
+        if path == "/exit":
+            spot = field(body, "spot", int, required=False)
+            vehicle = field(body, "vehicle", required=spot is None)
+            return await self.service.exit(spot, vehicle)
+        if path == "/reserve":
+            return await self.service.reserve(field(body, "spot", int, required=False),
+                                              field(body, "holder", required=False) or "",
+                                              field(body, "start_ts", int, required=False),
+                                              field(body, "end_ts", int, required=False),
+                                              field(body, "type", required=False))
+        if path == "/cancel":
+            return await self.service.cancel(field(body, "spot", int),
+                                             field(body, "start_ts", int, required=False))
+        if path == "/metrics":
+            return self.metrics.render()
+        if path == "/batch":
+            operations = body.get("operations")
+            if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+                raise RequestError(400, "operations must be a list of objects")
+            return await self.service.batch(operations)
+        if path == "/occupancy":
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            resolution = query.get("resolution", "hour")
+            if resolution not in ("minute", "hour", "day"):
+                raise RequestError(400, "resolution must be minute, hour or day")
+            return await self.service.occupancy(resolution, field(query, "since", int, required=False))
+        if path == "/availability":
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            return await self.service.availability(field(query, "spot", int),
+                                                   field(query, "start_ts", int, required=False),
+                                                   field(query, "end_ts", int, required=False))
+        if path == "/search":
+            vehicle = parse_qs(url.query).get("vehicle", [""])[0]
+            if not vehicle.strip():
+                raise RequestError(400, "Missing query parameter vehicle")
+            return await self.service.search(vehicle)
+        if path == "/revenue":
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            return await self.service.revenue(query.get("from"), query.get("to"))
+        if path == "/plates":
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            if not query.get("q", "").strip():
+                raise RequestError(400, "Missing query parameter q")
+            return await self.service.plates(query["q"],
+                                             field(query, "limit", int, required=False) or PLATE_SEARCH_LIMIT)
+        if path == "/forecast":
+            return await self.service.forecast()
+        return await self.service.status()
+
+    async def respond(self, method, target, body):
+        try:
+            return 200, await self.route(method, target, body)
+        except RequestError as e:
+            return e.status, {"error": str(e)}
+        except ParkingError as e:
+            return 409, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                limit = MAX_BATCH_BODY if target.split("?")[0].rstrip("/") == "/batch" else MAX_BODY
+                if length > limit:
+                    status, payload = 413, {"error": "Request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.respond(method.upper(), target, body)
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = (connection != "close" if version == "HTTP/1.1"
+                                  else connection == "keep-alive")
+
+                if isinstance(payload, str):
+                    data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+                head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                        f"Content-Type: {content_type}\r\n"
+                        f"Content-Length: {len(data)}\r\n")
+                if not keep_alive:
+                    head += "Connection: close\r\n"
+                writer.write(head.encode("latin-1") + b"\r\n" + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutting down with the connection idle; end quietly
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, started=None, path=None):
+        # Runs until cancelled, then flushes whatever is still pending. With
+        # `path` it listens on that Unix socket instead of host:port.
+        self.service.start()
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)  # left over from a previous run
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parking Management System gate server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of a TCP port")
+    add_lot_arguments(parser, storage="journal")
+    parser.add_argument("--flush-ms", type=float, default=FLUSH_INTERVAL * 1000,
+                        help="group commit interval in milliseconds")
+    parser.add_argument("--flush-batch", type=int, default=FLUSH_BATCH,
+                        help="flush early once this many events are waiting")
+    parser.add_argument("--retention-days", type=int, metavar="DAYS",
+                        help="move sessions older than DAYS days to the compressed archive, hourly")
+    parser.add_argument("--metrics", action="store_true", help="serve timings and counters on /metrics")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="also write the metrics to PATH every --metrics-interval seconds")
+    parser.add_argument("--metrics-interval", type=float, default=DUMP_INTERVAL)
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and write the stats to FILE")
+    parser.add_argument("--record-events", metavar="PATH",
+                        help="append every event to PATH for parking_replay.py")
+    args = parser.parse_args()
+
+    # The server fsyncs once per batch instead of once per event
+    options = {"sync_each_event": False} if args.storage == "journal" else {}
+    engine, storage = open_lot(args, options, args.retention_days, backfill=True, plates=True)
+    forecast = AvailabilityForecast(engine)
+    engine.subscribe(forecast.on_event)
+    ForecastBuild(engine, forecast).run_now(forecast)
+    metrics = None
+    if args.metrics or args.metrics_file:
+        # Before subscribe(), so the journal callback is the timed one
+        metrics = Metrics()
+        metrics.instrument_engine(engine)
+        metrics.instrument_storage(storage)
+        metrics.gauge("forecast_refreshes", lambda: forecast.refreshes,
+                      "Times the availability forecast was recomputed")
+    engine.subscribe(storage.record)
+    recorder = EventRecorder(args.record_events) if args.record_events else None
+    if recorder is not None:
+        engine.subscribe(recorder.record)
+
+    service = ParkingService(engine, storage, args.flush_ms / 1000, args.flush_batch, forecast=forecast)
+    server = ParkingServer(service, metrics)
+    profiler = Profiler(args.profile) if args.profile else None
+
+    async def archive_history():
+        # Expired sessions are written out on a worker thread; the commit and
+        # the trim of the hot store happen here, between requests
+        loop = asyncio.get_running_loop()
+        while True:
+            job = ArchiveJob(engine, retention_cutoff(args.retention_days, engine.now()))
+            if job.count:
+                await loop.run_in_executor(None, job.run)
+                try:
+                    moved = job.install(engine, storage)
+                except Exception as e:
+                    print(f"Error archiving history: {e}", flush=True)
+                else:
+                    print(f"Archived {moved} sessions", flush=True)
+            await asyncio.sleep(ARCHIVE_INTERVAL)
+
+    async def dump_metrics():
+        while True:
+            await asyncio.sleep(args.metrics_interval)
+            metrics.dump(args.metrics_file)
+
+    async def run():
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, task.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass
+        dumper = asyncio.create_task(dump_metrics()) if args.metrics_file else None
+        archiver = asyncio.create_task(archive_history()) if args.retention_days is not None else None
+        try:
+            where = args.unix or f"http://{args.host}:{args.port}"
+            await server.serve(args.host, args.port, lambda s: print(f"Listening on {where}", flush=True),
+                               path=args.unix)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for background in (dumper, archiver):
+                if background is not None:
+                    background.cancel()
+
+    if profiler is not None:
+        profiler.start()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        storage.close(engine)
+        if recorder is not None:
+            recorder.close()
+        if profiler is not None:
+            profiler.stop()
+        if args.metrics_file:
+            metrics.dump(args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
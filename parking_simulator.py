@@ -0,0 +1,437 @@
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from parking_engine import DEFAULT_RATES, ParkingEngine, ParkingError, VEHICLE_TYPES
+from parking_lot import ALLOCATION_STRATEGIES, DEFAULT_STRATEGY, LotLayout
+from parking_occupancy import OccupancySeries
+from parking_records import format_time
+from parking_storage import STORAGE_BACKENDS, StorageWriter, create_storage, data_dir_options
+from parking_tariff import Tariff
+
+HOUR = 3600
+# Arrivals per hour of the day relative to the mean: quiet nights, a
+# morning and an evening rush
+RUSH_HOUR_PROFILE = [0.2, 0.1, 0.1, 0.1, 0.2, 0.4, 0.9, 1.8, 2.4, 1.9, 1.3, 1.2,
+                     1.3, 1.2, 1.1, 1.2, 1.6, 2.2, 2.0, 1.4, 0.9, 0.6, 0.4, 0.3]
+DEFAULT_MIX = {"Car": 70, "Bike": 15, "SUV": 10, "Truck": 5}
+ARRIVAL_PROCESSES = ("poisson", "profile", "fixed")
+DWELL_DISTRIBUTIONS = ("lognormal", "exponential", "uniform", "fixed")
+SIM_OWNER = "Simulated"
+# Events written per group commit when a storage backend is attached
+SIM_COMMIT_EVERY = 1000
+
+# Event kinds, in the order they run when they fall on the same second:
+# spots are freed before new arrivals look for one
+DEPART = 0
+GENERATE = 1
+ARRIVE = 2
+
+
+class Scenario:
+    # Traffic for one simulation run: when vehicles arrive, how long they
+    # stay, what they drive and how many book ahead
+    def __init__(self, hours=24, process="profile", rate=60.0, profile=None,
+                 dwell="lognormal", dwell_hours=2.5, dwell_spread=0.8, min_minutes=5,
+                 max_hours=24, mix=None, reserve_share=0.0, lead_hours=2.0, hold_minutes=30,
+                 no_show=0.1):
+        if process not in ARRIVAL_PROCESSES:
+            raise ValueError(f"Unknown arrival process {process}")
+        if dwell not in DWELL_DISTRIBUTIONS:
+            raise ValueError(f"Unknown dwell-time distribution {dwell}")
+        if rate <= 0 or dwell_hours <= 0:
+            raise ValueError("Arrival rate and dwell time must be positive")
+        self.hours = hours
+        self.process = process
+        # Mean arrivals per hour over the day
+        self.rate = rate
+        self.profile = list(profile or RUSH_HOUR_PROFILE)
+        if len(self.profile) != 24 or min(self.profile) < 0 or not sum(self.profile):
+            raise ValueError("An arrival profile needs 24 non-negative hourly weights")
+        self.dwell = dwell
+        self.dwell_hours = dwell_hours
+        self.dwell_spread = dwell_spread
+        self.min_minutes = min_minutes
+        self.max_hours = max_hours
+        self.mix = dict(mix or DEFAULT_MIX)
+        for vtype in self.mix:
+            if vtype not in VEHICLE_TYPES:
+                raise ValueError(f"Unknown vehicle type {vtype}")
+        self.reserve_share = reserve_share
+        self.lead_hours = lead_hours
+        self.hold_minutes = hold_minutes
+        self.no_show = no_show
+
+    @classmethod
+    def from_dict(cls, data):
+        # {"hours": 24,
+        #  "arrivals": {"process": "profile", "rate": 60, "profile": [24 weights]},
+        #  "dwell": {"distribution": "lognormal", "mean_hours": 2.5, "spread": 0.8,
+        #            "min_minutes": 5, "max_hours": 24},
+        #  "mix": {"Car": 70, "Bike": 15},
+        #  "reservations": {"share": 0.05, "lead_hours": 2, "hold_minutes": 30, "no_show": 0.1}}
+        arrivals = data.get("arrivals", {})
+        dwell = data.get("dwell", {})
+        reservations = data.get("reservations", {})
+        return cls(hours=data.get("hours", 24),
+                   process=arrivals.get("process", "profile"),
+                   rate=arrivals.get("rate", 60.0),
+                   profile=arrivals.get("profile"),
+                   dwell=dwell.get("distribution", "lognormal"),
+                   dwell_hours=dwell.get("mean_hours", 2.5),
+                   dwell_spread=dwell.get("spread", 0.8),
+                   min_minutes=dwell.get("min_minutes", 5),
+                   max_hours=dwell.get("max_hours", 24),
+                   mix=data.get("mix"),
+                   reserve_share=reservations.get("share", 0.0),
+                   lead_hours=reservations.get("lead_hours", 2.0),
+                   hold_minutes=reservations.get("hold_minutes", 30),
+                   no_show=reservations.get("no_show", 0.1))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        return {
+            "hours": self.hours,
+            "arrivals": {"process": self.process, "rate": self.rate, "profile": self.profile},
+            "dwell": {"distribution": self.dwell, "mean_hours": self.dwell_hours,
+                      "spread": self.dwell_spread, "min_minutes": self.min_minutes,
+                      "max_hours": self.max_hours},
+            "mix": self.mix,
+            "reservations": {"share": self.reserve_share, "lead_hours": self.lead_hours,
+                             "hold_minutes": self.hold_minutes, "no_show": self.no_show}
+        }
+
+
+class Simulator:
+    # Discrete-event simulation of a lot: arrivals, departures and bookings
+    # sit in a heap keyed on a virtual clock, and each one is applied to the
+    # engine with that clock as `now`, so a day of traffic runs in as long as
+    # the engine calls take. The next arrival is drawn only when the one
+    # before it is scheduled, `lead_hours` ahead so it can book first.
+    def __init__(self, engine, scenario, start_ts=None, seed=1, writer=None,
+                 commit_every=SIM_COMMIT_EVERY):
+        self.engine = engine
+        self.scenario = scenario
+        self.start_ts = int(time.time()) if start_ts is None else start_ts
+        self.end_ts = self.start_ts + int(scenario.hours * HOUR)
+        self.rng = random.Random(seed)
+        self.writer = writer
+        self.commit_every = commit_every
+        self.now = self.start_ts
+        self.queue = []
+        self._seq = 0
+        self.arrived = 0
+        # The live occupancy series restarts on the virtual clock
+        engine.occupancy = OccupancySeries()
+        engine.occupancy.record(self.start_ts, engine.occupied_count)
+
+        self.types = list(scenario.mix)
+        self.weights = list(scenario.mix.values())
+        # Thinning bound for the hour-of-day profile, which is scaled to a
+        # mean of 1 so `rate` stays the daily mean
+        scale = 24 / sum(scenario.profile)
+        self.profile = [weight * scale for weight in scenario.profile]
+        self.peak_weight = max(self.profile)
+        spread = scenario.dwell_spread
+        self._mu = math.log(scenario.dwell_hours * HOUR) - spread * spread / 2
+        self.lead = int(scenario.lead_hours * HOUR)
+
+        hours = math.ceil(scenario.hours)
+        self.hourly = {name: [0] * hours for name in ("arrived", "parked", "rejected", "exits")}
+        self.hourly["revenue"] = [0.0] * hours
+        self.hourly["occupancy"] = [0.0] * hours
+        self.hourly["peak"] = [0] * hours
+        self.totals = {"arrived": 0, "parked": 0, "rejected": 0, "exits": 0, "revenue": 0.0,
+                       "dwell_seconds": 0, "booked": 0, "refused": 0, "no_shows": 0}
+        self.rejected_by_type = dict.fromkeys(self.types, 0)
+        self.rejected_by_reason = {}
+        self.revenue_by_type = dict.fromkeys(self.types, 0.0)
+        self.events = 0
+
+    def push(self, ts, kind, data=None):
+        self._seq += 1
+        heapq.heappush(self.queue, (ts, kind, self._seq, data))
+
+    # Traffic
+
+    def next_arrival(self, after):
+        scenario = self.scenario
+        if scenario.process == "fixed":
+            return after + HOUR / scenario.rate
+        if scenario.process == "poisson":
+            return after + self.rng.expovariate(scenario.rate / HOUR)
+        # Non-homogeneous Poisson by thinning: draw at the peak rate and keep
+        # each arrival with the weight of its hour of day
+        ts = after
+        peak_rate = scenario.rate * self.peak_weight / HOUR
+        while True:
+            ts += self.rng.expovariate(peak_rate)
+            if self.rng.random() * self.peak_weight < self.profile[time.localtime(ts).tm_hour]:
+                return ts
+
+    def dwell_seconds(self):
+        scenario = self.scenario
+        mean = scenario.dwell_hours * HOUR
+        if scenario.dwell == "lognormal":
+            seconds = self.rng.lognormvariate(self._mu, scenario.dwell_spread)
+        elif scenario.dwell == "exponential":
+            seconds = self.rng.expovariate(1 / mean)
+        elif scenario.dwell == "uniform":
+            seconds = self.rng.uniform(mean * (1 - scenario.dwell_spread), mean * (1 + scenario.dwell_spread))
+        else:
+            seconds = mean
+        return int(min(max(seconds, scenario.min_minutes * 60), scenario.max_hours * HOUR))
+
+    def schedule_arrival(self, after):
+        ts = self.next_arrival(after)
+        if ts < self.end_ts:
+            self.push(max(self.now, int(ts) - self.lead), GENERATE, ts)
+
+    # Event handlers
+
+    def generate(self, arrival_ts):
+        # Decide who arrives at `arrival_ts`; bookers reserve now, lead
+        # hours ahead of it
+        self.arrived += 1
+        plate = f"SIM{self.arrived:07d}"
+        vtype = self.rng.choices(self.types, self.weights)[0]
+        arrival = int(arrival_ts)
+        booking = None
+        if self.scenario.reserve_share and self.rng.random() < self.scenario.reserve_share:
+            end = arrival + int(self.scenario.hold_minutes * 60)
+            try:
+                spot = self.engine.reserve_any(plate, arrival, end, vtype, now=self.now)
+                booking = (spot, arrival)
+                self.totals["booked"] += 1
+            except ParkingError:
+                self.totals["refused"] += 1
+            if booking is not None and self.rng.random() < self.scenario.no_show:
+                # The hold runs out on its own
+                self.totals["no_shows"] += 1
+                self.schedule_arrival(arrival_ts)
+                return
+        self.push(arrival, ARRIVE, (plate, vtype, booking))
+        self.schedule_arrival(arrival_ts)
+
+    def arrive(self, plate, vtype, booking):
+        hour = self.hour_index()
+        self.totals["arrived"] += 1
+        self.hourly["arrived"][hour] += 1
+        if booking is not None:
+            # Hand the hold back so the booked spot can be allocated
+            try:
+                self.engine.cancel_reservation(booking[0], booking[1], now=self.now)
+            except ParkingError:
+                pass
+        try:
+            spot = self.engine.park(plate, vtype, SIM_OWNER, now=self.now)
+        except ParkingError as e:
+            self.totals["rejected"] += 1
+            self.hourly["rejected"][hour] += 1
+            self.rejected_by_type[vtype] += 1
+            reason = str(e)
+            self.rejected_by_reason[reason] = self.rejected_by_reason.get(reason, 0) + 1
+            return
+        self.totals["parked"] += 1
+        self.hourly["parked"][hour] += 1
+        self.push(self.now + self.dwell_seconds(), DEPART, spot)
+
+    def depart(self, spot):
+        record = self.engine.remove(spot, now=self.now)
+        hour = self.hour_index()
+        self.totals["exits"] += 1
+        self.totals["revenue"] += record.fee
+        self.totals["dwell_seconds"] += record.exit_ts - record.entry_ts
+        self.hourly["exits"][hour] += 1
+        self.hourly["revenue"][hour] += record.fee
+        self.revenue_by_type[record.type] = self.revenue_by_type.get(record.type, 0.0) + record.fee
+
+    def hour_index(self):
+        return min(len(self.hourly["arrived"]) - 1, (self.now - self.start_ts) // HOUR)
+
+    def update_reservations(self, until):
+        # Holds start and run out at their own times, not the next event's
+        engine = self.engine
+        due = engine.next_reservation_change()
+        while due is not None and due <= until:
+            engine.update_reservations(due)
+            self.events += 1
+            due = engine.next_reservation_change()
+
+    # Run
+
+    def run(self):
+        engine = self.engine
+        writer = self.writer
+        self.schedule_arrival(self.start_ts)
+        started = time.perf_counter()
+        while self.queue and self.queue[0][0] < self.end_ts:
+            ts, kind, _, data = heapq.heappop(self.queue)
+            self.update_reservations(ts)
+            self.now = ts
+            if kind == DEPART:
+                self.depart(data)
+            elif kind == GENERATE:
+                self.generate(data)
+            else:
+                self.arrive(*data)
+            self.events += 1
+            if writer is not None and writer.pending >= self.commit_every:
+                writer.commit(engine)
+        self.update_reservations(self.end_ts)
+        self.now = self.end_ts
+        engine.occupancy.advance(self.end_ts)
+        if writer is not None:
+            writer.commit(engine)
+            writer.drain()
+        return self.report(time.perf_counter() - started)
+
+    def report(self, seconds):
+        engine = self.engine
+        totals = self.totals
+        simulated = self.end_ts - self.start_ts
+        peak, peak_ts = engine.occupancy.peak_occupancy()
+        hourly = dict(self.hourly, revenue=[round(fee, 2) for fee in self.hourly["revenue"]])
+        for start, mean, top in engine.occupancy.series("hour", since=self.start_ts):
+            index = (start - self.start_ts) // HOUR
+            if 0 <= index < len(hourly["occupancy"]):
+                hourly["occupancy"][index] = round(mean, 2)
+                hourly["peak"][index] = top
+        return {
+            "scenario": self.scenario.to_dict(),
+            "start": format_time(self.start_ts),
+            "spots": engine.total_spots,
+            "strategy": engine.strategy,
+            "wall_seconds": seconds,
+            "speedup": simulated / seconds if seconds else None,
+            "events": self.events,
+            "events_per_second": self.events / seconds if seconds else None,
+            "arrived": totals["arrived"],
+            "parked": totals["parked"],
+            "rejected": totals["rejected"],
+            "rejection_rate": totals["rejected"] / totals["arrived"] if totals["arrived"] else 0.0,
+            "rejected_by_type": self.rejected_by_type,
+            "rejected_by_reason": self.rejected_by_reason,
+            "throughput_per_hour": totals["parked"] / (simulated / HOUR) if simulated else 0.0,
+            "exits": totals["exits"],
+            "still_parked": engine.occupied_count,
+            "revenue": round(totals["revenue"], 2),
+            "revenue_by_type": {vtype: round(fee, 2) for vtype, fee in self.revenue_by_type.items()},
+            "mean_dwell_hours": totals["dwell_seconds"] / totals["exits"] / HOUR if totals["exits"] else 0.0,
+            "reservations": {"booked": totals["booked"], "refused": totals["refused"],
+                             "no_shows": totals["no_shows"]},
+            "peak_occupancy": peak,
+            "peak_at": format_time(peak_ts) if peak_ts is not None else None,
+            "mean_utilisation": engine.occupancy.utilisation(engine.total_spots, self.end_ts),
+            "hourly": hourly
+        }
+
+
+def print_report(report):
+    print(f"Simulated {report['scenario']['hours']:g} h from {report['start']} in "
+          f"{report['wall_seconds']:.2f} s ({report['speedup'] or 0:,.0f}x real time, "
+          f"{report['events_per_second'] or 0:,.0f} events/s)")
+    print(f"Arrivals {report['arrived']}: parked {report['parked']}, rejected {report['rejected']} "
+          f"({report['rejection_rate']:.1%}), {report['throughput_per_hour']:.1f} parked per hour")
+    for reason, count in sorted(report["rejected_by_reason"].items()):
+        print(f"  {reason} x{count}")
+    print(f"Revenue ₹{report['revenue']:.2f} from {report['exits']} sessions "
+          f"(mean stay {report['mean_dwell_hours']:.2f} h), {report['still_parked']} still parked")
+    print(f"Peak occupancy {report['peak_occupancy']}/{report['spots']} at {report['peak_at']}, "
+          f"mean utilisation {report['mean_utilisation']:.1%}")
+    bookings = report["reservations"]
+    if bookings["booked"] or bookings["refused"]:
+        print(f"Reservations: {bookings['booked']} booked, {bookings['refused']} refused, "
+              f"{bookings['no_shows']} no-shows")
+    hourly = report["hourly"]
+    print(f"{'Hour':>4} {'Arrived':>8} {'Parked':>7} {'Rejected':>9} {'Exits':>6} {'Revenue':>10} "
+          f"{'Occupancy':>10} {'Peak':>5}")
+    for hour in range(len(hourly["arrived"])):
+        print(f"{hour:>4} {hourly['arrived'][hour]:>8} {hourly['parked'][hour]:>7} "
+              f"{hourly['rejected'][hour]:>9} {hourly['exits'][hour]:>6} {hourly['revenue'][hour]:>10.2f} "
+              f"{hourly['occupancy'][hour]:>10.1f} {hourly['peak'][hour]:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate parking traffic for capacity planning")
+    parser.add_argument("--scenario", metavar="CONFIG", help="scenario file (see scenario.example.json)")
+    parser.add_argument("--hours", type=float, help="simulated time (default: 24)")
+    parser.add_argument("--arrivals", choices=ARRIVAL_PROCESSES, help="arrival process (default: profile)")
+    parser.add_argument("--rate", type=float, help="mean arrivals per hour (default: 60)")
+    parser.add_argument("--dwell", choices=DWELL_DISTRIBUTIONS, help="dwell-time distribution (default: lognormal)")
+    parser.add_argument("--dwell-hours", type=float, help="mean stay in hours (default: 2.5)")
+    parser.add_argument("--reserve-share", type=float, help="share of arrivals that book ahead (default: 0)")
+    parser.add_argument("--start", metavar="YYYY-MM-DD", help="first simulated day (default: today)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spots", type=int, default=50)
+    parser.add_argument("--lot", metavar="CONFIG", help="lot layout file")
+    parser.add_argument("--strategy", choices=sorted(ALLOCATION_STRATEGIES), default=DEFAULT_STRATEGY)
+    parser.add_argument("--tariff", metavar="CONFIG", help="tariff file")
+    parser.add_argument("--storage", choices=sorted(STORAGE_BACKENDS),
+                        help="also persist every event through this backend")
+    parser.add_argument("--data-dir", metavar="DIR",
+                        help="empty directory --storage writes to (default: a new temporary directory)")
+    parser.add_argument("--commit-every", type=int, default=SIM_COMMIT_EVERY,
+                        help=f"events per group commit with --storage (default: {SIM_COMMIT_EVERY})")
+    parser.add_argument("--output", metavar="PATH", help="also write the full report as JSON")
+    args = parser.parse_args()
+
+    if args.storage and args.data_dir:
+        # Simulated sessions must never mix with a real lot's data, whose
+        # history would also stop being in exit order
+        existing = [path for kind in STORAGE_BACKENDS for path in data_dir_options(kind, args.data_dir).values()
+                    if os.path.exists(path)]
+        if existing:
+            parser.error(f"{args.data_dir} already holds lot data ({', '.join(sorted(set(existing)))}); "
+                         "give --data-dir an empty directory")
+
+    scenario = Scenario.load(args.scenario) if args.scenario else Scenario()
+    overrides = {"hours": args.hours, "process": args.arrivals, "rate": args.rate, "dwell": args.dwell,
+                 "dwell_hours": args.dwell_hours, "reserve_share": args.reserve_share}
+    for name, value in overrides.items():
+        if value is not None:
+            setattr(scenario, name, value)
+    scenario = Scenario.from_dict(scenario.to_dict())  # validate the overrides
+
+    day = datetime.strptime(args.start, "%Y-%m-%d") if args.start else datetime.now()
+    start_ts = int(day.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+    layout = LotLayout.load(args.lot) if args.lot else None
+    tariff = Tariff.load(args.tariff, DEFAULT_RATES) if args.tariff else None
+    engine = ParkingEngine(total_spots=args.spots, layout=layout, strategy=args.strategy, tariff=tariff)
+
+    writer = None
+    if args.storage:
+        options = {"sync_each_event": False} if args.storage == "journal" else {}
+        data_dir = args.data_dir or tempfile.mkdtemp(prefix="parking_sim_")
+        storage = create_storage(args.storage, data_dir, **options)
+        storage.load(engine)
+        writer = StorageWriter(storage)
+        engine.subscribe(writer.record)
+        writer.start()
+    try:
+        report = Simulator(engine, scenario, start_ts, args.seed, writer, args.commit_every).run()
+    finally:
+        if writer is not None:
+            writer.close(engine)
+
+    print_report(report)
+    if writer is not None:
+        print(f"Simulated lot data written to {data_dir}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
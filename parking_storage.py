@@ -0,0 +1,638 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from array import array
+from parking_history import HISTORY_SORT_KEYS, HistoryQueries, HistoryStats, HistoryWarmup, MemoryHistory
+from parking_records import (ParkedVehicle, Reservation, SessionRecord, VEHICLE_TYPE_CODES,
+                             VEHICLE_TYPE_LIST, day_end, day_start)
+
+
+def write_atomic(path, text):
+    # Write to a temp file, fsync it and rename over the target so a crash
+    # leaves either the old or the new file, never a truncated one.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    directory = os.path.dirname(os.path.abspath(path))
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class JsonStorage:
+    # Original storage: the whole state rewritten into one JSON file on save.
+    def __init__(self, path="parking_data.json"):
+        self.path = path
+        self.bytes_written = 0
+
+    def load(self, engine, background=False):
+        # One JSON document, so there is nothing to stream
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                engine.load_dict(json.load(f))
+
+    def record(self, event):
+        pass
+
+    def flush(self):
+        pass
+
+    def save(self, engine):
+        text = json.dumps(engine.to_dict(), indent=4)
+        write_atomic(self.path, text)
+        self.bytes_written += len(text)
+
+    def prune_history(self, engine):
+        # The history was trimmed (archived); rewrite without it
+        self.save(engine)
+
+    def close(self, engine):
+        pass
+
+
+class JournalStorage:
+    # Append-only write-ahead journal plus periodic compacted snapshots.
+    # Every event is appended and fsynced, so per-event cost does not grow
+    # with history. Every `snapshot_every` events the sessions closed since
+    # the last snapshot are appended to a JSON-lines history file and the
+    # live state (parked vehicles, reservations) is written atomically to a
+    # small snapshot. Loading reads the snapshot, replays the journal tail
+    # and then streams the history file, optionally on a background thread.
+    def __init__(self, directory="parking_journal", snapshot_every=1000,
+                 legacy_path="parking_data.json", sync_each_event=True):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        # With sync_each_event off, callers group-commit through flush()
+        self.sync_each_event = sync_each_event
+        self.legacy_path = legacy_path
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.journal_path = os.path.join(directory, "journal.log")
+        self.history_path = os.path.join(directory, "history.jsonl")
+        self.seq = 0
+        self.events_since_snapshot = 0
+        self.history_bytes = 0
+        self.pending_sessions = []
+        self.bytes_written = 0
+        self._journal = None
+
+    def load(self, engine, background=False):
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot["seq"]
+            if "state" in snapshot:
+                # Older snapshot holding the whole history inline
+                engine.load_dict(snapshot["state"])
+                self.pending_sessions = [record.to_dict() for record in engine.history]
+            else:
+                engine.load_dict(snapshot)
+                self.history_bytes = snapshot["history_bytes"]
+                # Named since history rewrites, before that always history.jsonl
+                self.history_path = os.path.join(self.directory, snapshot.get("history_file", "history.jsonl"))
+        elif self.legacy_path and os.path.exists(self.legacy_path):
+            # First start in journal mode: import the old JSON file
+            with open(self.legacy_path, "r") as f:
+                engine.load_dict(json.load(f))
+            self.pending_sessions = [record.to_dict() for record in engine.history]
+        self.seq = snapshot_seq
+
+        # Replay the journal tail
+        valid_size = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # torn write from a crash
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    valid_size += len(line)
+                    if entry["seq"] > snapshot_seq:
+                        engine.apply_event(entry["event"])
+                        self.events_since_snapshot += self._track(entry["event"])
+                        self.seq = entry["seq"]
+
+        # Sessions closed before the snapshot are still on disk
+        path, limit = self.history_path, self.history_bytes
+
+        self._journal = open(self.journal_path, "ab")
+        self._journal.truncate(valid_size)
+        if not os.path.exists(self.snapshot_path):
+            self.compact(engine)
+
+        warmup = None
+        if limit:
+            warmup = HistoryWarmup(lambda: self._read_history(path, limit))
+            if not background:
+                warmup.run_now(engine)
+                warmup = None
+        return warmup
+
+    def _read_history(self, path, limit):
+        # Stream the first `limit` bytes of a history file, one session per line
+        with open(path, "rb") as f:
+            for line in f:
+                limit -= len(line)
+                if limit < 0:
+                    break
+                yield SessionRecord.from_dict(json.loads(line))
+
+    def _track(self, event):
+        # Returns the number of engine events in `event`
+        op = event["op"]
+        if op in ("exit", "session"):
+            self.pending_sessions.append(event["record"])
+        elif op == "clear":
+            self.pending_sessions = []
+            self.history_bytes = 0
+        elif op == "batch":
+            return sum(self._track(inner) for inner in event["events"])
+        return 1
+
+    def record(self, event):
+        self.seq += 1
+        line = json.dumps({"seq": self.seq, "event": event}, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._journal.write(line)
+        self.bytes_written += len(line)
+        if self.sync_each_event:
+            self.flush()
+        # A batch is one line, so it is replayed whole or not at all
+        self.events_since_snapshot += self._track(event)
+
+    def flush(self):
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def save(self, engine):
+        if self.events_since_snapshot >= self.snapshot_every:
+            self.compact(engine)
+
+    def compact(self, engine):
+        # Anything past `history_bytes` was not covered by a snapshot (a crash
+        # mid-compaction), so cut it off before appending
+        with open(self.history_path, "ab") as f:
+            f.truncate(self.history_bytes)
+            for record in self.pending_sessions:
+                f.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            history_bytes = os.fstat(f.fileno()).st_size
+
+        self._write_snapshot(engine, history_bytes)
+        self.pending_sessions = []
+        self._truncate_journal()
+
+    def _write_snapshot(self, engine, history_bytes):
+        snapshot = json.dumps(dict(engine.state_dict(), seq=self.seq, history_bytes=history_bytes,
+                                   history_file=os.path.basename(self.history_path)),
+                              separators=(",", ":"))
+        write_atomic(self.snapshot_path, snapshot)
+        self.bytes_written += max(0, history_bytes - self.history_bytes) + len(snapshot)
+        self.history_bytes = history_bytes
+
+    def _truncate_journal(self):
+        # Events up to `seq` are now in the snapshot; a crash before the
+        # truncate is harmless because replay skips them by sequence number.
+        self._journal.truncate(0)
+        self._journal.seek(0)
+        os.fsync(self._journal.fileno())
+        self.events_since_snapshot = 0
+
+    def prune_history(self, engine):
+        # The history was trimmed (archived): write what is left to a new
+        # history file and switch to it with the snapshot, so a crash leaves
+        # the old file and snapshot in force. Needs the whole hot history in
+        # memory, i.e. any warmup installed.
+        history = getattr(engine.history, "hot", engine.history)
+        name = "history.1.jsonl" if os.path.basename(self.history_path) == "history.jsonl" else "history.jsonl"
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            for record in history:
+                f.write(json.dumps(record.to_dict(), separators=(",", ":")).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            history_bytes = f.tell()
+        old_path, self.history_path = self.history_path, path
+        self.history_bytes = 0
+        self._write_snapshot(engine, history_bytes)
+        self.pending_sessions = []
+        self._truncate_journal()
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+    def close(self, engine):
+        if self._journal is not None:
+            self.compact(engine)
+            self._journal.close()
+            self._journal = None
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    vehicle TEXT NOT NULL,
+    type TEXT NOT NULL,
+    owner TEXT,
+    entry_ts INTEGER,
+    exit_ts INTEGER,
+    duration REAL,
+    fee REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_vehicle ON sessions (vehicle);
+CREATE INDEX IF NOT EXISTS idx_sessions_exit_ts ON sessions (exit_ts);
+CREATE INDEX IF NOT EXISTS idx_sessions_type ON sessions (type);
+CREATE TABLE IF NOT EXISTS spots (
+    spot INTEGER PRIMARY KEY,
+    vehicle TEXT NOT NULL,
+    type TEXT NOT NULL,
+    owner TEXT,
+    phone TEXT,
+    entry_ts INTEGER
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    spot INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS reservation_windows (
+    spot INTEGER NOT NULL,
+    holder TEXT,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER,
+    PRIMARY KEY (spot, start_ts)
+);
+"""
+
+SESSION_COLUMNS = ("vehicle", "type", "owner", "entry_ts", "exit_ts", "duration", "fee")
+SESSION_SELECT = f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions"
+SORT_COLUMNS = {"exit": "id", "entry": "entry_ts"}
+
+
+class SqliteHistory(HistoryQueries):
+    # Session history kept in the `sessions` table. Only the running
+    # aggregates are held in memory (seeded by one GROUP BY at startup);
+    # row lookups are answered by SQLite using the indexes.
+    def __init__(self, conn, stats=None):
+        self.conn = conn
+        if stats is not None:
+            self.stats = stats
+            return
+        self.stats = HistoryStats()
+        self._load_stats()
+
+    def _load_stats(self):
+        conn = self.conn
+        self.stats.load_totals(
+            conn.execute("SELECT COALESCE(SUM(duration), 0) FROM sessions").fetchone()[0],
+            conn.execute("SELECT date(exit_ts, 'unixepoch', 'localtime') AS day, COUNT(*), SUM(fee) "
+                         "FROM sessions GROUP BY day"),
+            conn.execute("SELECT type, COUNT(*) FROM sessions GROUP BY type"))
+
+    def __len__(self):
+        return self.stats.count
+
+    def open_reader(self):
+        # A history on its own connection, sharing the aggregates, to hand to
+        # one worker thread; it sees what the owner has committed. Call this
+        # on the owner's thread and close() the reader when done.
+        path = self.conn.execute("PRAGMA database_list").fetchone()[2]
+        if not path:
+            return self  # in-memory database, nothing to reopen
+        return SqliteHistory(sqlite3.connect(path, check_same_thread=False), self.stats)
+
+    def close(self):
+        self.conn.close()
+
+    def __iter__(self):
+        for row in self.conn.execute(f"{SESSION_SELECT} ORDER BY id"):
+            yield SessionRecord(*row)
+
+    def append(self, record):
+        self.conn.execute(
+            "INSERT INTO sessions (vehicle, type, owner, entry_ts, exit_ts, duration, fee) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (record.vehicle, record.type.value, record.owner, record.entry_ts,
+             record.exit_ts, record.duration, record.fee))
+        self.stats.add(record)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def clear(self):
+        self.conn.execute("DELETE FROM sessions")
+        self.stats.clear()
+
+    def drop_before(self, ts):
+        # Delete the sessions that ended before `ts` (archived elsewhere);
+        # committed with the next flush
+        count = self.conn.execute("DELETE FROM sessions WHERE exit_ts < ?", (ts,)).rowcount
+        if count:
+            self._load_stats()
+        return count
+
+    def recent(self, limit):
+        cursor = self.conn.execute(f"{SESSION_SELECT} ORDER BY id DESC LIMIT ?", (limit,))
+        return [SessionRecord(*row) for row in cursor]
+
+    def find_by_plate(self, vehicle_num):
+        cursor = self.conn.execute(f"{SESSION_SELECT} WHERE vehicle = ? ORDER BY id", (vehicle_num,))
+        return [SessionRecord(*row) for row in cursor]
+
+    def cursor(self):
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM sessions").fetchone()[0]
+
+    def plate_counts(self, after=None, upto=None):
+        return self.conn.execute(
+            "SELECT vehicle, COUNT(*), MAX(exit_ts) FROM sessions WHERE id > ? AND id <= ? GROUP BY vehicle",
+            (after or 0, upto if upto is not None else 2 ** 63 - 1)).fetchall()
+
+    def columns(self, start_day=None, end_day=None):
+        # Same layout as MemoryHistory.columns(), read in one query
+        where, params = self._where(start_day=start_day, end_day=end_day)
+        columns = {
+            "vehicle": [], "owner": [], "type": array('B'), "entry_ts": array('q'),
+            "exit_ts": array('q'), "duration": array('d'), "fee": array('d')
+        }
+        for vehicle, vtype, owner, entry_ts, exit_ts, duration, fee in self.conn.execute(
+                f"{SESSION_SELECT}{where} ORDER BY id", params):
+            columns["vehicle"].append(vehicle)
+            columns["owner"].append(owner)
+            columns["type"].append(VEHICLE_TYPE_CODES[vtype])
+            columns["entry_ts"].append(entry_ts)
+            columns["exit_ts"].append(exit_ts)
+            columns["duration"].append(duration)
+            columns["fee"].append(fee)
+        return columns
+
+    def _where(self, plate=None, vtype=None, start_day=None, end_day=None):
+        clauses, params = [], []
+        if plate:
+            # Prefix match as a range so the plate index is used
+            clauses.append("vehicle >= ? AND vehicle < ?")
+            params += [plate, plate + "\uffff"]
+        if vtype:
+            clauses.append("type = ?")
+            params.append(str(vtype))
+        if start_day:
+            clauses.append("exit_ts >= ?")
+            params.append(day_start(start_day))
+        if end_day:
+            clauses.append("exit_ts < ?")
+            params.append(day_end(end_day))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        return self.conn.execute(f"SELECT COUNT(*) FROM sessions{where}", params).fetchone()[0]
+
+    def page(self, offset, limit, sort="exit", descending=True, **filters):
+        if sort not in HISTORY_SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sort}")
+        where, params = self._where(**filters)
+        column = SORT_COLUMNS.get(sort, sort)
+        direction = "DESC" if descending else "ASC"
+        cursor = self.conn.execute(
+            f"{SESSION_SELECT}{where} ORDER BY {column} {direction}, id {direction} LIMIT ? OFFSET ?",
+            params + [limit, offset])
+        return [SessionRecord(*row) for row in cursor]
+
+
+class SqliteStorage:
+    # SQLite backend: sessions, currently parked spots and reservations live
+    # in tables, so startup only reads the parked set and history queries
+    # run against indexes instead of scanning a list in Python.
+    # The connection (shared with SqliteHistory) belongs to the loading thread
+    thread_bound = True
+
+    def __init__(self, path="parking_data.db", legacy_path="parking_data.json"):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.conn = None
+
+    def load(self, engine, background=False):
+        # History stays in the database, so there is nothing to warm up
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SQLITE_SCHEMA)
+        history = SqliteHistory(self.conn)
+
+        if not len(history) and self.legacy_path and os.path.exists(self.legacy_path) \
+                and not self.conn.execute("SELECT 1 FROM spots UNION SELECT 1 FROM reservations "
+                                          "UNION SELECT 1 FROM reservation_windows").fetchone():
+            # First start on SQLite: import the old JSON file
+            with open(self.legacy_path, "r") as f:
+                data = json.load(f)
+            engine.load_dict(data, history=history)
+            history.extend(SessionRecord.from_dict(h) for h in data.get("history", []))
+            self._write_state(engine)
+            self.conn.commit()
+            return
+
+        parked = {
+            spot: ParkedVehicle(vehicle, vtype, owner, phone or "", entry_ts)
+            for spot, vehicle, vtype, owner, phone, entry_ts
+            in self.conn.execute("SELECT spot, vehicle, type, owner, phone, entry_ts FROM spots")
+        }
+        reservations = [Reservation(*row) for row in self.conn.execute(
+            "SELECT spot, holder, start_ts, end_ts FROM reservation_windows")]
+        # The `reservations` table predates time windows: open-ended holds
+        legacy = [spot for spot, in self.conn.execute("SELECT spot FROM reservations")]
+        engine.load_state(parked, reservations + legacy, history)
+        if legacy:
+            self._write_state(engine)
+            self.conn.commit()
+
+    def _write_state(self, engine):
+        self.conn.execute("DELETE FROM spots")
+        self.conn.executemany(
+            "INSERT INTO spots (spot, vehicle, type, owner, phone, entry_ts) VALUES (?, ?, ?, ?, ?, ?)",
+            [(spot, vehicle.vehicle, vehicle.type.value, vehicle.owner, vehicle.phone, vehicle.entry_ts)
+             for spot, vehicle in engine.parked_vehicles.items()])
+        self.conn.execute("DELETE FROM reservations")
+        self.conn.execute("DELETE FROM reservation_windows")
+        self.conn.executemany(
+            "INSERT INTO reservation_windows (spot, holder, start_ts, end_ts) VALUES (?, ?, ?, ?)",
+            [(r.spot, r.holder, r.start_ts, r.end_ts) for r in engine.reservations])
+
+    def record(self, event):
+        # Closed sessions are inserted by SqliteHistory.append
+        op = event["op"]
+        if op == "batch":
+            for inner in event["events"]:
+                self.record(inner)
+        elif op == "park":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO spots (spot, vehicle, type, owner, phone, entry_ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (event["spot"], event["vehicle"], event["type"], event["owner"],
+                 event["phone"], event["entry_ts"]))
+        elif op == "exit":
+            self.conn.execute("DELETE FROM spots WHERE spot = ?", (event["spot"],))
+        elif op == "reserve":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reservation_windows (spot, holder, start_ts, end_ts) "
+                "VALUES (?, ?, ?, ?)",
+                (event["spot"], event["holder"], event["start_ts"], event["end_ts"]))
+        elif op == "cancel":
+            self.conn.execute("DELETE FROM reservation_windows WHERE spot = ? AND start_ts = ?",
+                              (event["spot"], event["start_ts"]))
+        elif op == "clear":
+            self.conn.execute("DELETE FROM spots")
+            self.conn.execute("DELETE FROM reservations")
+            self.conn.execute("DELETE FROM reservation_windows")
+
+    def flush(self):
+        self.conn.commit()
+
+    def save(self, engine):
+        self.conn.commit()
+
+    def prune_history(self, engine):
+        # SqliteHistory.drop_before deleted the rows
+        self.conn.commit()
+
+    def close(self, engine):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+
+class EngineSnapshot:
+    # What save() reads from an engine, captured on the engine's thread so a
+    # writer thread can serialise it while the engine moves on. History
+    # columns are only appended to or replaced whole, so the captured
+    # columns and row count stay valid.
+    def __init__(self, engine):
+        self.state = engine.state_dict()
+        history = getattr(engine.history, "hot", engine.history)
+        self.columns = history.columns() if isinstance(history, MemoryHistory) else None
+        self.rows = len(history)
+        self.engine = engine
+
+    def state_dict(self):
+        return self.state
+
+    def to_dict(self):
+        if self.columns is None:
+            return self.engine.to_dict()
+        c = self.columns
+        return dict(self.state, history=[
+            SessionRecord(c["vehicle"][i], VEHICLE_TYPE_LIST[c["type"][i]], c["owner"][i], c["entry_ts"][i],
+                          c["exit_ts"][i], c["duration"][i], c["fee"][i]).to_dict()
+            for i in range(self.rows)])
+
+
+class StorageWriter:
+    # Group commit for an owner that must not block on the disk (the
+    # window). Engine events are collected as they happen; commit() hands
+    # everything since the last one to a writer thread, which records the
+    # batch, flushes once and saves from an EngineSnapshot. The writer is
+    # the only thread touching the storage until drain(); backends bound to
+    # the thread that opened them are written inline instead.
+    def __init__(self, storage):
+        self.storage = storage
+        self.events = []
+        self.background = not getattr(storage, "thread_bound", False)
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def pending(self):
+        return len(self.events)
+
+    def start(self):
+        if self.background:
+            self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, event):
+        self.events.append(event)
+
+    def commit(self, engine, done=None):
+        # `done(error)` is called, on the writer thread, once the batch is
+        # durable or has failed
+        events, self.events = self.events, []
+        self.commits += 1
+        if self._thread is None:
+            self._write(events, engine, done)
+        else:
+            self._queue.put((events, EngineSnapshot(engine), done))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, events, engine, done):
+        error = None
+        try:
+            for event in events:
+                self.storage.record(event)
+            self.storage.flush()
+            self.storage.save(engine)
+        except Exception as e:
+            error = e
+            print(f"Error saving data: {e}")
+        if done is not None:
+            done(error)
+
+    def drain(self):
+        # Wait until everything committed so far is written
+        if self._thread is not None:
+            self._queue.join()
+
+    def prune_history(self, engine):
+        # Needs the live engine, so it runs here once the writer is idle
+        self.commit(engine)
+        self.drain()
+        self.storage.prune_history(engine)
+
+    def close(self, engine):
+        # Whatever is still pending is written before the storage closes
+        self.commit(engine)
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.storage.close(engine)
+
+
+STORAGE_BACKENDS = {
+    "json": JsonStorage,
+    "journal": JournalStorage,
+    "sqlite": SqliteStorage,
+}
+
+
+def data_dir_options(kind, directory):
+    # File locations for a backend kept entirely under one directory, e.g.
+    # one per shard when several lots run side by side
+    legacy_path = os.path.join(directory, "parking_data.json")
+    return {
+        "json": {"path": legacy_path},
+        "journal": {"directory": os.path.join(directory, "parking_journal"), "legacy_path": legacy_path},
+        "sqlite": {"path": os.path.join(directory, "parking_data.db"), "legacy_path": legacy_path},
+    }[kind]
+
+
+def create_storage(kind="json", data_dir=None, **options):
+    if data_dir is not None:
+        os.makedirs(data_dir, exist_ok=True)
+        options = dict(data_dir_options(kind, data_dir), **options)
+    return STORAGE_BACKENDS[kind](**options)
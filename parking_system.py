@@ -1,34 +1,111 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-from datetime import datetime
+from tkinter import ttk, messagebox, simpledialog, filedialog
+import argparse
+import asyncio
+import bisect
 import json
-import os
+import queue
+import threading
+import time
 from collections import defaultdict
+from parking_archive import ARCHIVE_INTERVAL, ArchiveJob, archive_dir, attach_archive, retention_cutoff
+from parking_engine import DEFAULT_RATES, ParkingEngine, ParkingError, VEHICLE_TYPES
+from parking_forecast import AvailabilityForecast, ForecastBuild
+from parking_lot import ALLOCATION_STRATEGIES, DEFAULT_STRATEGY, LotLayout
+from parking_metrics import DUMP_INTERVAL, Metrics, Profiler
+from parking_occupancy import OccupancyBackfill
+from parking_plates import PlateIndexBuild
+from parking_tariff import Tariff
+from parking_storage import JsonStorage, STORAGE_BACKENDS, StorageWriter, create_storage
+from parking_history_view import HistoryView
+from parking_export_view import ExportDialog
+from parking_records import SessionRecord, day_of, format_time
+from parking_server import ParkingServer, ParkingService
+
+WARMUP_POLL_MS = 50
+RESERVATION_POLL_MS = 1000
+GATE_POLL_MS = 20
+# Changes are drawn at most once per frame and written at most once per
+# window, or as soon as this many events are waiting
+REFRESH_MS = 50
+SAVE_WINDOW_MS = 500
+SAVE_BATCH = 200
+SEARCH_RESULTS_SHOWN = 10
+# Batches larger than this redraw the tables instead of updating row by row
+BATCH_REBUILD_SIZE = 200
+# Window methods timed when metrics are on
+UI_TIMED = ("park_vehicle", "remove_vehicle", "search_vehicle", "flush_data", "load_data",
+            "update_display", "update_analytics", "draw_parking_map", "on_engine_event")
+MAP_CELL_SIZE = 70
+MAP_MIN_CELL_SIZE = 12
+MAP_MIN_ZOOM = 0.2
+MAP_MAX_ZOOM = 3.0
+MAP_COLORS = {"available": "#27ae60", "occupied": "#e74c3c", "reserved": "#3498db"}
 
 class ParkingManagementSystem:
-    def __init__(self, root):
+    def __init__(self, root, storage=None, timing=False, engine=None, metrics=None,
+                 metrics_file=None, profiler=None, retention_days=None, archive_path=None,
+                 flush_ms=SAVE_WINDOW_MS, flush_batch=SAVE_BATCH):
         self.root = root
+        self.started = time.perf_counter()
+        self.timing = timing
+        self.metrics = metrics
+        self.metrics_file = metrics_file
+        self.profiler = profiler
+        # Background jobs running now, by name; see run_job()
+        self.jobs = {}
+        self.retention_days = retention_days
+        self.gate_requests = None
+        self.flush_ms = flush_ms
+        self.flush_batch = flush_batch
+        self.refresh_pending = False
+        self.save_pending = False
         self.root.title("Parking Management System Pro")
         self.root.geometry("1200x750")
         self.root.configure(bg="#2c3e50")
         
-        # Data structures
-        self.parking_spots = {}
-        self.parked_vehicles = {}
-        self.history = []
-        self.total_spots = 50
-        self.rates = {"Car": 20, "Bike": 10, "Truck": 30, "SUV": 25}
-        self.reserved_spots = set()
+        # Parking engine
+        self.engine = engine or ParkingEngine(total_spots=50)
+        self.storage = storage or JsonStorage()
         
-        # Initialize parking spots
-        for i in range(1, self.total_spots + 1):
-            self.parking_spots[i] = None
+        # Wrapped before anything holds on to these methods as callbacks
+        if metrics is not None:
+            metrics.instrument(self, UI_TIMED, "ui_")
+            metrics.instrument_engine(self.engine)
+            metrics.instrument_storage(self.storage)
         
         # Load data
-        self.load_data()
+        warmup = self.load_data()
+        attach_archive(self.engine, archive_path or archive_dir(), retention_days)
+        # Writes happen on the writer thread, in batches
+        self.writer = StorageWriter(self.storage)
+        self.engine.subscribe(self.writer.record)
+        self.writer.start()
+        self.forecast = AvailabilityForecast(self.engine)
+        self.engine.subscribe(self.forecast.on_event)
         
         # Create UI
         self.create_ui()
+        self.engine.subscribe(self.on_engine_event)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.bind("<Map>", self.on_first_frame, add="+")
+        self.root.after(RESERVATION_POLL_MS, self.check_reservations)
+        if metrics_file:
+            self.root.after(int(DUMP_INTERVAL * 1000), self.dump_metrics)
+        if profiler is not None:
+            self.root.bind("<F12>", self.toggle_profiler)
+        
+        # Older history streams in while the window is already usable
+        if warmup is not None:
+            self.revenue_label.config(text="Loading history...")
+            self.run_job("warmup", warmup, lambda job: job.install(self.engine),
+                         "Error loading history", self.on_history_loaded)
+        else:
+            self.start_backfill()
+            self.start_plate_index()
+            self.start_forecast()
+        if retention_days is not None:
+            self.root.after(WARMUP_POLL_MS, self.start_archive)
         
     def create_ui(self):
         # Title
@@ -63,7 +140,7 @@ class ParkingManagementSystem:
         
         tk.Label(left_panel, text="Vehicle Type:", bg="#34495e", 
                 fg="#ecf0f1", font=("Arial", 11)).pack(pady=5)
-        self.vehicle_type = ttk.Combobox(left_panel, values=["Car", "Bike", "Truck", "SUV"], 
+        self.vehicle_type = ttk.Combobox(left_panel, values=VEHICLE_TYPES, 
                                          font=("Arial", 12), width=18, state="readonly")
         self.vehicle_type.set("Car")
         self.vehicle_type.pack(pady=5)
@@ -127,6 +204,16 @@ class ParkingManagementSystem:
                               font=("Arial", 10), width=18, cursor="hand2")
         export_btn.pack(pady=5)
         
+        import_btn = tk.Button(left_panel, text="📥 Import Data", 
+                              command=self.import_data, bg="#2980b9", fg="white",
+                              font=("Arial", 10), width=18, cursor="hand2")
+        import_btn.pack(pady=5)
+        
+        checkout_btn = tk.Button(left_panel, text="🚪 Checkout All", 
+                                command=self.checkout_all, bg="#d35400", fg="white",
+                                font=("Arial", 10), width=18, cursor="hand2")
+        checkout_btn.pack(pady=5)
+        
         # Right panel
         right_panel = tk.Frame(main_frame, bg="#34495e", relief=tk.RAISED, bd=2)
         right_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -140,7 +227,7 @@ class ParkingManagementSystem:
                                        fg="white", padx=20, pady=8)
         self.occupied_label.grid(row=0, column=0, padx=5, pady=5)
         
-        self.available_label = tk.Label(stats_frame, text=f"Available: {self.total_spots}", 
+        self.available_label = tk.Label(stats_frame, text=f"Available: {self.engine.total_spots}", 
                                         font=("Arial", 12, "bold"), bg="#27ae60", 
                                         fg="white", padx=20, pady=8)
         self.available_label.grid(row=0, column=1, padx=5, pady=5)
@@ -192,33 +279,7 @@ class ParkingManagementSystem:
         history_tab = tk.Frame(tab_control, bg="#34495e")
         tab_control.add(history_tab, text="📜 History")
         
-        history_frame = tk.Frame(history_tab, bg="#34495e")
-        history_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        hist_scrollbar = ttk.Scrollbar(history_frame)
-        hist_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        self.history_tree = ttk.Treeview(history_frame, 
-                                         columns=("Vehicle", "Type", "Owner", "Entry", "Exit", "Duration", "Fee"), 
-                                         show="headings", yscrollcommand=hist_scrollbar.set, height=12)
-        self.history_tree.pack(fill=tk.BOTH, expand=True)
-        hist_scrollbar.config(command=self.history_tree.yview)
-        
-        self.history_tree.heading("Vehicle", text="Vehicle No.")
-        self.history_tree.heading("Type", text="Type")
-        self.history_tree.heading("Owner", text="Owner")
-        self.history_tree.heading("Entry", text="Entry Time")
-        self.history_tree.heading("Exit", text="Exit Time")
-        self.history_tree.heading("Duration", text="Duration (hrs)")
-        self.history_tree.heading("Fee", text="Fee (₹)")
-        
-        self.history_tree.column("Vehicle", width=90)
-        self.history_tree.column("Type", width=60)
-        self.history_tree.column("Owner", width=90)
-        self.history_tree.column("Entry", width=120)
-        self.history_tree.column("Exit", width=120)
-        self.history_tree.column("Duration", width=90, anchor="center")
-        self.history_tree.column("Fee", width=70, anchor="center")
+        self.history_view = HistoryView(history_tab, lambda: self.engine.history)
         
         # Analytics Tab
         analytics_tab = tk.Frame(tab_control, bg="#34495e")
@@ -236,72 +297,70 @@ class ParkingManagementSystem:
         map_tab = tk.Frame(tab_control, bg="#34495e")
         tab_control.add(map_tab, text="🗺️ Parking Map")
         
+        # Legend stays fixed below the scrollable map
+        self.map_legend = tk.Canvas(map_tab, bg="#2c3e50", height=30, highlightthickness=0)
+        self.map_legend.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=(0, 10))
+        
         map_canvas_frame = tk.Frame(map_tab, bg="#34495e")
         map_canvas_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        self.map_canvas = tk.Canvas(map_canvas_frame, bg="#2c3e50", highlightthickness=0)
+        map_yscroll = ttk.Scrollbar(map_canvas_frame)
+        map_yscroll.pack(side=tk.RIGHT, fill=tk.Y)
+        map_xscroll = ttk.Scrollbar(map_canvas_frame, orient=tk.HORIZONTAL)
+        map_xscroll.pack(side=tk.BOTTOM, fill=tk.X)
+        
+        self.map_canvas = tk.Canvas(map_canvas_frame, bg="#2c3e50", highlightthickness=0,
+                                    xscrollcommand=map_xscroll.set, yscrollcommand=map_yscroll.set)
         self.map_canvas.pack(fill=tk.BOTH, expand=True)
+        map_yscroll.config(command=self.map_canvas.yview)
+        map_xscroll.config(command=self.map_canvas.xview)
+        
+        # Canvas item ids per spot, spots needing a redraw and layout state
+        self.map_items = {}
+        self.map_dirty = set()
+        self.map_zoom = 1.0
+        self.map_cols = 0
+        
+        self.map_canvas.bind("<Configure>", self.on_map_configure)
+        self.map_canvas.bind("<MouseWheel>", self.on_map_scroll)
+        self.map_canvas.bind("<Button-4>", self.on_map_scroll)
+        self.map_canvas.bind("<Button-5>", self.on_map_scroll)
+        self.map_canvas.bind("<Control-MouseWheel>", self.on_map_zoom)
+        self.map_canvas.bind("<Control-Button-4>", self.on_map_zoom)
+        self.map_canvas.bind("<Control-Button-5>", self.on_map_zoom)
         
         tab_control.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        # Bind tab change event
-        tab_control.bind("<<NotebookTabChanged>>", self.on_tab_change)
+        self.draw_map_legend()
         
         # Update display
+        self.rebuild_tables()
         self.update_display()
         self.draw_parking_map()
         
     def park_vehicle(self):
-        vehicle_num = self.vehicle_entry.get().strip().upper()
+        vehicle_num = self.vehicle_entry.get()
         vehicle_type = self.vehicle_type.get()
-        owner = self.owner_entry.get().strip()
-        phone = self.phone_entry.get().strip()
+        owner = self.owner_entry.get()
+        phone = self.phone_entry.get()
         
-        if not vehicle_num or not owner:
-            messagebox.showerror("Error", "Please fill vehicle number and owner name!")
-            return
-        
-        # Check if vehicle already parked
-        for spot, data in self.parked_vehicles.items():
-            if data["vehicle"] == vehicle_num:
-                messagebox.showerror("Error", f"Vehicle {vehicle_num} is already parked at spot {spot}!")
-                return
-        
-        # Find available spot
-        available_spot = None
-        for spot in range(1, self.total_spots + 1):
-            if self.parking_spots[spot] is None and spot not in self.reserved_spots:
-                available_spot = spot
-                break
-        
-        if available_spot is None:
-            messagebox.showerror("Error", "No parking spots available!")
+        try:
+            spot = self.engine.park(vehicle_num, vehicle_type, owner, phone)
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        # Park the vehicle
-        entry_time = datetime.now()
-        self.parking_spots[available_spot] = vehicle_num
-        self.parked_vehicles[available_spot] = {
-            "vehicle": vehicle_num,
-            "type": vehicle_type,
-            "owner": owner,
-            "phone": phone,
-            "entry_time": entry_time
-        }
-        
+        data = self.engine.parked_vehicles[spot]
         messagebox.showinfo("Success", 
-                          f"✅ Vehicle {vehicle_num} parked at spot {available_spot}\n" +
-                          f"Owner: {owner}\n" +
-                          f"Entry Time: {entry_time.strftime('%I:%M %p')}")
+                          f"✅ Vehicle {data.vehicle} parked at spot {spot}\n" +
+                          f"Owner: {data.owner}\n" +
+                          f"Entry Time: {format_time(data.entry_ts, '%I:%M %p')}")
         
         # Clear entries
         self.vehicle_entry.delete(0, tk.END)
         self.owner_entry.delete(0, tk.END)
         self.phone_entry.delete(0, tk.END)
         
-        self.update_display()
-        self.save_data()
-        
     def remove_vehicle(self):
         try:
             spot_num = int(self.spot_entry.get().strip())
@@ -309,163 +368,209 @@ class ParkingManagementSystem:
             messagebox.showerror("Error", "Please enter a valid spot number!")
             return
         
-        if spot_num not in self.parked_vehicles:
-            messagebox.showerror("Error", f"No vehicle parked at spot {spot_num}!")
+        try:
+            record = self.engine.remove(spot_num)
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        # Get vehicle data
-        data = self.parked_vehicles[spot_num]
-        exit_time = datetime.now()
-        duration = (exit_time - data["entry_time"]).total_seconds() / 3600
-        
-        # Calculate fee
-        rate = self.rates[data["type"]]
-        fee = max(rate, round(duration * rate, 2))
-        
-        # Add to history
-        self.history.append({
-            "vehicle": data["vehicle"],
-            "type": data["type"],
-            "owner": data["owner"],
-            "entry_time": data["entry_time"].strftime('%Y-%m-%d %I:%M %p'),
-            "exit_time": exit_time.strftime('%Y-%m-%d %I:%M %p'),
-            "duration": round(duration, 2),
-            "fee": fee
-        })
-        
-        # Remove from current parking
-        del self.parked_vehicles[spot_num]
-        self.parking_spots[spot_num] = None
-        
         messagebox.showinfo("Payment Receipt", 
-                          f"🚗 Vehicle: {data['vehicle']}\n" +
-                          f"👤 Owner: {data['owner']}\n" +
-                          f"⏱️ Duration: {round(duration, 2)} hours\n" +
-                          f"💰 Total Fee: ₹{fee}\n\n" +
+                          f"🚗 Vehicle: {record.vehicle}\n" +
+                          f"👤 Owner: {record.owner}\n" +
+                          f"⏱️ Duration: {record.duration} hours\n" +
+                          f"💰 Total Fee: ₹{record.fee}\n\n" +
                           f"Thank you for parking with us!")
         
         self.spot_entry.delete(0, tk.END)
-        self.update_display()
-        self.save_data()
         
     def reserve_spot(self):
         spot = simpledialog.askinteger("Reserve Spot", 
-                                       f"Enter spot number to reserve (1-{self.total_spots}):",
-                                       minvalue=1, maxvalue=self.total_spots)
+                                       f"Enter spot number to reserve (1-{self.engine.total_spots}):",
+                                       minvalue=1, maxvalue=self.engine.total_spots)
         if spot:
-            if self.parking_spots[spot] is not None:
-                messagebox.showerror("Error", f"Spot {spot} is already occupied!")
-            elif spot in self.reserved_spots:
+            holder = simpledialog.askstring("Reserve Spot", "Reserved for (optional):") or ""
+            hours = simpledialog.askfloat("Reserve Spot", "Hold for how many hours?\n(Cancel = until released)",
+                                          minvalue=0.1)
+            now = self.engine.now()
+            end = now + int(hours * 3600) if hours else None
+            try:
+                reserved = self.engine.reserve(spot, holder, end=end, now=now)
+            except ParkingError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            if not reserved:
                 messagebox.showinfo("Info", f"Spot {spot} is already reserved!")
             else:
-                self.reserved_spots.add(spot)
-                messagebox.showinfo("Success", f"Spot {spot} has been reserved!")
-                self.update_display()
-                self.save_data()
+                until = f" until {format_time(end, '%I:%M %p')}" if end else ""
+                messagebox.showinfo("Success", f"Spot {spot} has been reserved{until}!")
     
     def search_vehicle(self):
-        vehicle = simpledialog.askstring("Search Vehicle", "Enter vehicle number:")
-        if vehicle:
-            vehicle = vehicle.strip().upper()
-            found = False
-            for spot, data in self.parked_vehicles.items():
-                if data["vehicle"] == vehicle:
-                    messagebox.showinfo("Vehicle Found", 
-                                      f"🚗 Vehicle: {vehicle}\n" +
-                                      f"📍 Spot: {spot}\n" +
-                                      f"👤 Owner: {data['owner']}\n" +
-                                      f"📱 Phone: {data.get('phone', 'N/A')}\n" +
-                                      f"🚙 Type: {data['type']}\n" +
-                                      f"⏰ Entry: {data['entry_time'].strftime('%I:%M %p')}")
-                    found = True
-                    break
-            
-            if not found:
-                messagebox.showinfo("Not Found", f"Vehicle {vehicle} is not currently parked.")
+        query = simpledialog.askstring("Search Vehicle", "Enter full or partial vehicle number:")
+        if not query or not query.strip():
+            return
+        matches = self.engine.search_plates(query)
+        if not matches:
+            messagebox.showinfo("Not Found", f"No vehicle matching {query.strip().upper()} has been seen.")
+            return
+        
+        best = matches[0]
+        if best.kind == "exact" and best.spot is not None:
+            data = self.engine.parked_vehicles[best.spot]
+            messagebox.showinfo("Vehicle Found", 
+                              f"🚗 Vehicle: {best.plate}\n" +
+                              f"📍 Spot: {best.spot} ({self.engine.spot_info(best.spot).label})\n" +
+                              f"👤 Owner: {data.owner}\n" +
+                              f"📱 Phone: {data.phone or 'N/A'}\n" +
+                              f"🚙 Type: {data.type}\n" +
+                              f"⏰ Entry: {format_time(data.entry_ts, '%I:%M %p')}")
+            return
+        
+        lines = []
+        for match in matches[:SEARCH_RESULTS_SHOWN]:
+            if match.spot is not None:
+                where = f"parked at spot {match.spot} ({self.engine.spot_info(match.spot).label})"
+            else:
+                where = f"last seen {format_time(match.last_seen)}"
+            lines.append(f"{match.plate} - {where} [{match.kind}]")
+        if len(matches) > SEARCH_RESULTS_SHOWN:
+            lines.append(f"... and {len(matches) - SEARCH_RESULTS_SHOWN} more")
+        messagebox.showinfo("Search Results", "\n".join(lines))
     
     def clear_all_data(self):
         if messagebox.askyesno("Confirm", "Are you sure you want to clear all data? This cannot be undone!"):
-            self.parked_vehicles.clear()
-            self.history.clear()
-            self.reserved_spots.clear()
-            for i in range(1, self.total_spots + 1):
-                self.parking_spots[i] = None
-            self.update_display()
-            self.save_data()
+            self.engine.clear()
             messagebox.showinfo("Success", "All data has been cleared!")
     
     def export_report(self):
-        report = f"PARKING MANAGEMENT SYSTEM - REPORT\n"
-        report += f"Generated: {datetime.now().strftime('%Y-%m-%d %I:%M %p')}\n"
-        report += "="*60 + "\n\n"
-        
-        report += f"CURRENT STATUS:\n"
-        report += f"Total Spots: {self.total_spots}\n"
-        report += f"Occupied: {len(self.parked_vehicles)}\n"
-        report += f"Available: {self.total_spots - len(self.parked_vehicles)}\n"
-        report += f"Reserved: {len(self.reserved_spots)}\n\n"
-        
-        today_revenue = sum(h['fee'] for h in self.history 
-                           if h['exit_time'].startswith(datetime.now().strftime('%Y-%m-%d')))
-        report += f"Today's Revenue: ₹{today_revenue}\n"
-        report += f"Total Transactions: {len(self.history)}\n\n"
-        
-        report += "CURRENTLY PARKED VEHICLES:\n"
-        report += "-"*60 + "\n"
-        for spot, data in sorted(self.parked_vehicles.items()):
-            report += f"Spot {spot}: {data['vehicle']} ({data['type']}) - {data['owner']}\n"
+        ExportDialog(self.root, self.engine)
+    
+    def import_data(self):
+        path = filedialog.askopenfilename(title="Import parking data",
+                                          filetypes=[("Parking data", "*.json"), ("All files", "*")])
+        if not path:
+            return
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not read {path}: {e}")
+            return
         
-        with open(f"parking_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt", "w") as f:
-            f.write(report)
+        summary = self.engine.import_dict(data)
+        message = (f"Parked vehicles imported: {summary['parked']} ({summary['moved']} moved to another spot)\n"
+                   f"Reservations imported: {summary['reservations']}\n"
+                   f"Sessions imported: {summary['sessions']}")
+        if summary["sessions_skipped"]:
+            message += f"\nSessions older than the current history: {summary['sessions_skipped']} (skipped)"
+        if summary["skipped"]:
+            message += f"\nVehicles skipped: {', '.join(summary['skipped'][:10])}"
+            if len(summary["skipped"]) > 10:
+                message += f" and {len(summary['skipped']) - 10} more"
+        messagebox.showinfo("Import Complete", message)
+    
+    def checkout_all(self):
+        count = self.engine.occupied_count
+        if not count:
+            messagebox.showinfo("Info", "No vehicles are parked.")
+            return
+        if not messagebox.askyesno("Confirm", f"Check out all {count} parked vehicles now?"):
+            return
         
-        messagebox.showinfo("Success", "Report exported successfully!")
+        results = self.engine.remove_many()
+        records = [result for result in results if isinstance(result, SessionRecord)]
+        messagebox.showinfo("Checkout Complete",
+                          f"Vehicles checked out: {len(records)}\n" +
+                          f"💰 Total Fees: ₹{sum(record.fee for record in records):.2f}")
     
     def update_display(self):
         # Update stats
-        occupied = len(self.parked_vehicles)
-        available = self.total_spots - occupied - len(self.reserved_spots)
+        occupied = self.engine.occupied_count
+        available = self.engine.available_count
         self.occupied_label.config(text=f"Occupied: {occupied}")
         self.available_label.config(text=f"Available: {available}")
-        self.reserved_label.config(text=f"Reserved: {len(self.reserved_spots)}")
+        self.reserved_label.config(text=f"Reserved: {len(self.engine.reserved_spots)}")
         
         # Calculate today's revenue
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_revenue = sum(h['fee'] for h in self.history if h['exit_time'].startswith(today))
+        today = day_of(self.engine.now())
+        today_revenue = self.engine.history.revenue_for_day(today)
         self.revenue_label.config(text=f"Today's Revenue: ₹{today_revenue:.2f}")
         
-        # Update current vehicles
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        for spot, data in sorted(self.parked_vehicles.items()):
-            self.tree.insert("", tk.END, values=(
-                spot,
-                data["vehicle"],
-                data["type"],
-                data["owner"],
-                data.get("phone", "N/A"),
-                data["entry_time"].strftime('%I:%M %p')
-            ))
-        
-        # Update history
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
-        
-        for record in reversed(self.history[-50:]):  # Show last 50
-            self.history_tree.insert("", tk.END, values=(
-                record["vehicle"],
-                record["type"],
-                record["owner"],
-                record["entry_time"],
-                record["exit_time"],
-                record["duration"],
-                record["fee"]
-            ))
-        
         # Update analytics
         self.update_analytics()
         self.draw_parking_map()
     
+    def request_refresh(self):
+        # Bursts of changes are drawn once, on the next frame
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.root.after(REFRESH_MS, self.refresh)
+    
+    def refresh(self):
+        self.refresh_pending = False
+        self.update_display()
+    
+    def rebuild_tables(self):
+        # Full rebuild, only needed on load and after clearing all data
+        self.tree.delete(*self.tree.get_children())
+        self.tree_spots = []
+        for spot in sorted(self.engine.parked_vehicles):
+            self.insert_vehicle_row(spot)
+        
+        self.history_view.reload()
+    
+    def on_engine_event(self, event):
+        # Apply each change to the tables as a single row insert/delete; the
+        # stats, map and file catch up in one go later
+        self.request_refresh()
+        self.save_data()
+        op = event["op"]
+        if op == "batch":
+            if len(event["events"]) > BATCH_REBUILD_SIZE:
+                # Cheaper to redraw everything once than row by row
+                self.rebuild_tables()
+                self.map_dirty.update(self.map_items)
+            else:
+                for inner in event["events"]:
+                    self.on_engine_event(inner)
+            return
+        if op == "park":
+            self.insert_vehicle_row(event["spot"])
+        elif op == "exit":
+            self.delete_vehicle_row(event["spot"])
+            self.history_view.on_new_record(SessionRecord.from_dict(event["record"]))
+        elif op == "session":
+            self.history_view.on_new_record(SessionRecord.from_dict(event["record"]))
+        elif op == "clear":
+            # Sessions still loading in the background were cleared too
+            for job in self.jobs.values():
+                job.cancel()
+            self.rebuild_tables()
+        
+        if "spot" in event:
+            self.map_dirty.add(event["spot"])
+        else:
+            self.map_dirty.update(self.map_items)
+    
+    def insert_vehicle_row(self, spot):
+        data = self.engine.parked_vehicles[spot]
+        # Rows are keyed by spot and kept in spot order
+        index = bisect.bisect(self.tree_spots, spot)
+        self.tree_spots.insert(index, spot)
+        self.tree.insert("", index, iid=str(spot), values=(
+            spot,
+            data.vehicle,
+            data.type,
+            data.owner,
+            data.phone or "N/A",
+            format_time(data.entry_ts, '%I:%M %p')
+        ))
+    
+    def delete_vehicle_row(self, spot):
+        index = bisect.bisect_left(self.tree_spots, spot)
+        if index < len(self.tree_spots) and self.tree_spots[index] == spot:
+            del self.tree_spots[index]
+            self.tree.delete(str(spot))
+    
     def update_analytics(self):
         self.analytics_text.delete(1.0, tk.END)
         
@@ -474,8 +579,8 @@ class ParkingManagementSystem:
         
         # Vehicle type distribution
         type_count = defaultdict(int)
-        for data in self.parked_vehicles.values():
-            type_count[data['type']] += 1
+        for data in self.engine.parked_vehicles.values():
+            type_count[data.type] += 1
         
         analytics += "🚗 Current Vehicle Types:\n"
         for vtype, count in type_count.items():
@@ -483,171 +588,379 @@ class ParkingManagementSystem:
         analytics += "\n"
         
         # Historical stats
-        if self.history:
-            total_revenue = sum(h['fee'] for h in self.history)
-            avg_duration = sum(h['duration'] for h in self.history) / len(self.history)
+        if self.engine.history:
+            total_revenue = self.engine.history.total_revenue()
+            _, _, avg_duration = self.engine.history.duration_stats()
             
             analytics += f"💰 Total Revenue: ₹{total_revenue:.2f}\n"
-            analytics += f"📊 Total Transactions: {len(self.history)}\n"
+            analytics += f"📊 Total Transactions: {len(self.engine.history)}\n"
             analytics += f"⏱️ Average Parking Duration: {avg_duration:.2f} hours\n\n"
             
             # Most common vehicle types
-            hist_types = defaultdict(int)
-            for h in self.history:
-                hist_types[h['type']] += 1
+            hist_types = self.engine.history.type_counts()
             
             analytics += "📈 Most Parked Vehicle Types:\n"
             for vtype, count in sorted(hist_types.items(), key=lambda x: x[1], reverse=True):
                 analytics += f"  • {vtype}: {count} times\n"
             analytics += "\n"
             
-            # Peak usage
-            analytics += "⭐ Peak Usage Statistics:\n"
-            analytics += f"  • Maximum Occupancy: {max(len(self.parked_vehicles), occupied if 'occupied' in locals() else 0)}/{self.total_spots}\n"
-            analytics += f"  • Occupancy Rate: {(len(self.parked_vehicles)/self.total_spots)*100:.1f}%\n"
+        # Peak usage
+        occupancy = self.engine.occupancy
+        now = self.engine.now()
+        peak, peak_ts = occupancy.peak_occupancy()
+        analytics += "⭐ Peak Usage Statistics:\n"
+        analytics += f"  • Maximum Occupancy: {peak}/{self.engine.total_spots}"
+        analytics += f" ({format_time(peak_ts)})\n" if peak_ts else "\n"
+        analytics += f"  • Occupancy Rate: {(len(self.engine.parked_vehicles)/self.engine.total_spots)*100:.1f}%\n"
+        analytics += f"  • Average Utilisation: {occupancy.utilisation(self.engine.total_spots, now)*100:.1f}%\n"
+        
+        busiest = sorted((mean, hour) for hour, mean in enumerate(occupancy.hour_of_day()) if mean is not None)
+        if busiest:
+            analytics += "  • Busiest Hours: " + ", ".join(
+                f"{hour:02d}:00 ({mean/self.engine.total_spots*100:.0f}%)" for mean, hour in reversed(busiest[-3:])) + "\n"
+        
+        # Served from the forecast's cache, recomputed at most once a second
+        expected = self.forecast.forecast(now)["expected_free"]
+        analytics += "\n🔮 Expected Free Spots:\n"
+        analytics += "  • " + ", ".join(f"in {minutes} min: {free:.0f}" for minutes, free in expected.items()) + "\n"
         
         self.analytics_text.insert(1.0, analytics)
     
     def draw_parking_map(self):
-        self.map_canvas.delete("all")
-        
-        # Calculate grid
-        cols = 10
-        rows = (self.total_spots + cols - 1) // cols
-        
+        # Only spots whose state changed since the last draw are touched;
+        # positions are recomputed on resize and zoom only
+        if len(self.map_items) != self.engine.total_spots:
+            self.layout_parking_map()
+            return
+        for spot in self.map_dirty:
+            self.update_map_spot(spot)
+        self.map_dirty.clear()
+    
+    def map_geometry(self):
         canvas_width = self.map_canvas.winfo_width()
-        canvas_height = self.map_canvas.winfo_height()
-        
-        if canvas_width <= 1 or canvas_height <= 1:
+        if canvas_width <= 1:
             canvas_width = 900
-            canvas_height = 400
         
-        cell_width = (canvas_width - 40) // cols
-        cell_height = (canvas_height - 40) // rows
-        cell_size = min(cell_width, cell_height, 70)
+        cell_size = max(MAP_MIN_CELL_SIZE, int(MAP_CELL_SIZE * self.map_zoom))
+        cols = max(1, (canvas_width - 40) // cell_size)
+        return canvas_width, cell_size, cols
+    
+    def layout_parking_map(self):
+        canvas_width, cell_size, cols = self.map_geometry()
+        rows = (self.engine.total_spots + cols - 1) // cols
+        self.map_cols = cols
         
-        start_x = (canvas_width - (cols * cell_size)) // 2
+        start_x = max(20, (canvas_width - (cols * cell_size)) // 2)
         start_y = 20
-        
-        spot_num = 1
-        for row in range(rows):
-            for col in range(cols):
-                if spot_num > self.total_spots:
-                    break
-                
-                x = start_x + col * cell_size
-                y = start_y + row * cell_size
-                
-                # Determine color
-                if self.parking_spots[spot_num] is not None:
-                    color = "#e74c3c"  # Occupied - Red
-                    text_color = "white"
-                elif spot_num in self.reserved_spots:
-                    color = "#3498db"  # Reserved - Blue
-                    text_color = "white"
-                else:
-                    color = "#27ae60"  # Available - Green
-                    text_color = "white"
-                
-                # Draw spot
-                rect = self.map_canvas.create_rectangle(
-                    x + 5, y + 5, x + cell_size - 5, y + cell_size - 5,
-                    fill=color, outline="#34495e", width=2
-                )
-                
-                # Add spot number
-                self.map_canvas.create_text(
-                    x + cell_size // 2, y + cell_size // 2,
-                    text=str(spot_num), font=("Arial", 10, "bold"),
-                    fill=text_color
-                )
-                
-                # Add vehicle number if occupied
-                if self.parking_spots[spot_num] is not None:
-                    vehicle = self.parked_vehicles[spot_num]["vehicle"]
-                    self.map_canvas.create_text(
-                        x + cell_size // 2, y + cell_size // 2 + 15,
-                        text=vehicle[:6], font=("Arial", 7),
-                        fill=text_color
-                    )
-                
-                spot_num += 1
-        
-        # Add legend
+        show_labels = cell_size >= 30
+        pad = max(1, cell_size // 14)
+        
+        # Drop items of spots that no longer exist
+        for spot in [s for s in self.map_items if s > self.engine.total_spots]:
+            for item in self.map_items.pop(spot):
+                self.map_canvas.delete(item)
+        
+        for spot_num in range(1, self.engine.total_spots + 1):
+            row, col = divmod(spot_num - 1, cols)
+            x = start_x + col * cell_size
+            y = start_y + row * cell_size
+            rect_coords = (x + pad, y + pad, x + cell_size - pad, y + cell_size - pad)
+            label_coords = (x + cell_size // 2, y + cell_size // 2)
+            plate_coords = (x + cell_size // 2, y + cell_size // 2 + pad * 3)
+            
+            if spot_num not in self.map_items:
+                rect = self.map_canvas.create_rectangle(*rect_coords, outline="#34495e", width=2)
+                label = self.map_canvas.create_text(*label_coords, text=str(spot_num),
+                                                    font=("Arial", 10, "bold"), fill="white")
+                plate = self.map_canvas.create_text(*plate_coords, font=("Arial", 7), fill="white")
+                self.map_items[spot_num] = (rect, label, plate)
+            else:
+                rect, label, plate = self.map_items[spot_num]
+                self.map_canvas.coords(rect, *rect_coords)
+                self.map_canvas.coords(label, *label_coords)
+                self.map_canvas.coords(plate, *plate_coords)
+            
+            state = tk.NORMAL if show_labels else tk.HIDDEN
+            self.map_canvas.itemconfig(self.map_items[spot_num][1], state=state)
+            self.map_canvas.itemconfig(self.map_items[spot_num][2], state=state)
+            self.update_map_spot(spot_num)
+        
+        self.map_dirty.clear()
+        self.map_canvas.config(scrollregion=(0, 0, start_x * 2 + cols * cell_size,
+                                             start_y * 2 + rows * cell_size))
+    
+    def update_map_spot(self, spot):
+        items = self.map_items.get(spot)
+        if items is None:
+            return
+        rect, label, plate = items
+        vehicle = self.engine.parking_spots.get(spot)
+        
+        # Determine color
+        text = vehicle[:6] if vehicle else ""
+        if vehicle is not None:
+            color = MAP_COLORS["occupied"]
+        elif spot in self.engine.reserved_spots:
+            color = MAP_COLORS["reserved"]
+            reservation = self.engine.reservations.covering(spot, self.engine.now())
+            text = reservation.holder[:6] if reservation else ""
+        else:
+            color = MAP_COLORS["available"]
+        
+        self.map_canvas.itemconfig(rect, fill=color)
+        self.map_canvas.itemconfig(plate, text=text)
+    
+    def draw_map_legend(self):
         legend_x = 20
-        legend_y = canvas_height - 60
-        
-        # Available
-        self.map_canvas.create_rectangle(legend_x, legend_y, legend_x + 20, legend_y + 20,
-                                        fill="#27ae60", outline="#34495e", width=2)
-        self.map_canvas.create_text(legend_x + 30, legend_y + 10, text="Available",
-                                   anchor="w", fill="#ecf0f1", font=("Arial", 10))
-        
-        # Occupied
-        self.map_canvas.create_rectangle(legend_x + 120, legend_y, legend_x + 140, legend_y + 20,
-                                        fill="#e74c3c", outline="#34495e", width=2)
-        self.map_canvas.create_text(legend_x + 150, legend_y + 10, text="Occupied",
-                                   anchor="w", fill="#ecf0f1", font=("Arial", 10))
-        
-        # Reserved
-        self.map_canvas.create_rectangle(legend_x + 240, legend_y, legend_x + 260, legend_y + 20,
-                                        fill="#3498db", outline="#34495e", width=2)
-        self.map_canvas.create_text(legend_x + 270, legend_y + 10, text="Reserved",
-                                   anchor="w", fill="#ecf0f1", font=("Arial", 10))
-    
-    def on_tab_change(self, event):
-        # Redraw parking map when tab is switched
-        self.root.after(100, self.draw_parking_map)
+        legend_y = 5
+        for offset, (name, color) in zip((0, 120, 240), (("Available", MAP_COLORS["available"]),
+                                                          ("Occupied", MAP_COLORS["occupied"]),
+                                                          ("Reserved", MAP_COLORS["reserved"]))):
+            self.map_legend.create_rectangle(legend_x + offset, legend_y,
+                                             legend_x + offset + 20, legend_y + 20,
+                                             fill=color, outline="#34495e", width=2)
+            self.map_legend.create_text(legend_x + offset + 30, legend_y + 10, text=name,
+                                        anchor="w", fill="#ecf0f1", font=("Arial", 10))
+    
+    def on_map_configure(self, event):
+        # Relayout only when the resize changes the number of columns
+        _, _, cols = self.map_geometry()
+        if cols != self.map_cols or len(self.map_items) != self.engine.total_spots:
+            self.layout_parking_map()
+    
+    def on_map_scroll(self, event):
+        if getattr(event, "num", None) == 4 or getattr(event, "delta", 0) > 0:
+            self.map_canvas.yview_scroll(-1, "units")
+        else:
+            self.map_canvas.yview_scroll(1, "units")
+    
+    def on_map_zoom(self, event):
+        if getattr(event, "num", None) == 4 or getattr(event, "delta", 0) > 0:
+            self.map_zoom = min(MAP_MAX_ZOOM, self.map_zoom * 1.25)
+        else:
+            self.map_zoom = max(MAP_MIN_ZOOM, self.map_zoom / 1.25)
+        self.layout_parking_map()
     
     def save_data(self):
-        data = {
-            "parked_vehicles": {
-                spot: {
-                    "vehicle": info["vehicle"],
-                    "type": info["type"],
-                    "owner": info["owner"],
-                    "phone": info.get("phone", ""),
-                    "entry_time": info["entry_time"].strftime('%Y-%m-%d %H:%M:%S')
-                }
-                for spot, info in self.parked_vehicles.items()
-            },
-            "history": self.history,
-            "reserved_spots": list(self.reserved_spots)
-        }
-        
-        with open("parking_data.json", "w") as f:
-            json.dump(data, f, indent=4)
+        # Mark the state unsaved: written flush_ms after the first change,
+        # once flush_batch events have piled up, or when the window closes,
+        # whichever comes first
+        if self.writer.pending >= self.flush_batch:
+            self.flush_data()
+        elif not self.save_pending:
+            self.save_pending = True
+            self.root.after(self.flush_ms, self.flush_data)
+    
+    def flush_data(self):
+        self.save_pending = False
+        if self.writer.pending:
+            self.writer.commit(self.engine)
     
     def load_data(self):
-        if os.path.exists("parking_data.json"):
-            try:
-                with open("parking_data.json", "r") as f:
-                    data = json.load(f)
-                
-                # Load parked vehicles
-                for spot_str, info in data.get("parked_vehicles", {}).items():
-                    spot = int(spot_str)
-                    self.parked_vehicles[spot] = {
-                        "vehicle": info["vehicle"],
-                        "type": info["type"],
-                        "owner": info["owner"],
-                        "phone": info.get("phone", ""),
-                        "entry_time": datetime.strptime(info["entry_time"], '%Y-%m-%d %H:%M:%S')
-                    }
-                    self.parking_spots[spot] = info["vehicle"]
-                
-                # Load history
-                self.history = data.get("history", [])
-                
-                # Load reserved spots
-                self.reserved_spots = set(data.get("reserved_spots", []))
-            except Exception as e:
-                print(f"Error loading data: {e}")
+        # The older history still to stream in, if any
+        try:
+            return self.storage.load(self.engine, background=True)
+        except Exception as e:
+            print(f"Error loading data: {e}")
+    
+    def check_reservations(self):
+        # Expire and activate reservation windows as their times come
+        self.engine.update_reservations()
+        self.root.after(RESERVATION_POLL_MS, self.check_reservations)
+    
+    def run_job(self, name, job, install, failure, then=None):
+        # Run a BackgroundJob on a worker thread, listed in self.jobs under
+        # `name` until it is done, and poll it from the Tk loop. Once it is
+        # done it is installed here with install(job), a failure printed
+        # after `failure`, and then(job) called.
+        self.jobs[name] = job
+        job.start()
+        self.root.after(WARMUP_POLL_MS, self.poll_job, name, job, install, failure, then)
+    
+    def poll_job(self, name, job, install, failure, then):
+        if not job.done.is_set():
+            self.root.after(WARMUP_POLL_MS, self.poll_job, name, job, install, failure, then)
+            return
+        
+        del self.jobs[name]
+        try:
+            install(job)
+        except Exception as e:
+            print(f"{failure}: {e}")
+        if then is not None:
+            then(job)
+    
+    def on_history_loaded(self, warmup):
+        if not warmup.cancelled:
+            self.history_view.reload()
+            self.request_refresh()
+            self.start_backfill()
+            self.start_plate_index()
+            self.start_forecast()
+        if self.timing:
+            print(f"History loaded in {(time.perf_counter() - self.started) * 1000:.0f} ms "
+                  f"({len(self.engine.history)} sessions)")
+    
+    def start_backfill(self):
+        # Occupancy before this run is rebuilt from the history in the background
+        if len(self.engine.history):
+            self.run_job("backfill", OccupancyBackfill(self.engine), lambda job: job.install(self.engine),
+                         "Error rebuilding occupancy", lambda job: self.update_analytics())
+    
+    def start_plate_index(self):
+        # Historical plates are indexed for search in the background
+        if len(self.engine.history):
+            self.run_job("plates", PlateIndexBuild(self.engine), lambda job: job.install(self.engine),
+                         "Error indexing plates")
+    
+    def start_forecast(self):
+        # Arrival and stay profiles are learned from the history in the background
+        if len(self.engine.history):
+            self.run_job("forecast", ForecastBuild(self.engine, self.forecast),
+                         lambda job: job.install(self.forecast), "Error learning the forecast",
+                         lambda job: self.request_refresh())
+    
+    def start_archive(self):
+        # Sessions past the retention period move to the archive in the
+        # background, once the whole history is loaded and indexed
+        if self.jobs:
+            self.root.after(WARMUP_POLL_MS, self.start_archive)
+            return
+        job = ArchiveJob(self.engine, retention_cutoff(self.retention_days, self.engine.now()))
+        if not job.count:
+            self.root.after(ARCHIVE_INTERVAL * 1000, self.start_archive)
+            return
+        self.run_job("archive", job, self.install_archive, "Error archiving history",
+                     lambda job: self.root.after(ARCHIVE_INTERVAL * 1000, self.start_archive))
+    
+    def install_archive(self, job):
+        if job.install(self.engine, self.writer):
+            self.history_view.reload()
+    
+    def on_first_frame(self, event):
+        if event.widget is self.root:
+            self.root.unbind("<Map>")
+            if self.timing:
+                print(f"Time to first frame: {(time.perf_counter() - self.started) * 1000:.0f} ms")
+    
+    def start_server(self, host, port):
+        # Serve gate terminals from this window. The HTTP loop runs on its own
+        # thread; engine calls are queued to the Tk thread, which applies
+        # everything that arrived since the last poll as one batch. The gates
+        # are answered once the writer thread has made the batch durable.
+        self.gate_requests = queue.Queue()
+        service = ParkingService(self.engine, dispatch=self.dispatch_gate_request, forecast=self.forecast)
+        server = ParkingServer(service, self.metrics)
+        threading.Thread(target=lambda: asyncio.run(server.serve(host, port)),
+                         name="gate-server", daemon=True).start()
+        self.root.after(GATE_POLL_MS, self.process_gate_requests)
+    
+    async def dispatch_gate_request(self, fn, *args):
+        # Runs on the server thread
+        future = asyncio.get_running_loop().create_future()
+        self.gate_requests.put((fn, args, future))
+        return await future
+    
+    def process_gate_requests(self):
+        done = []
+        # Everything that arrived since the last poll is stored as one batch
+        with self.engine.batch():
+            while True:
+                try:
+                    fn, args, future = self.gate_requests.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    done.append((future, fn(*args), None))
+                except Exception as e:
+                    done.append((future, None, e))
+        
+        if done:
+            self.writer.commit(self.engine, lambda saved_error: answer_gates(done, saved_error))
+        self.root.after(GATE_POLL_MS, self.process_gate_requests)
+    
+    def dump_metrics(self):
+        self.metrics.dump(self.metrics_file)
+        self.root.after(int(DUMP_INTERVAL * 1000), self.dump_metrics)
+    
+    def toggle_profiler(self, event=None):
+        if self.profiler.toggle():
+            self.root.title("Parking Management System Pro (profiling)")
+        else:
+            self.root.title("Parking Management System Pro")
+            print(f"Profile written to {self.profiler.path}", flush=True)
+    
+    def on_close(self):
+        # Nothing still waiting for its window is lost
+        self.writer.close(self.engine)
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.metrics_file:
+            self.metrics.dump(self.metrics_file)
+        self.root.destroy()
+
+def answer_gates(done, saved_error):
+    # Runs on the writer thread; a failed write fails every request in it
+    for future, result, error in done:
+        future.get_loop().call_soon_threadsafe(resolve_future, future, result, saved_error or error)
+
+def resolve_future(future, result, error):
+    # The gate may have hung up in the meantime
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
 
 def main():
+    parser = argparse.ArgumentParser(description="Parking Management System Pro")
+    parser.add_argument("--storage", choices=sorted(STORAGE_BACKENDS), default="json",
+                        help="persistence backend (default: json)")
+    parser.add_argument("--timing", action="store_true",
+                        help="print time to first frame and history load time")
+    parser.add_argument("--lot", metavar="CONFIG",
+                        help="lot layout file with levels, zones and bay sizes (default: 50 flat spots)")
+    parser.add_argument("--strategy", choices=sorted(ALLOCATION_STRATEGIES), default=DEFAULT_STRATEGY,
+                        help=f"spot allocation strategy (default: {DEFAULT_STRATEGY})")
+    parser.add_argument("--tariff", metavar="CONFIG",
+                        help="tariff file with tiers, peak windows, caps and grace period")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="also accept gate events over HTTP on this port")
+    parser.add_argument("--host", default="127.0.0.1", help="address for --serve")
+    parser.add_argument("--retention-days", type=int, metavar="DAYS",
+                        help="move sessions older than DAYS days to the compressed archive")
+    parser.add_argument("--archive-dir", metavar="DIR", help="archive location (default: parking_archive)")
+    parser.add_argument("--flush-ms", type=int, default=SAVE_WINDOW_MS,
+                        help=f"write changes at most this often, in ms (default: {SAVE_WINDOW_MS})")
+    parser.add_argument("--flush-batch", type=int, default=SAVE_BATCH,
+                        help=f"write early once this many events are waiting (default: {SAVE_BATCH})")
+    parser.add_argument("--metrics", action="store_true",
+                        help="time the hot paths (served on /metrics with --serve)")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help=f"write the metrics to PATH every {DUMP_INTERVAL:g} seconds")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="profile with cProfile, toggled with F12, stats written to FILE")
+    args = parser.parse_args()
+    
+    layout = LotLayout.load(args.lot) if args.lot else None
+    tariff = Tariff.load(args.tariff, DEFAULT_RATES) if args.tariff else None
+    engine = ParkingEngine(total_spots=50, layout=layout, strategy=args.strategy, tariff=tariff)
+    
+    metrics = Metrics() if args.metrics or args.metrics_file else None
+    profiler = Profiler(args.profile) if args.profile else None
+    
+    # Changes are group-committed, so the journal fsyncs once per write
+    options = {"sync_each_event": False} if args.storage == "journal" else {}
     root = tk.Tk()
-    app = ParkingManagementSystem(root)
+    app = ParkingManagementSystem(root, storage=create_storage(args.storage, **options), timing=args.timing,
+                                  engine=engine, metrics=metrics, metrics_file=args.metrics_file,
+                                  profiler=profiler, retention_days=args.retention_days,
+                                  archive_path=args.archive_dir, flush_ms=args.flush_ms,
+                                  flush_batch=args.flush_batch)
+    if args.serve:
+        app.start_server(args.host, args.serve)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()